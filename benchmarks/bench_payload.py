@@ -0,0 +1,81 @@
+"""
+bench_payload.py
+
+Micro-benchmark of the opentelemetry-c payload accessors. Reads every
+opentelemetry:* event of the ust traces folders found in a CTF traces folder
+and reports the payload throughput of each accessor.
+
+    python3 benchmarks/bench_payload.py -i path/to/ctf/traces
+"""
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import bt2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+# pylint: disable=wrong-import-position
+from ctf_payload import read_payload, read_payload_legacy  # noqa: E402
+
+PAYLOAD_FIELDS = {
+    "opentelemetry:resource_spans": "resource_spans",
+    "opentelemetry:resource_metrics": "resource_metrics",
+    "opentelemetry:resource_logs": "resource_logs",
+}
+
+
+def collect_payload_fields(ust_traces_folder: str) -> list:
+    """Decode a ust traces folder and keep its payload fields alive"""
+    fields = []
+    for msg in bt2.TraceCollectionMessageIterator(ust_traces_folder):
+        # pylint: disable=protected-access
+        if not isinstance(msg, bt2._EventMessageConst):
+            continue
+        field_name = PAYLOAD_FIELDS.get(msg.event.name)
+        if field_name is not None:
+            # Keep the message, it owns the field
+            fields.append((msg, msg.event[field_name]))
+    return fields
+
+
+def bench(accessor, fields, repeat: int) -> float:
+    """Return the best throughput of an accessor in bytes per second"""
+    best = float("inf")
+    n_bytes = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n_bytes = sum(len(accessor(field)) for _, field in fields)
+        best = min(best, time.perf_counter() - start)
+    return n_bytes / best if best else float("inf")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare the opentelemetry-c payload accessors")
+    parser.add_argument('-i', '--ctf-traces-folder-path',
+                        action='store',
+                        help='The path of folder where ctf traces',
+                        required=True,
+                        type=Path,
+                        dest='input_folder')
+    parser.add_argument('-r', '--repeat',
+                        action='store',
+                        help='The number of measurements per accessor',
+                        default=5,
+                        type=int,
+                        dest='repeat')
+    args = parser.parse_args()
+
+    payload_fields = []
+    for folder in args.input_folder.glob("**/ust"):
+        if folder.is_dir():
+            payload_fields.extend(collect_payload_fields(str(folder)))
+    if not payload_fields:
+        sys.exit("No opentelemetry-c events found")
+
+    total = sum(len(read_payload(field)) for _, field in payload_fields)
+    print(f"{len(payload_fields)} payloads, {total / 1e6:.2f} MB")
+    for name, payload_accessor in (("legacy", read_payload_legacy), ("native", read_payload)):
+        throughput = bench(payload_accessor, payload_fields, args.repeat)
+        print(f"{name:>8}: {throughput / 1e6:8.2f} MB/s")
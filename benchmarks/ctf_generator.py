@@ -0,0 +1,231 @@
+"""
+ctf_generator.py
+
+Generate synthetic opentelemetry-c CTF traces. Events are named and laid out
+like the ones of opentelemetry-c: opentelemetry:resource_{spans,metrics,logs}
+events holding a serialized OTLP resource in a sequence of uint8.
+
+    python3 benchmarks/ctf_generator.py -o /tmp/traces --folders 4 --events 10000 --payload-size 512
+"""
+import os
+import random
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import bt2
+from opentelemetry.proto.logs.v1.logs_pb2 import ResourceLogs
+from opentelemetry.proto.metrics.v1.metrics_pb2 import (
+    AGGREGATION_TEMPORALITY_CUMULATIVE, ResourceMetrics)
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
+
+SIGNALS = ("spans", "metrics", "logs")
+
+# Events per CTF packet
+EVENTS_PER_PACKET = 1000
+
+
+def _set_resource(resource, service_name: str) -> None:
+    attribute = resource.attributes.add()
+    attribute.key = "service.name"
+    attribute.value.string_value = service_name
+
+
+def make_resource_spans(rng: random.Random, payload_size: int, service_name: str) -> bytes:
+    """Serialized ResourceSpans holding one span, padded to about payload_size bytes"""
+    resource_spans = ResourceSpans()
+    _set_resource(resource_spans.resource, service_name)
+    scope_spans = resource_spans.scope_spans.add()
+    scope_spans.scope.name = "benchmark"
+    span = scope_spans.spans.add()
+    span.trace_id = rng.randbytes(16)
+    span.span_id = rng.randbytes(8)
+    span.name = "benchmark-span"
+    span.start_time_unix_nano = 1
+    span.end_time_unix_nano = 2
+    padding = payload_size - resource_spans.ByteSize()
+    if padding > 0:
+        attribute = span.attributes.add()
+        attribute.key = "padding"
+        attribute.value.string_value = "x" * padding
+    return resource_spans.SerializeToString()
+
+
+def make_resource_metrics(rng: random.Random, payload_size: int, service_name: str) -> bytes:
+    """Serialized ResourceMetrics holding one histogram, with enough data points
+    to reach about payload_size bytes"""
+    resource_metrics = ResourceMetrics()
+    _set_resource(resource_metrics.resource, service_name)
+    scope_metrics = resource_metrics.scope_metrics.add()
+    scope_metrics.scope.name = "benchmark"
+    metric = scope_metrics.metrics.add()
+    metric.name = "benchmark.histogram"
+    metric.histogram.aggregation_temporality = AGGREGATION_TEMPORALITY_CUMULATIVE
+    while True:
+        data_point = metric.histogram.data_points.add()
+        data_point.time_unix_nano = rng.getrandbits(62)
+        data_point.bucket_counts.extend(rng.randrange(100) for _ in range(11))
+        data_point.explicit_bounds.extend(float(bound) for bound in range(0, 100, 10))
+        data_point.count = sum(data_point.bucket_counts)
+        attribute = data_point.attributes.add()
+        attribute.key = "worker"
+        attribute.value.int_value = len(metric.histogram.data_points)
+        if resource_metrics.ByteSize() >= payload_size:
+            return resource_metrics.SerializeToString()
+
+
+def make_resource_logs(rng: random.Random, payload_size: int, service_name: str) -> bytes:
+    """Serialized ResourceLogs holding one log record, padded to about payload_size bytes"""
+    resource_logs = ResourceLogs()
+    _set_resource(resource_logs.resource, service_name)
+    scope_logs = resource_logs.scope_logs.add()
+    scope_logs.scope.name = "benchmark"
+    log_record = scope_logs.log_records.add()
+    log_record.trace_id = rng.randbytes(16)
+    log_record.time_unix_nano = 1
+    log_record.body.string_value = ""
+    padding = payload_size - resource_logs.ByteSize()
+    log_record.body.string_value = "x" * max(padding, 0)
+    return resource_logs.SerializeToString()
+
+
+PAYLOAD_FACTORIES = {
+    "spans": make_resource_spans,
+    "metrics": make_resource_metrics,
+    "logs": make_resource_logs,
+}
+
+
+class _OtelEventsIterator(bt2._UserMessageIterator):
+    """Emit the stream, packet and event messages of one synthetic stream"""
+
+    def __init__(self, config, self_output_port):
+        spec = self_output_port.user_data
+        self._messages = self._iter_messages(spec)
+
+    def _iter_messages(self, spec: Dict) -> Iterator:
+        stream = spec["stream"]
+        payloads: List = spec["payloads"]
+        timestamp = spec["start_timestamp"]
+
+        yield self._create_stream_beginning_message(stream)
+        for first in range(0, len(payloads), EVENTS_PER_PACKET):
+            packet = stream.create_packet()
+            yield self._create_packet_beginning_message(packet, timestamp)
+            for signal, payload in payloads[first:first + EVENTS_PER_PACKET]:
+                event_class, field_name = spec["event_classes"][signal]
+                msg = self._create_event_message(event_class, packet, timestamp)
+                msg.event.payload_field[f"_{field_name}_length"] = len(payload)
+                msg.event.payload_field[field_name] = payload
+                yield msg
+                timestamp += spec["interval_ns"]
+            yield self._create_packet_end_message(packet, timestamp)
+        yield self._create_stream_end_message(stream)
+
+    def __next__(self):
+        return next(self._messages)
+
+
+class _OtelEventsSource(bt2._UserSourceComponent,  # type: ignore[call-arg]
+                        message_iterator_class=_OtelEventsIterator):
+    """Source of synthetic opentelemetry-c events, configured by the obj argument"""
+
+    def __init__(self, config, params, obj):
+        trace_class = self._create_trace_class()
+        clock_class = self._create_clock_class(frequency=1_000_000_000, origin_is_unix_epoch=True)
+        stream_class = trace_class.create_stream_class(
+            default_clock_class=clock_class,
+            supports_packets=True,
+            packets_have_beginning_default_clock_snapshot=True,
+            packets_have_end_default_clock_snapshot=True,
+        )
+
+        event_classes = {}
+        for signal in SIGNALS:
+            field_name = f"resource_{signal}"
+            length_field_class = trace_class.create_unsigned_integer_field_class(field_value_range=64)
+            payload_field_class = trace_class.create_structure_field_class()
+            payload_field_class.append_member(f"_{field_name}_length", length_field_class)
+            payload_field_class.append_member(field_name, trace_class.create_dynamic_array_field_class(
+                trace_class.create_unsigned_integer_field_class(field_value_range=8),
+                length_fc=length_field_class))
+            event_class = stream_class.create_event_class(
+                name=f"opentelemetry:{field_name}", payload_field_class=payload_field_class)
+            event_classes[signal] = (event_class, field_name)
+
+        trace = trace_class()
+        self._add_output_port("out", {
+            "stream": trace.create_stream(stream_class),
+            "event_classes": event_classes,
+            "payloads": obj["payloads"],
+            "start_timestamp": obj["start_timestamp"],
+            "interval_ns": obj["interval_ns"],
+        })
+
+
+def write_ctf_trace(
+    output_folder: Path,
+    n_events: int,
+    payload_size: int,
+    signals=SIGNALS,
+    interval_ns: int = 1_000_000,
+    seed: int = 0,
+) -> int:
+    """Write one CTF trace of n_events opentelemetry-c events cycling over signals.
+    Return the total payload size in bytes."""
+    rng = random.Random(seed)
+    service_name = f"benchmark-{seed}"
+    payloads = []
+    for index in range(n_events):
+        signal = signals[index % len(signals)]
+        payload = PAYLOAD_FACTORIES[signal](rng, payload_size, service_name)
+        payloads.append((signal, list(payload)))
+
+    output_folder.mkdir(parents=True, exist_ok=True)
+    graph = bt2.Graph()
+    source = graph.add_component(_OtelEventsSource, "source", obj={
+        "payloads": payloads,
+        "start_timestamp": 1_600_000_000_000_000_000 + seed * interval_ns,
+        "interval_ns": interval_ns,
+    })
+    sink = graph.add_component(
+        bt2.find_plugin("ctf").sink_component_classes["fs"], "sink",
+        params={"path": str(output_folder), "assume-single-trace": True})
+    graph.connect_ports(source.output_ports["out"], sink.input_ports["in"])
+    graph.run()
+    return sum(len(payload) for _, payload in payloads)
+
+
+def write_ctf_traces_folder(
+    output_folder: Path,
+    n_folders: int,
+    n_events: int,
+    payload_size: int,
+    signals=SIGNALS,
+) -> int:
+    """Write n_folders sessions laid out like LTTng output, each one holding a
+    ust traces folder of n_events events. Return the total payload size."""
+    total = 0
+    for index in range(n_folders):
+        trace_folder = output_folder / f"session-{index}" / "ust" / "uid" / str(os.getuid()) / "64-bit"
+        total += write_ctf_trace(trace_folder, n_events, payload_size, signals, seed=index)
+    return total
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Generate synthetic opentelemetry-c CTF traces")
+    parser.add_argument('-o', '--output-folder', required=True, type=Path, dest='output_folder',
+                        help='The folder where the ust traces folders are written')
+    parser.add_argument('--folders', default=1, type=int, dest='n_folders',
+                        help='The number of ust traces folders')
+    parser.add_argument('--events', default=10000, type=int, dest='n_events',
+                        help='The number of events per ust traces folder')
+    parser.add_argument('--payload-size', default=512, type=int, dest='payload_size',
+                        help='The approximate size in bytes of each event payload')
+    parser.add_argument('--signals', default=list(SIGNALS), nargs='+', choices=SIGNALS, dest='signals',
+                        help='The kinds of telemetry data to generate, in turn')
+    args = parser.parse_args()
+
+    n_bytes = write_ctf_traces_folder(
+        args.output_folder, args.n_folders, args.n_events, args.payload_size, tuple(args.signals))
+    print(f"Wrote {args.n_folders * args.n_events} events, {n_bytes / 1e6:.2f} MB of payloads")
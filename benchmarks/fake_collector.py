@@ -0,0 +1,99 @@
+"""
+fake_collector.py
+
+In-process OTLP gRPC collector implementing the Trace, Metrics and Logs
+services. It only counts what it receives, so that the replayer can be
+benchmarked without the docker-compose stack.
+"""
+import threading
+import time
+from concurrent import futures
+from typing import Dict
+
+import grpc
+from opentelemetry.proto.collector.logs.v1 import (logs_service_pb2,
+                                                   logs_service_pb2_grpc)
+from opentelemetry.proto.collector.metrics.v1 import (metrics_service_pb2,
+                                                      metrics_service_pb2_grpc)
+from opentelemetry.proto.collector.trace.v1 import (trace_service_pb2,
+                                                    trace_service_pb2_grpc)
+
+# Leave room for the oversized requests the replayer could send
+MAX_MESSAGE_LENGTH = 64 * 1024 * 1024
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.resources = 0
+        self.bytes = 0
+
+    def add(self, n_resources: int, n_bytes: int) -> None:
+        with self._lock:
+            self.requests += 1
+            self.resources += n_resources
+            self.bytes += n_bytes
+
+
+class FakeCollector:
+    """OTLP gRPC server counting the requests, resources and bytes it receives
+    Args:
+        latency_millis: Time spent handling each request, to emulate a remote collector
+        max_workers: Number of server threads
+    """
+
+    def __init__(self, latency_millis: float = 0.0, max_workers: int = 16):
+        self._latency = latency_millis / 1e3
+        self.counters: Dict[str, _Counters] = {
+            "traces": _Counters(), "metrics": _Counters(), "logs": _Counters()}
+        self._server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=max_workers),
+            options=[("grpc.max_receive_message_length", MAX_MESSAGE_LENGTH)])
+
+        collector = self
+
+        class TraceService(trace_service_pb2_grpc.TraceServiceServicer):
+            def Export(self, request, context):  # pylint: disable=invalid-name
+                collector._handle("traces", len(request.resource_spans), request.ByteSize())
+                return trace_service_pb2.ExportTraceServiceResponse()
+
+        class MetricsService(metrics_service_pb2_grpc.MetricsServiceServicer):
+            def Export(self, request, context):  # pylint: disable=invalid-name
+                collector._handle("metrics", len(request.resource_metrics), request.ByteSize())
+                return metrics_service_pb2.ExportMetricsServiceResponse()
+
+        class LogsService(logs_service_pb2_grpc.LogsServiceServicer):
+            def Export(self, request, context):  # pylint: disable=invalid-name
+                collector._handle("logs", len(request.resource_logs), request.ByteSize())
+                return logs_service_pb2.ExportLogsServiceResponse()
+
+        trace_service_pb2_grpc.add_TraceServiceServicer_to_server(TraceService(), self._server)
+        metrics_service_pb2_grpc.add_MetricsServiceServicer_to_server(MetricsService(), self._server)
+        logs_service_pb2_grpc.add_LogsServiceServicer_to_server(LogsService(), self._server)
+        self.port = self._server.add_insecure_port("127.0.0.1:0")
+
+    def _handle(self, signal: str, n_resources: int, n_bytes: int) -> None:
+        if self._latency:
+            time.sleep(self._latency)
+        self.counters[signal].add(n_resources, n_bytes)
+
+    @property
+    def endpoint(self) -> str:
+        """Endpoint to pass to the replayer"""
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> None:
+        """Start serving requests"""
+        self._server.start()
+
+    def stop(self) -> None:
+        """Stop serving requests"""
+        self._server.stop(grace=None)
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        """Requests, resources and bytes received for each signal"""
+        return {
+            signal: {"requests": counters.requests, "resources": counters.resources, "bytes": counters.bytes}
+            for signal, counters in self.counters.items()
+        }
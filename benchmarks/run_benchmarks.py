@@ -0,0 +1,129 @@
+"""
+run_benchmarks.py
+
+Reproducible benchmarks of the replayer. Each scenario generates synthetic
+opentelemetry-c CTF traces (cached in the work folder), starts an in-process
+fake OTLP collector and runs src/replayer.py against it. The report gives the
+throughput, peak RSS, CPU time and the time spent in each replay stage.
+
+    python3 benchmarks/run_benchmarks.py --scenario small-spans many-folders -- --jobs 4
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import REMAINDER, ArgumentParser
+from pathlib import Path
+from typing import Any, Dict, List
+
+from ctf_generator import SIGNALS, write_ctf_traces_folder
+from fake_collector import FakeCollector
+
+REPLAYER = Path(__file__).resolve().parent.parent / "src" / "replayer.py"
+
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "small-spans": {"n_folders": 1, "n_events": 100_000, "payload_size": 200, "signals": ("spans",)},
+    "huge-metrics": {"n_folders": 1, "n_events": 100, "payload_size": 1_000_000, "signals": ("metrics",)},
+    "many-folders": {"n_folders": 50, "n_events": 2_000, "payload_size": 500, "signals": SIGNALS},
+}
+
+
+def prepare_traces(work_folder: Path, name: str, scale: float) -> Dict:
+    """Generate the traces of a scenario unless they are already cached"""
+    scenario = dict(SCENARIOS[name])
+    scenario["n_events"] = max(1, int(scenario["n_events"] * scale))
+    traces_folder = work_folder / f"{name}-x{scale:g}"
+    description_path = traces_folder / "scenario.json"
+    if description_path.exists():
+        with open(description_path, "r", encoding="utf-8") as description_file:
+            return json.load(description_file)
+
+    print(f"Generating the traces of {name} ...", file=sys.stderr)
+    payload_bytes = write_ctf_traces_folder(
+        traces_folder, scenario["n_folders"], scenario["n_events"],
+        scenario["payload_size"], scenario["signals"])
+    description = {
+        "traces_folder": str(traces_folder),
+        "n_events": scenario["n_folders"] * scenario["n_events"],
+        "payload_bytes": payload_bytes,
+    }
+    with open(description_path, "w", encoding="utf-8") as description_file:
+        json.dump(description, description_file)
+    return description
+
+
+def run_scenario(description: Dict, replayer_args: List[str], latency_millis: float) -> Dict:
+    """Replay the traces of a scenario against a fake collector"""
+    collector = FakeCollector(latency_millis=latency_millis)
+    collector.start()
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        stats_path = Path(temporary_folder) / "stats.json"
+        command = [
+            sys.executable, str(REPLAYER),
+            "-i", description["traces_folder"],
+            "-e", collector.endpoint,
+            "--progress", "none",
+            "--stats-json", str(stats_path),
+            *replayer_args,
+        ]
+        start = time.perf_counter()
+        process = subprocess.Popen(command)  # pylint: disable=consider-using-with
+        # wait4 gives the resource usage of this replayer only
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        elapsed = time.perf_counter() - start
+        collector.stop()
+
+        stats = {}
+        if stats_path.exists():
+            with open(stats_path, "r", encoding="utf-8") as stats_file:
+                stats = json.load(stats_file)
+
+    return {
+        "exit_code": process.returncode,
+        "elapsed_seconds": elapsed,
+        "events_per_second": description["n_events"] / elapsed,
+        "payload_mb_per_second": description["payload_bytes"] / 1e6 / elapsed,
+        "peak_rss_mb": rusage.ru_maxrss / 1024,
+        "cpu_user_seconds": rusage.ru_utime,
+        "cpu_system_seconds": rusage.ru_stime,
+        "stage_seconds": stats.get("stage_seconds", {}),
+        "collector": collector.summary(),
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the replayer against a fake OTLP collector")
+    parser.add_argument('--scenario', default=list(SCENARIOS), nargs='+', choices=SCENARIOS, dest='scenarios',
+                        help='The scenarios to run')
+    parser.add_argument('--scale', default=1.0, type=float, dest='scale',
+                        help='Multiply the number of events of each scenario')
+    parser.add_argument('--work-folder', default=Path(tempfile.gettempdir()) / "otel-replayer-benchmarks",
+                        type=Path, dest='work_folder',
+                        help='The folder where generated traces are cached')
+    parser.add_argument('--latency-millis', default=0.0, type=float, dest='latency_millis',
+                        help='The time spent by the fake collector on each request')
+    parser.add_argument('--output', default=None, type=Path, dest='output',
+                        help='Write the report to this JSON file')
+    parser.add_argument('replayer_args', nargs=REMAINDER,
+                        help='Arguments passed to the replayer, after --')
+    args = parser.parse_args()
+    extra_args = [arg for arg in args.replayer_args if arg != "--"]
+
+    report = {}
+    for scenario_name in args.scenarios:
+        scenario_description = prepare_traces(args.work_folder, scenario_name, args.scale)
+        result = run_scenario(scenario_description, extra_args, args.latency_millis)
+        report[scenario_name] = result
+        print(f"{scenario_name:>14}: {result['events_per_second']:10.0f} events/s "
+              f"{result['payload_mb_per_second']:8.2f} MB/s "
+              f"{result['peak_rss_mb']:8.1f} MB RSS "
+              f"{result['cpu_user_seconds'] + result['cpu_system_seconds']:7.2f} s CPU")
+        for stage, seconds in sorted(result["stage_seconds"].items()):
+            print(f"{'':>16}{stage}: {seconds:.2f} s")
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=2)
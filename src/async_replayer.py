@@ -0,0 +1,687 @@
+"""
+async_replayer.py
+
+Replay the telemetry data of opentelemetry-c CTF traces from an asyncio
+application.
+
+A Replayer reads sources, ust traces folders or LTTng live sessions, each one
+decoded by bt2 in its own thread. Each thread filters, samples and paces the
+telemetry data of its source, passes them through the stages of the source,
+records its checkpoints and fills the payload cache. The telemetry data are
+streamed to the event loop in chunks, and can either be iterated over, or
+batched and exported to sinks. The default sink exports through grpc.aio
+channels, which keep many requests in flight from the event loop alone.
+
+A checkpoint is saved by the event loop once the telemetry data read before
+it are exported, so that its position never passes a batch still in flight
+or being retried.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import (Any, AsyncIterator, Callable, Dict, Generator, Iterable,
+                    List, Optional, Sequence, Set, Tuple, Union)
+
+import bt2
+from google.protobuf.message import DecodeError, Message
+
+from checkpoint import (DEFAULT_CHECKPOINT_INTERVAL, FolderCheckpoint,
+                        ReplayPosition, ResumeFilter)
+from ctf_payload import OTEL_EVENTS, decode_payload, read_payload
+from event_filter import SIGNAL_EVENTS, EventFilter
+from export_engine import DEFAULT_MAX_CONCURRENT_EXPORTS
+from follow import (DEFAULT_FOLLOW_POLL_INTERVAL, Follower, is_lttng_live_url,
+                    open_traces)
+from otlp_raw import repeated_field_size
+from otlp_split import DEFAULT_MAX_EXPORT_REQUEST_BYTES
+from pacer import Pacer
+from payload_cache import (CachedFolder, PayloadCache, PayloadCacheWriter,
+                           folder_key)
+from progress import FolderProgress
+from replay_sinks import OTLPSink, ReplaySink
+from replay_stages import ReplayStage, StageOutput
+from replay_stats import ReplayStats
+
+DEFAULT_MAX_EXPORT_BATCH_BYTES = DEFAULT_MAX_EXPORT_REQUEST_BYTES
+DEFAULT_MAX_EXPORT_BATCH_SIZE = 512
+DEFAULT_SCHEDULE_DELAY_MILLIS = 5000
+# Number of telemetry data handed over from a reader thread to the event loop at once
+DEFAULT_CHUNK_SIZE = 256
+# Number of chunks read ahead of the consumer, for each source
+DEFAULT_MAX_PENDING_CHUNKS = 8
+DEFAULT_MAX_CONCURRENT_SOURCES = 4
+
+_EVENT_SIGNALS = {event_name: signal for signal, event_name in SIGNAL_EVENTS.items()}
+
+
+class _SourceStopped(Exception):
+    """Raised in a source thread once the telemetry data are no longer consumed"""
+
+
+class _CheckpointMark:
+    """Position of a source to save in its checkpoint, once the telemetry data read before it are exported"""
+
+    def __init__(self, source: int, ust_traces_folder: str, checkpoint: FolderCheckpoint,
+                 position: ReplayPosition, n_tel_data: int, done: bool):
+        self.source = source
+        self.ust_traces_folder = ust_traces_folder
+        self.checkpoint = checkpoint
+        self.timestamp = position.timestamp
+        self.n_at_timestamp = position.n_at_timestamp
+        self.n_tel_data = n_tel_data
+        self.done = done
+
+
+class _Chunk:
+    """Telemetry data read by a source thread, with the counters of the events read for them"""
+
+    def __init__(self, source: int):
+        self.source = source
+        # Signal, telemetry data, size and number of replayed telemetry data accounted for
+        self.items: List[Tuple[str, Any, int, int]] = []
+        self.n_events = 0
+        # Telemetry data found, and exported by the previous runs of a resumed source
+        self.n_tel_data = 0
+        self.n_exported_before = 0
+        self.n_payload_bytes = 0
+        self.n_decoded = 0
+        self.n_filtered = 0
+        self.n_parse_errors = 0
+        self.total = 0.0
+        self.progress = 0.0
+        # Export the pending batches once the chunk is batched, before the source waits
+        self.submit = False
+        self.checkpoint: Optional[_CheckpointMark] = None
+
+    def is_empty(self) -> bool:
+        return not (self.items or self.n_events or self.n_tel_data or self.n_exported_before or self.total
+                    or self.progress or self.submit or self.checkpoint is not None)
+
+
+class _SourceState:
+    """Chunk being filled by the thread reading a source
+    Args:
+        source: Index of the source
+        push: Hands a chunk over to the event loop
+        stopped: Set once the telemetry data are no longer consumed
+    """
+
+    def __init__(self, source: int, push: Callable[[_Chunk], None], stopped: threading.Event):
+        self._source = source
+        self._push = push
+        self._stopped = stopped
+        self.chunk = _Chunk(source)
+
+    def flush(self, submit: bool = False) -> None:
+        """Hand the chunk over to the event loop, and have the pending batches exported if submit is set"""
+        if self._stopped.is_set():
+            raise _SourceStopped()
+        self.chunk.submit = self.chunk.submit or submit
+        if not self.chunk.is_empty():
+            chunk, self.chunk = self.chunk, _Chunk(self._source)
+            self._push(chunk)
+
+    def add(self, signal: str, outputs: List[StageOutput]) -> None:
+        self.chunk.items.extend((signal, item, size, n_items) for item, size, n_items in outputs)
+
+
+class _Batch:
+    def __init__(self):
+        self.items: List = []
+        self.n_bytes = 0
+        self.n_items = 0
+        # Number of replayed telemetry data of each source
+        self.sources: Dict[int, int] = defaultdict(int)
+        self.start_time = time.monotonic()
+
+
+class Replayer:
+    """Replay the telemetry data recorded by opentelemetry-c in CTF traces
+    Args:
+        sources: ust traces folders or LTTng live session URLs. They are iterated
+            as they are replayed, so that a folder discovery can go on meanwhile.
+        sinks: Destinations of the telemetry data, an OTLPSink to the default collector if empty
+        event_filter: Selection of the telemetry data to replay
+        pass_through: Hand the serialized telemetry data to the sinks without decoding them
+        validate_payloads: In pass-through mode, check the framing of the serialized telemetry data
+        follow: Keep reading the sources while they are written. LTTng live sessions are always followed.
+        follow_poll_interval: Time in seconds between two checks for new data when following
+        follow_idle_timeout: Stop following a source after this many seconds without new events
+        stop_following: Checked while following, the sources stop being followed once it returns True
+        max_export_batch_size: Maximum number of telemetry data in a batch
+        max_export_batch_bytes: Maximum serialized size of a batch
+        schedule_delay_millis: Maximum time telemetry data wait before being exported
+        max_concurrent_exports: Maximum number of batches being handed over to the sinks at once
+        max_concurrent_sources: Maximum number of sources read at once. Followed sources are all read at once.
+        prepare: Transforms a batch right before it is exported, for instance coalesce
+        stages: Create the stages of a source, at most one per signal
+        pacer: Sends the telemetry data at the pace of their CTF timestamps
+        checkpoint_dir: Folder of the checkpoints saved for each ust traces folder
+        checkpoint_interval: Time in seconds between two checkpoints of a source
+        resume: Resume the sources from their checkpoint, skipping the ones already replayed
+        payload_cache: Cache of the payloads of the ust traces folders, not used for followed sources
+        progress_mode: "time", "exact" or "none", see FolderProgress
+        pbar: Progress bar updated from the event loop, ProgressBar or RemoteProgressBar
+        shutdown_timeout: Maximum time in seconds waited for the batches being retried
+            before saving the last checkpoint of a source
+        time_stages: Account the time spent decoding and parsing in the statistics
+        stats_interval: Log a statistics line every this many seconds
+        stats: Statistics of the replay, created if not set
+    """
+
+    def __init__(
+        self,
+        sources: Iterable[str],
+        sinks: Sequence[ReplaySink] = (),
+        event_filter: Optional[EventFilter] = None,
+        pass_through: bool = False,
+        validate_payloads: bool = True,
+        follow: bool = False,
+        follow_poll_interval: float = DEFAULT_FOLLOW_POLL_INTERVAL,
+        follow_idle_timeout: Optional[float] = None,
+        stop_following: Optional[Callable[[], bool]] = None,
+        max_export_batch_size: int = DEFAULT_MAX_EXPORT_BATCH_SIZE,
+        max_export_batch_bytes: int = DEFAULT_MAX_EXPORT_BATCH_BYTES,
+        schedule_delay_millis: float = DEFAULT_SCHEDULE_DELAY_MILLIS,
+        max_concurrent_exports: int = DEFAULT_MAX_CONCURRENT_EXPORTS,
+        max_concurrent_sources: int = DEFAULT_MAX_CONCURRENT_SOURCES,
+        prepare: Optional[Callable[[List], List]] = None,
+        stages: Sequence[Callable[[], ReplayStage]] = (),
+        pacer: Optional[Pacer] = None,
+        checkpoint_dir: Optional[Path] = None,
+        checkpoint_interval: float = DEFAULT_CHECKPOINT_INTERVAL,
+        resume: bool = False,
+        payload_cache: Optional[PayloadCache] = None,
+        progress_mode: str = "none",
+        pbar=None,
+        shutdown_timeout: Optional[float] = None,
+        time_stages: bool = False,
+        stats_interval: Optional[float] = None,
+        stats: Optional[ReplayStats] = None,
+    ):
+        self._sources = sources
+        self._sinks = list(sinks) or [OTLPSink()]
+        self._event_filter = event_filter or EventFilter()
+        self._pass_through = pass_through
+        self._validate_payloads = validate_payloads
+        self._follow = follow
+        self._follow_poll_interval = follow_poll_interval
+        self._follow_idle_timeout = follow_idle_timeout
+        self._stop_following = stop_following
+        self._max_export_batch_size = max(1, max_export_batch_size)
+        self._max_export_batch_bytes = max_export_batch_bytes
+        self._schedule_delay = schedule_delay_millis / 1e3
+        self._max_concurrent_exports = max(1, max_concurrent_exports)
+        self._max_concurrent_sources = max(1, max_concurrent_sources)
+        self._prepare = prepare
+        self._stages = list(stages)
+        self._pacer = pacer
+        self._checkpoint_dir = checkpoint_dir
+        self._checkpoint_interval = checkpoint_interval
+        self._resume = resume
+        self._payload_cache = payload_cache
+        self._progress_mode = progress_mode
+        self._pbar = pbar
+        self._shutdown_timeout = shutdown_timeout
+        self._time_stages = time_stages
+        self._stats_interval = stats_interval
+        self.stats = stats if stats is not None else ReplayStats()
+        # Telemetry data found and exported, including by the previous runs of resumed sources
+        self.n_tel_data = 0
+        self.n_tel_data_exported = 0
+
+    def _iter_ctf_events(self, state: _SourceState, source: str, begin: Optional[float], end: Optional[float],
+                         folder_progress: Optional[FolderProgress], need_timestamp: bool, select_events: bool,
+                         on_idle: Callable[[], None]) -> Generator[Tuple[str, int, Optional[bytes]], None, None]:
+        """Decode a source between begin and end, yield the name, timestamp and
+        payload of its opentelemetry-c events. The payload of unknown events is None.
+        If select_events is set, only the events selected by the event filter are yielded."""
+        event_filter = self._event_filter
+        stats = self.stats if self._time_stages else None
+        # Seek to the checkpoint instead of decoding and discarding the events before it
+        messages: Iterable
+        if self._follow or is_lttng_live_url(source):
+            messages = Follower(source, begin, self._follow_poll_interval, self._follow_idle_timeout,
+                                on_idle=on_idle, end=end, stop=self._stop_following)
+        else:
+            messages = open_traces(source, begin, end)
+        if stats is not None:
+            messages = stats.timed(messages, "decode")
+
+        for msg in messages:
+            if folder_progress is not None:
+                state.chunk.progress += folder_progress.advance(msg)
+            # pylint: disable=protected-access
+            if not isinstance(msg, bt2._EventMessageConst):
+                continue
+            # An event message holds a trace event.
+            state.chunk.n_events += 1
+            ev = msg.event
+            if select_events:
+                # Other events are skipped without reading their name
+                if not event_filter.accepts_event(ev):
+                    continue
+            elif not ev.name.startswith("opentelemetry:"):
+                continue
+            name = ev.name
+            timestamp = msg.default_clock_snapshot.ns_from_origin if need_timestamp else 0
+
+            otel_event = OTEL_EVENTS.get(name)
+            if otel_event is None:
+                yield name, timestamp, None
+                continue
+            if stats is None:
+                yield name, timestamp, read_payload(ev[otel_event[0]])
+            else:
+                start = time.perf_counter()
+                payload = read_payload(ev[otel_event[0]])
+                stats.stage_seconds["payload"] += time.perf_counter() - start
+                yield name, timestamp, payload
+
+    def _iter_cached_events(self, state: _SourceState, cached_folder: CachedFolder,
+                            folder_progress: Optional[FolderProgress]
+                            ) -> Generator[Tuple[str, int, Optional[bytes]], None, None]:
+        """Yield the name, timestamp and payload of the opentelemetry-c events of a cached folder"""
+        events: Iterable[Tuple[str, int, bytes]] = cached_folder
+        if self._time_stages:
+            events = self.stats.timed(events, "cache")
+
+        for name, timestamp, payload in events:
+            if folder_progress is not None:
+                state.chunk.progress += folder_progress.advance_event(timestamp)
+            state.chunk.n_events += 1
+            yield name, timestamp, payload if name in OTEL_EVENTS else None
+
+    def _decode(self, state: _SourceState, name: str, payload: bytes):
+        """Filter, decode and sample the payload of an opentelemetry-c event.
+        Return None if it is filtered out or invalid."""
+        chunk = state.chunk
+        event_filter = self._event_filter
+        message_type = OTEL_EVENTS[name][1]
+        chunk.n_payload_bytes += len(payload)
+        try:
+            if not event_filter.accepts_payload(payload):
+                chunk.n_filtered += 1
+                return None
+            if self._time_stages:
+                start = time.perf_counter()
+                item = decode_payload(payload, message_type, self._pass_through, self._validate_payloads)
+                self.stats.stage_seconds["parse"] += time.perf_counter() - start
+            else:
+                item = decode_payload(payload, message_type, self._pass_through, self._validate_payloads)
+            if item is not None:
+                sampled = event_filter.sample_item(item, message_type)
+                if sampled is None:
+                    chunk.n_filtered += 1
+                    return None
+                item = sampled
+        except DecodeError:
+            # The filter parses payloads that are not decoded in pass-through mode
+            item = None
+        if item is None:
+            chunk.n_parse_errors += 1
+            logging.error("Unable to parse one %s event", name)
+        return item
+
+    def _read_source(self, index: int, source: str, push: Callable[[_Chunk], None],
+                     stopped: threading.Event) -> None:
+        """Read the telemetry data of a source and push them in chunks, until stopped is set"""
+        state = _SourceState(index, push, stopped)
+        stages = {stage.signal: stage for stage in (create_stage() for create_stage in self._stages)}
+        follow = self._follow or is_lttng_live_url(source)
+
+        def flush_stages() -> None:
+            for signal, stage in stages.items():
+                state.add(signal, stage.flush())
+
+        def on_idle() -> None:
+            # Nothing new to read, hand over what waited for too long in the stages
+            for signal, stage in stages.items():
+                state.add(signal, stage.flush_expired())
+            state.flush()
+
+        def submit_paced() -> None:
+            # Export the telemetry data due so far before waiting for the next ones
+            state.flush(submit=True)
+
+        checkpoint: Optional[FolderCheckpoint] = None
+        resume_filter: Optional[ResumeFilter] = None
+        n_tel_data = 0
+        if self._checkpoint_dir is not None:
+            checkpoint = FolderCheckpoint(self._checkpoint_dir, source)
+            if self._resume and checkpoint.load():
+                n_tel_data = checkpoint.n_tel_data
+                state.chunk.n_tel_data = checkpoint.n_tel_data
+                state.chunk.n_exported_before = checkpoint.n_tel_data_exported
+                if checkpoint.done:
+                    logging.info("Skipping %s, already replayed", source)
+                    state.flush()
+                    return
+                logging.info("Resuming %s after %d telemetry data", source, checkpoint.n_tel_data)
+                resume_filter = ResumeFilter(checkpoint)
+        # Position of the telemetry data handed over, saved by the event loop
+        position = ReplayPosition()
+        if checkpoint is not None:
+            position.timestamp = checkpoint.timestamp
+            position.n_at_timestamp = checkpoint.n_at_timestamp
+
+        # Read the payloads from the cache, or record them while decoding the folder
+        cached_folder: Optional[CachedFolder] = None
+        cache_writer: Optional[PayloadCacheWriter] = None
+        # A followed folder is still growing, its payloads are not cached
+        if self._payload_cache is not None and not follow:
+            cache_key = folder_key(source)
+            cached_folder = self._payload_cache.open(cache_key)
+            if cached_folder is None and resume_filter is None:
+                cache_writer = self._payload_cache.writer(cache_key)
+
+        folder_progress: Optional[FolderProgress] = None
+        if self._progress_mode != "none":
+            if cached_folder is not None:
+                folder_progress = FolderProgress(source, self._progress_mode,
+                                                 cached_folder.time_range, cached_folder.n_records)
+            else:
+                folder_progress = FolderProgress(source, self._progress_mode)
+            state.chunk.total += folder_progress.total
+
+        event_filter = self._event_filter
+        filter_time = event_filter.begin is not None or event_filter.end is not None
+        need_timestamp = (checkpoint is not None or self._pacer is not None or cache_writer is not None
+                          or bool(stages) or filter_time)
+        last_checkpoint_time = time.monotonic()
+
+        events: Generator[Tuple[str, int, Optional[bytes]], None, None]
+        if cached_folder is not None:
+            events = self._iter_cached_events(state, cached_folder, folder_progress)
+        else:
+            # The cache records all the events, they are filtered afterwards
+            resume_begin = checkpoint.begin_seconds() if checkpoint is not None and resume_filter else None
+            if cache_writer is None:
+                events = self._iter_ctf_events(
+                    state, source, event_filter.trimmer_begin(resume_begin), event_filter.end,
+                    folder_progress, need_timestamp, True, on_idle)
+            else:
+                events = self._iter_ctf_events(
+                    state, source, resume_begin, None, folder_progress, need_timestamp, False, on_idle)
+
+        try:
+            for name, timestamp, payload in events:
+                if cache_writer is not None:
+                    cache_writer.add(name, timestamp, payload or b"")
+                if not event_filter.accepts_name(name):
+                    continue
+                if filter_time and not event_filter.accepts_timestamp(timestamp):
+                    continue
+                if resume_filter is not None and resume_filter.is_replayed(timestamp):
+                    continue
+                n_tel_data += 1
+                state.chunk.n_tel_data += 1
+                item = None if payload is None else self._decode(state, name, payload)
+                if payload is not None and item is not None:
+                    state.chunk.n_decoded += 1
+                    if self._pacer is not None:
+                        self._pacer.wait(timestamp, on_wait=submit_paced)
+                    signal = _EVENT_SIGNALS[name]
+                    stage = stages.get(signal)
+                    if stage is None:
+                        state.chunk.items.append((signal, item, len(payload), 1))
+                    else:
+                        state.add(signal, stage.add(item, len(payload), timestamp))
+
+                # The position only covers the telemetry data handed over to the event loop
+                if checkpoint is not None:
+                    position.advance(timestamp)
+                    if time.monotonic() - last_checkpoint_time >= self._checkpoint_interval:
+                        flush_stages()
+                        state.chunk.checkpoint = _CheckpointMark(index, source, checkpoint, position,
+                                                                 n_tel_data, False)
+                        state.flush()
+                        last_checkpoint_time = time.monotonic()
+                if len(state.chunk.items) >= DEFAULT_CHUNK_SIZE:
+                    state.flush()
+        except BaseException:
+            if cache_writer is not None:
+                cache_writer.abort()
+            raise
+        finally:
+            events.close()
+            if cached_folder is not None:
+                cached_folder.close()
+        if cache_writer is not None:
+            cache_writer.commit()
+
+        flush_stages()
+        for stage in stages.values():
+            stage.report()
+        if folder_progress is not None:
+            state.chunk.progress += folder_progress.finish()
+        if checkpoint is not None:
+            state.chunk.checkpoint = _CheckpointMark(index, source, checkpoint, position, n_tel_data, True)
+        state.flush()
+
+    async def _chunks(self) -> AsyncIterator[_Chunk]:
+        """Read the sources in threads, yield their chunks as they are read"""
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        sources: Iterable[str]
+        if self._follow:
+            sources = [str(source) for source in self._sources]
+            n_readers = len(sources)
+        else:
+            sources = (str(source) for source in self._sources)
+            n_readers = self._max_concurrent_sources
+        next_sources = enumerate(sources)
+        # Bound the chunks read ahead, so that slow sinks slow the sources down
+        pending_chunks = threading.BoundedSemaphore(DEFAULT_MAX_PENDING_CHUNKS * max(1, n_readers))
+        stopped = threading.Event()
+
+        def push(chunk: _Chunk) -> None:
+            while not pending_chunks.acquire(timeout=0.1):
+                if stopped.is_set():
+                    raise _SourceStopped()
+            if stopped.is_set():
+                raise _SourceStopped()
+            loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+
+        def read_source(index: int, source: str) -> None:
+            # The end of a source is marked by None, or by the exception raised reading it
+            end = None
+            try:
+                self._read_source(index, source, push, stopped)
+            except _SourceStopped:
+                pass
+            except BaseException as error:  # pylint: disable=broad-except
+                end = error
+            if stopped.is_set():
+                return
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, end)
+            except RuntimeError:
+                # The event loop is closed
+                pass
+
+        executor = ThreadPoolExecutor(max_workers=max(1, n_readers), thread_name_prefix="source")
+
+        async def start_next_source() -> bool:
+            # The sources can be discovered as they are iterated
+            next_source = await asyncio.to_thread(next, next_sources, None)
+            if next_source is None:
+                return False
+            executor.submit(read_source, *next_source)
+            return True
+
+        stats = self.stats
+        pbar = self._pbar
+        try:
+            n_running = 0
+            while n_running < n_readers and await start_next_source():
+                n_running += 1
+            while n_running:
+                chunk = await chunks.get()
+                if chunk is None:
+                    n_running -= 1
+                    if await start_next_source():
+                        n_running += 1
+                    continue
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                pending_chunks.release()
+                self.n_tel_data += chunk.n_tel_data
+                stats.counters["events"] += chunk.n_events
+                stats.counters["payload_bytes"] += chunk.n_payload_bytes
+                stats.counters["telemetry_data"] += chunk.n_decoded
+                stats.counters["filtered"] += chunk.n_filtered
+                stats.counters["parse_errors"] += chunk.n_parse_errors
+                if self._stats_interval is not None:
+                    stats.log_periodically(self._stats_interval)
+                if pbar is not None:
+                    if chunk.total:
+                        pbar.add_total(chunk.total)
+                    if chunk.progress:
+                        pbar.update(chunk.progress)
+                yield chunk
+        finally:
+            stopped.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def items(self) -> AsyncIterator[Tuple[str, Union[bytes, Message]]]:
+        """Iterate over the telemetry data of all the sources, as they are read.
+        Yield the signal, "traces", "metrics" or "logs", and the ResourceSpans,
+        ResourceMetrics or ResourceLogs, serialized in pass-through mode.
+        Checkpoints are only saved by run, once the telemetry data are exported."""
+        async for chunk in self._chunks():
+            for signal, item, _, _ in chunk.items:
+                if item is not None:
+                    yield signal, item
+
+    async def run(self) -> ReplayStats:
+        """Replay all the sources to the sinks, then shut the sinks down.
+        Return the statistics of the replay."""
+        stats = self.stats
+        batches: Dict[str, _Batch] = {}
+        window = asyncio.Semaphore(self._max_concurrent_exports)
+        exports: Set[asyncio.Task] = set()
+        # Telemetry data of each source exported, including by the previous runs of resumed sources
+        source_exported: Dict[int, int] = defaultdict(int)
+
+        async def export(signal: str, batch: _Batch) -> None:
+            items = batch.items
+            if self._prepare is not None:
+                items = self._prepare(items)
+            n_handing_over = len(self._sinks)
+
+            async def hand_over(sink: ReplaySink) -> bool:
+                nonlocal n_handing_over
+                try:
+                    result = await sink.submit(signal, items, self._pass_through)
+                finally:
+                    # The window only covers the batches the sinks cannot take yet
+                    n_handing_over -= 1
+                    if not n_handing_over:
+                        window.release()
+                return await result
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*(hand_over(sink) for sink in self._sinks), return_exceptions=True)
+            success = True
+            for result in results:
+                if isinstance(result, BaseException):
+                    logging.error("Unable to export %d %s", batch.n_items, signal, exc_info=result)
+                success = success and result is True
+            if not success:
+                logging.error("Unable to export %d %s", batch.n_items, signal)
+            stats.record_export(signal, batch.n_items, time.perf_counter() - start, success)
+            if success:
+                self.n_tel_data_exported += batch.n_items
+                for source, n_items in batch.sources.items():
+                    source_exported[source] += n_items
+
+        async def submit(signal: str) -> None:
+            batch = batches.pop(signal, None)
+            if batch is None:
+                return
+            await window.acquire()
+            task = asyncio.create_task(export(signal, batch))
+            exports.add(task)
+            task.add_done_callback(exports.discard)
+
+        async def submit_all() -> None:
+            for signal in list(batches):
+                await submit(signal)
+
+        async def wait_handed_over() -> None:
+            for _ in range(self._max_concurrent_exports):
+                await window.acquire()
+            for _ in range(self._max_concurrent_exports):
+                window.release()
+
+        async def save_checkpoint(mark: _CheckpointMark) -> None:
+            # Only the telemetry data whose export completed can be recorded. The
+            # batches being retried are only in memory, the position must not pass them.
+            await submit_all()
+            await wait_handed_over()
+            # Batches submitted meanwhile hold telemetry data read before the mark too
+            exported = list(exports)
+            timeout = self._shutdown_timeout if mark.done else 0.0
+            if not all(await asyncio.gather(*(sink.flush(timeout) for sink in self._sinks))):
+                if mark.done:
+                    logging.warning("Exports of %s are still retried, its checkpoint is left at the last "
+                                    "saved position", mark.ust_traces_folder)
+                return
+            await asyncio.gather(*exported)
+            checkpoint = mark.checkpoint
+            checkpoint.timestamp = mark.timestamp
+            checkpoint.n_at_timestamp = mark.n_at_timestamp
+            checkpoint.done = mark.done
+            checkpoint.n_tel_data = mark.n_tel_data
+            checkpoint.n_tel_data_exported = source_exported[mark.source]
+            await asyncio.to_thread(checkpoint.save)
+
+        async def flush_expired() -> None:
+            while True:
+                await asyncio.sleep(self._schedule_delay / 2)
+                deadline = time.monotonic() - self._schedule_delay
+                for signal in [signal for signal, batch in batches.items() if batch.start_time <= deadline]:
+                    await submit(signal)
+
+        flusher = asyncio.create_task(flush_expired())
+        try:
+            async for chunk in self._chunks():
+                source_exported[chunk.source] += chunk.n_exported_before
+                self.n_tel_data_exported += chunk.n_exported_before
+                for signal, item, size, n_items in chunk.items:
+                    if item is None:
+                        # Replayed telemetry data left with nothing to export
+                        source_exported[chunk.source] += n_items
+                        self.n_tel_data_exported += n_items
+                        continue
+                    size = repeated_field_size(size)
+                    batch = batches.get(signal)
+                    if batch is not None and (len(batch.items) >= self._max_export_batch_size
+                                              or batch.n_bytes + size > self._max_export_batch_bytes):
+                        await submit(signal)
+                        batch = None
+                    if batch is None:
+                        batch = batches[signal] = _Batch()
+                    batch.items.append(item)
+                    batch.n_bytes += size
+                    batch.n_items += n_items
+                    batch.sources[chunk.source] += n_items
+                if chunk.submit:
+                    await submit_all()
+                if chunk.checkpoint is not None:
+                    await save_checkpoint(chunk.checkpoint)
+        finally:
+            flusher.cancel()
+            await submit_all()
+            # Sinks are shut down once they took all the batches
+            await wait_handed_over()
+            await asyncio.gather(*(sink.shutdown() for sink in self._sinks))
+            await asyncio.gather(*exports)
+            if self._pacer is not None:
+                self._pacer.report()
+        return stats
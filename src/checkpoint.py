@@ -0,0 +1,122 @@
+"""
+checkpoint.py
+
+Persist the replay state of ust traces folders so that an interrupted replay
+can resume where it stopped.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_CHECKPOINT_INTERVAL = 30.0
+
+
+class ReplayPosition:
+    """Position of a replay in a ust traces folder.
+
+    The position is the CTF timestamp of the last replayed event and the
+    number of events replayed with this exact timestamp, since several events
+    can share a timestamp.
+    """
+
+    def __init__(self):
+        self.timestamp: Optional[int] = None
+        self.n_at_timestamp = 0
+
+    def advance(self, timestamp: int) -> None:
+        """Record that the event with this timestamp has been replayed"""
+        if timestamp == self.timestamp:
+            self.n_at_timestamp += 1
+        else:
+            self.timestamp = timestamp
+            self.n_at_timestamp = 1
+
+    def begin_seconds(self) -> Optional[float]:
+        """Timestamp in seconds from which the trace must be read to resume.
+
+        A microsecond margin absorbs the float conversion; the events between
+        this timestamp and the position must then be skipped with is_replayed."""
+        if self.timestamp is None:
+            return None
+        return (self.timestamp - 1000) / 1e9
+
+
+class FolderCheckpoint(ReplayPosition):
+    """Replay state of a ust traces folder, stored in a small JSON file.
+
+    The position is the one of the last replayed opentelemetry-c event.
+    Args:
+        checkpoint_dir: Folder holding the state files
+        ust_traces_folder: Path of the ust traces folder
+    """
+
+    def __init__(self, checkpoint_dir: Path, ust_traces_folder: str):
+        super().__init__()
+        folder_hash = hashlib.sha1(
+            os.path.abspath(ust_traces_folder).encode()).hexdigest()
+        self._path = checkpoint_dir / f"{folder_hash}.json"
+        self._ust_traces_folder = ust_traces_folder
+
+        self.done = False
+        self.n_tel_data = 0
+        self.n_tel_data_exported = 0
+
+    def load(self) -> bool:
+        """Load the saved state, return False if there is none"""
+        try:
+            with open(self._path, "r", encoding="utf-8") as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError):
+            logging.warning("Ignoring unreadable checkpoint %s", self._path)
+            return False
+
+        self.done = state["done"]
+        self.timestamp = state["timestamp"]
+        self.n_at_timestamp = state["n_at_timestamp"]
+        self.n_tel_data = state["n_tel_data"]
+        self.n_tel_data_exported = state["n_tel_data_exported"]
+        return True
+
+    def save(self) -> None:
+        """Atomically write the state file"""
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self._path.with_suffix(".tmp")
+        with open(temporary_path, "w", encoding="utf-8") as state_file:
+            json.dump({
+                "ust_traces_folder": self._ust_traces_folder,
+                "done": self.done,
+                "timestamp": self.timestamp,
+                "n_at_timestamp": self.n_at_timestamp,
+                "n_tel_data": self.n_tel_data,
+                "n_tel_data_exported": self.n_tel_data_exported,
+            }, state_file)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        os.replace(temporary_path, self._path)
+
+
+class ResumeFilter:
+    """Skip the events already replayed before a checkpoint
+    Args:
+        checkpoint: Loaded checkpoint of the folder, or position of a replay
+    """
+
+    def __init__(self, checkpoint: ReplayPosition):
+        self._timestamp = checkpoint.timestamp
+        self._n_to_skip_at_timestamp = checkpoint.n_at_timestamp
+
+    def is_replayed(self, timestamp: int) -> bool:
+        """Return True if the event with this timestamp was already replayed"""
+        if self._timestamp is None or timestamp > self._timestamp:
+            return False
+        if timestamp < self._timestamp:
+            return True
+        if self._n_to_skip_at_timestamp > 0:
+            self._n_to_skip_at_timestamp -= 1
+            return True
+        return False
@@ -0,0 +1,62 @@
+"""
+coalescer.py
+
+Merge resource spans, metrics and logs sharing the same resource and
+instrumentation scope, so that repeated resource and scope blocks are
+only sent once per export request.
+"""
+from typing import Dict, List, Sequence, Tuple, TypeVar
+
+from opentelemetry.proto.logs.v1.logs_pb2 import ResourceLogs
+from opentelemetry.proto.metrics.v1.metrics_pb2 import ResourceMetrics
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
+
+ResourceT = TypeVar("ResourceT", ResourceSpans, ResourceMetrics, ResourceLogs)
+
+# Scopes field and items field of each resource message
+SCOPE_FIELDS = {
+    ResourceSpans: ("scope_spans", "spans"),
+    ResourceMetrics: ("scope_metrics", "metrics"),
+    ResourceLogs: ("scope_logs", "log_records"),
+}
+
+
+def resource_key(resource) -> Tuple[bytes, str]:
+    """Key identifying the resource of a resource spans, metrics or logs"""
+    return resource.resource.SerializeToString(deterministic=True), resource.schema_url
+
+
+def scope_key(scope) -> Tuple[bytes, str]:
+    """Key identifying the instrumentation scope of a scope spans, metrics or logs"""
+    return scope.scope.SerializeToString(deterministic=True), scope.schema_url
+
+
+def coalesce(resources: Sequence[ResourceT]) -> List[ResourceT]:
+    """Merge resources with identical resource and schema URL, then their
+    scopes with identical instrumentation scope and schema URL. The order of
+    the spans, metrics and logs is preserved within each scope."""
+    if len(resources) < 2:
+        return list(resources)
+    scopes_field, items_field = SCOPE_FIELDS[type(resources[0])]
+
+    merged: Dict[Tuple[bytes, str], Tuple[ResourceT, Dict]] = {}
+    for resource in resources:
+        key = resource_key(resource)
+        if key not in merged:
+            merged_resource = type(resource)()
+            merged_resource.resource.CopyFrom(resource.resource)
+            merged_resource.schema_url = resource.schema_url
+            merged[key] = (merged_resource, {})
+        merged_resource, merged_scopes = merged[key]
+
+        for scope in getattr(resource, scopes_field):
+            key = scope_key(scope)
+            merged_scope = merged_scopes.get(key)
+            if merged_scope is None:
+                merged_scope = getattr(merged_resource, scopes_field).add()
+                merged_scope.scope.CopyFrom(scope.scope)
+                merged_scope.schema_url = scope.schema_url
+                merged_scopes[key] = merged_scope
+            getattr(merged_scope, items_field).extend(getattr(scope, items_field))
+
+    return [merged_resource for merged_resource, _ in merged.values()]
@@ -0,0 +1,67 @@
+"""
+ctf_payload.py
+
+Read the serialized protobuf payload of opentelemetry-c CTF events.
+
+opentelemetry-c stores each payload in a CTF sequence of uint8. Iterating over
+the bt2 array field wraps every byte in a Python field object, which dominates
+the replay loop for payloads of several KB. The accessor below reads the
+integer values through the native bt2 bindings instead and builds the bytes
+object in a single copy. Payloads are then decoded, or only validated in
+pass-through mode, with decode_payload.
+"""
+from itertools import repeat
+
+from google.protobuf.message import DecodeError
+from opentelemetry.proto.logs.v1.logs_pb2 import ResourceLogs
+from opentelemetry.proto.metrics.v1.metrics_pb2 import ResourceMetrics
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
+
+from otlp_raw import validate_resource_payload
+
+try:
+    from bt2 import native_bt
+except ImportError:
+    native_bt = None
+
+# Payload field and message type of each opentelemetry-c event
+OTEL_EVENTS = {
+    "opentelemetry:resource_spans": ("resource_spans", ResourceSpans),
+    "opentelemetry:resource_metrics": ("resource_metrics", ResourceMetrics),
+    "opentelemetry:resource_logs": ("resource_logs", ResourceLogs),
+}
+
+
+def read_payload_legacy(field) -> bytes:
+    """Read a payload by iterating over the bt2 field objects"""
+    return bytes(list(field))
+
+
+def read_payload(field) -> bytes:
+    """Read a payload from a bt2 static or dynamic array of uint8 field"""
+    try:
+        field_ptr = field._ptr  # pylint: disable=protected-access
+    except AttributeError:
+        return bytes(field)
+    if native_bt is None:
+        return bytes(field)
+
+    length = native_bt.field_array_get_length(field_ptr)
+    element_ptrs = map(native_bt.field_array_borrow_element_field_by_index_const,
+                       repeat(field_ptr, length), range(length))
+    return bytes(map(native_bt.field_integer_unsigned_get_value, element_ptrs))
+
+
+def decode_payload(payload: bytes, message_type, pass_through: bool = False, validate: bool = True):
+    """Parse an event payload, or only validate it in pass-through mode.
+    Return None if the payload is invalid."""
+    if pass_through:
+        if validate and not validate_resource_payload(payload):
+            return None
+        return payload
+    message = message_type()
+    try:
+        message.ParseFromString(payload)
+    except DecodeError:
+        return None
+    return message
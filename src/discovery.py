@@ -0,0 +1,140 @@
+"""
+discovery.py
+
+Find the ust traces folders to replay while they are being replayed.
+
+The scan walks the input folder with os.scandir and yields each ust folder as
+soon as it is found, without descending into it. Symbolic links to folders are
+followed, each folder being visited once. A background thread keeps scanning
+while the first folders are replayed. The folders found can be saved to a
+manifest file, with their absolute paths, read instead of scanning on the next
+runs.
+"""
+import fnmatch
+import logging
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Sequence
+
+UST_FOLDER_NAME = "ust"
+
+_END_OF_SCAN = object()
+
+
+def _matches(relative_path: str, patterns: Sequence[str]) -> bool:
+    return any(fnmatch.fnmatch(relative_path, pattern) for pattern in patterns)
+
+
+def is_selected(relative_path: str, include: Sequence[str] = (), exclude: Sequence[str] = ()) -> bool:
+    """Whether a ust folder, given relative to the input folder, passes the include and exclude globs"""
+    if include and not _matches(relative_path, include):
+        return False
+    return not _matches(relative_path, exclude)
+
+
+def scan_ust_folders(input_folder: Path, include: Sequence[str] = (), exclude: Sequence[str] = ()) -> Iterator[str]:
+    """Yield the ust traces folders under input_folder, in a stable order.
+    Folders matching an exclude glob are not scanned. Symbolic links are
+    followed, a folder reached through several paths is only visited once."""
+    pending = [str(input_folder)]
+    # Device and inode of the folders visited, so that symbolic link cycles end
+    visited = set()
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                subdirectories = sorted(entry.path for entry in entries if entry.is_dir())
+        except OSError as error:
+            logging.warning("Unable to scan %s: %s", directory, error)
+            continue
+
+        # Visit the subdirectories in alphabetical order
+        for subdirectory in reversed(subdirectories):
+            relative_path = os.path.relpath(subdirectory, input_folder)
+            if _matches(relative_path, exclude):
+                continue
+            try:
+                status = os.stat(subdirectory)
+            except OSError as error:
+                logging.warning("Unable to scan %s: %s", subdirectory, error)
+                continue
+            if (status.st_dev, status.st_ino) in visited:
+                continue
+            visited.add((status.st_dev, status.st_ino))
+            if os.path.basename(subdirectory) == UST_FOLDER_NAME:
+                # Stream files are not scanned
+                if is_selected(relative_path, include):
+                    yield subdirectory
+            else:
+                pending.append(subdirectory)
+
+
+def read_manifest(manifest_path: Path, input_folder: Path, include: Sequence[str] = (),
+                  exclude: Sequence[str] = ()) -> Iterator[str]:
+    """Yield the ust traces folders listed in a manifest file"""
+    with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+        for line in manifest_file:
+            ust_traces_folder = line.rstrip("\n")
+            if ust_traces_folder and is_selected(
+                    os.path.relpath(ust_traces_folder, input_folder), include, exclude):
+                yield ust_traces_folder
+
+
+def write_manifest(ust_traces_folders: Iterable[str], manifest_path: Path) -> Iterator[str]:
+    """Pass ust traces folders through while recording their absolute path in a
+    manifest file, which is only written once all the folders have been seen"""
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    with open(temporary_path, "w", encoding="utf-8") as manifest_file:
+        for ust_traces_folder in ust_traces_folders:
+            # The manifest stays valid whatever the working directory of the next runs
+            manifest_file.write(os.path.abspath(ust_traces_folder) + "\n")
+            yield ust_traces_folder
+    os.replace(temporary_path, manifest_path)
+
+
+def prefetch(iterable: Iterable, max_pending: int = 1024) -> Iterator:
+    """Consume an iterable from a background thread, so that producing the
+    next items overlaps with the processing of the current one"""
+    items: queue.Queue = queue.Queue(max_pending)
+    error: Optional[BaseException] = None
+
+    def produce() -> None:
+        nonlocal error
+        try:
+            for item in iterable:
+                items.put(item)
+        except BaseException as produce_error:  # pylint: disable=broad-except
+            error = produce_error
+        finally:
+            items.put(_END_OF_SCAN)
+
+    threading.Thread(target=produce, name="discovery", daemon=True).start()
+    while True:
+        item = items.get()
+        if item is _END_OF_SCAN:
+            if error is not None:
+                raise error
+            return
+        yield item
+
+
+def discover_ust_folders(input_folder: Path, include: Sequence[str] = (), exclude: Sequence[str] = (),
+                         manifest_path: Optional[Path] = None) -> Iterator[str]:
+    """Yield the ust traces folders to replay, from the manifest if it exists,
+    otherwise by scanning input_folder in the background and saving the manifest"""
+    if manifest_path is not None and manifest_path.exists():
+        logging.info("Reading the ust traces folders from %s", manifest_path)
+        return read_manifest(manifest_path, input_folder, include, exclude)
+
+    ust_traces_folders = scan_ust_folders(input_folder, include if manifest_path is None else (),
+                                          exclude if manifest_path is None else ())
+    if manifest_path is not None:
+        # The manifest lists all the folders, the globs are applied when reading it
+        ust_traces_folders = (
+            ust_traces_folder
+            for ust_traces_folder in write_manifest(ust_traces_folders, manifest_path)
+            if is_selected(os.path.relpath(ust_traces_folder, input_folder), include, exclude))
+    return prefetch(ust_traces_folders)
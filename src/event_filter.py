@@ -0,0 +1,167 @@
+"""
+event_filter.py
+
+Select the telemetry data to replay as early as possible.
+
+- The time range is pushed down to the bt2 graph, whose trimmer discards the
+  messages outside of it before they reach Python.
+- Signals are selected on the event class, looked up once per event class
+  instead of reading the name of every event. The filter keeps a reference to
+  the event classes it looked up, so that their address is not reused by the
+  event classes of another trace while they are cached.
+- Service names are matched on the resource alone, parsed out of the payload
+  without decoding the spans, metrics or logs.
+- Spans and logs are sampled on their trace id, keeping the same traces as a
+  TraceIdRatioBased sampler with the same ratio.
+"""
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+from opentelemetry.proto.logs.v1.logs_pb2 import ResourceLogs
+from opentelemetry.proto.resource.v1.resource_pb2 import Resource
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
+
+from coalescer import SCOPE_FIELDS
+from otlp_raw import WIRE_TYPE_LEN, iter_fields
+
+try:
+    from bt2 import native_bt
+except ImportError:
+    native_bt = None
+
+SIGNAL_EVENTS = {
+    "traces": "opentelemetry:resource_spans",
+    "metrics": "opentelemetry:resource_metrics",
+    "logs": "opentelemetry:resource_logs",
+}
+
+SERVICE_NAME_KEY = "service.name"
+
+_TRACE_ID_LIMIT = 1 << 64
+
+# Event classes cached before the cache is cleared, which bounds the number of
+# trace classes kept alive when traces are opened again and again while followed
+_MAX_EVENT_CLASSES = 256
+
+
+def resource_service_name(payload: bytes) -> Optional[str]:
+    """service.name attribute of a serialized ResourceSpans, ResourceMetrics
+    or ResourceLogs. Only the resource field is parsed. Raise DecodeError if
+    the payload is malformed."""
+    for field_number, wire_type, value_start, value_end in iter_fields(payload):
+        # resource = 1
+        if field_number == 1 and wire_type == WIRE_TYPE_LEN:
+            resource = Resource.FromString(payload[value_start:value_end])
+            for attribute in resource.attributes:
+                if attribute.key == SERVICE_NAME_KEY:
+                    return attribute.value.string_value
+            return None
+    return None
+
+
+class EventFilter:
+    """Selection of the opentelemetry-c events and telemetry data to replay
+    Args:
+        signals: Kinds of telemetry data to replay, "traces", "metrics" or "logs"
+        service_names: Only replay the telemetry data of these services
+        begin: Only replay the events from this timestamp, in seconds from origin
+        end: Only replay the events up to this timestamp, in seconds from origin
+        trace_id_ratio: Fraction of the traces whose spans and logs are replayed
+    """
+
+    def __init__(
+        self,
+        signals: Iterable[str] = tuple(SIGNAL_EVENTS),
+        service_names: Sequence[str] = (),
+        begin: Optional[float] = None,
+        end: Optional[float] = None,
+        trace_id_ratio: float = 1.0,
+    ):
+        self._event_names = frozenset(SIGNAL_EVENTS[signal] for signal in signals)
+        self._service_names = frozenset(service_names)
+        self.begin = begin
+        self.end = end
+        self._begin_ns = None if begin is None else int(begin * 1e9)
+        self._end_ns = None if end is None else int(end * 1e9)
+        self._trace_id_bound = int(max(0.0, min(1.0, trace_id_ratio)) * (_TRACE_ID_LIMIT - 1))
+        # Decision of each event class, keyed by its native address, along with
+        # the event class itself, whose reference keeps the address in use
+        self._event_classes: Dict[int, Tuple[bool, Any]] = {}
+
+    @property
+    def sampled(self) -> bool:
+        """Whether spans and logs are sampled on their trace id"""
+        return self._trace_id_bound < _TRACE_ID_LIMIT - 1
+
+    def trimmer_begin(self, resume_begin: Optional[float] = None) -> Optional[float]:
+        """Beginning of the range read from the traces, resuming from resume_begin if set"""
+        if resume_begin is None:
+            return self.begin
+        if self.begin is None:
+            return resume_begin
+        return max(self.begin, resume_begin)
+
+    def accepts_name(self, name: str) -> bool:
+        """Whether an opentelemetry-c event of this name is selected"""
+        return name in self._event_names
+
+    def accepts_event(self, event) -> bool:
+        """Whether a bt2 event is a selected opentelemetry-c event, looking up its
+        event class instead of reading its name when the native bindings allow it"""
+        if native_bt is None:
+            return self.accepts_name(event.name)
+        try:
+            # pylint: disable=protected-access
+            event_class = int(native_bt.event_borrow_class_const(event._ptr))
+        except (AttributeError, TypeError):
+            return self.accepts_name(event.name)
+        cached = self._event_classes.get(event_class)
+        if cached is None:
+            if len(self._event_classes) >= _MAX_EVENT_CLASSES:
+                self._event_classes.clear()
+            cached = self._event_classes[event_class] = (self.accepts_name(event.name), event.cls)
+        return cached[0]
+
+    def accepts_timestamp(self, timestamp: int) -> bool:
+        """Whether an event timestamp, in ns from origin, is in the time range"""
+        if self._begin_ns is not None and timestamp < self._begin_ns:
+            return False
+        return self._end_ns is None or timestamp <= self._end_ns
+
+    def accepts_payload(self, payload: bytes) -> bool:
+        """Whether the resource of a serialized payload belongs to a selected
+        service. Raise DecodeError if the payload is malformed."""
+        if not self._service_names:
+            return True
+        return resource_service_name(payload) in self._service_names
+
+    def _sampled_trace_id(self, trace_id: bytes) -> bool:
+        # Same decision as TraceIdRatioBased, on the lower 64 bits of the trace id
+        return int.from_bytes(trace_id[8:16], "big") < self._trace_id_bound
+
+    def sample(self, resource) -> bool:
+        """Remove the spans and logs of unsampled traces from a decoded resource.
+        Logs without trace id are kept. Return False if nothing is left."""
+        if not self.sampled or not isinstance(resource, (ResourceSpans, ResourceLogs)):
+            return True
+        scopes_field, items_field = SCOPE_FIELDS[type(resource)]
+        n_items = 0
+        for scope in getattr(resource, scopes_field):
+            items = getattr(scope, items_field)
+            kept = [item for item in items if not item.trace_id or self._sampled_trace_id(item.trace_id)]
+            if len(kept) != len(items):
+                del items[:]
+                items.extend(kept)
+            n_items += len(kept)
+        return n_items > 0
+
+    def sample_item(self, item, message_type):
+        """Sample a decoded or serialized resource of message_type, return None
+        if nothing is left. Raise DecodeError if a serialized resource is malformed."""
+        if not self.sampled:
+            return item
+        if isinstance(item, bytes):
+            message = message_type.FromString(item)
+            if not self.sample(message):
+                return None
+            return message.SerializeToString()
+        return item if self.sample(item) else None
@@ -0,0 +1,197 @@
+"""
+export_engine.py
+
+Export batches from a thread pool while keeping a bounded number
+of requests in flight, so that CTF decoding and network calls overlap.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from opentelemetry.exporter.otlp.proto.grpc.exporter import OTLPExporterMixin
+
+from replay_stats import ReplayStats
+from retry_queue import (DEFAULT_MAX_EXPORT_ATTEMPTS,
+                         DEFAULT_RETRY_QUEUE_BYTES, RetryQueue)
+
+DEFAULT_MAX_CONCURRENT_EXPORTS = 4
+
+
+class ExportEngine:
+    """Asynchronous export of batches of telemetry data
+    Args:
+        exporter_factory: Creates an OTLP exporter. Each worker thread owns an
+            exporter because an exporter serializes its own export calls.
+        max_concurrent_exports: Maximum number of requests queued or in flight.
+            Submitting a batch blocks while this window is full.
+        ordered: Send requests one at a time in the order they were submitted.
+            Decoding still overlaps with the network calls.
+        serialized: Batches hold serialized resources, sent with export_serialized
+        stats: Statistics counting the retries of the failed requests. The
+            export of the batches is recorded by their submitter.
+        retry_queue_bytes: Size of the failed batches kept in memory to be exported
+            again with an exponential backoff. 0 disables the retries.
+        retry_journal_dir: Folder where failed batches are spilled beyond retry_queue_bytes
+        max_export_attempts: Number of export attempts after which a batch is dropped
+        on_export: Called with the result and the latency in seconds of each export attempt
+    """
+
+    def __init__(
+        self,
+        exporter_factory: Callable,
+        max_concurrent_exports: int = DEFAULT_MAX_CONCURRENT_EXPORTS,
+        ordered: bool = False,
+        serialized: bool = False,
+        stats: Optional[ReplayStats] = None,
+        retry_queue_bytes: int = DEFAULT_RETRY_QUEUE_BYTES,
+        retry_journal_dir: Optional[Path] = None,
+        max_export_attempts: int = DEFAULT_MAX_EXPORT_ATTEMPTS,
+        on_export: Optional[Callable[[bool, float], None]] = None,
+    ):
+        max_concurrent_exports = max(1, max_concurrent_exports)
+        self._exporter_factory = exporter_factory
+        self._max_concurrent_exports = max_concurrent_exports
+        self._window = threading.BoundedSemaphore(max_concurrent_exports)
+
+        self._exporters: List = [exporter_factory()]
+        # Exporters created but not yet owned by a worker thread
+        self._unassigned_exporters: List = list(self._exporters)
+        self._exporters_lock = threading.Lock()
+        self._local = threading.local()
+        self._serialized = serialized
+        self._on_export = on_export
+
+        # pylint: disable=protected-access
+        self._success = self._exporters[0]._result.SUCCESS
+        self.exporting: str = self._exporters[0]._exporting
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=1 if ordered else max_concurrent_exports,
+            thread_name_prefix=f"export-{self.exporting}")
+
+        self._retry_queue: Optional[RetryQueue] = None
+        if retry_queue_bytes > 0 or retry_journal_dir is not None:
+            self._retry_queue = RetryQueue(
+                self._export_payloads, self.exporting, retry_queue_bytes, retry_journal_dir,
+                max_export_attempts, stats=stats)
+
+    @property
+    def exporter(self):
+        """One of the exporters of this engine, to read the exporters configuration"""
+        return self._exporters[0]
+
+    def _get_exporter(self):
+        exporter = getattr(self._local, "exporter", None)
+        if exporter is None:
+            with self._exporters_lock:
+                if self._unassigned_exporters:
+                    exporter = self._unassigned_exporters.pop()
+                else:
+                    exporter = self._exporter_factory()
+                    self._exporters.append(exporter)
+            self._local.exporter = exporter
+        return exporter
+
+    def _export(self, batch: Sequence) -> Tuple[bool, List[bytes]]:
+        """Export a batch, return whether it succeeded and the serialized
+        resources of the requests that failed"""
+        exporter = self._get_exporter()
+        failed: List[bytes] = []
+        start = time.perf_counter()
+        if self._serialized:
+            success = exporter.export_serialized(batch, failed) == self._success
+        else:
+            success = exporter.export(batch, failed) == self._success
+        self._record_export(time.perf_counter() - start, success)
+        return success, failed
+
+    def _export_payloads(self, payloads: List[bytes]) -> Tuple[bool, List[bytes]]:
+        """Export serialized resources, whether or not the engine is serialized"""
+        exporter = self._get_exporter()
+        failed: List[bytes] = []
+        start = time.perf_counter()
+        success = exporter.export_serialized(payloads, failed) == self._success
+        self._record_export(time.perf_counter() - start, success)
+        return success, failed
+
+    def _record_export(self, seconds: float, success: bool) -> None:
+        if self._on_export is not None:
+            self._on_export(success, seconds)
+
+    def _retry(self, retry_queue: RetryQueue, batch: Sequence, failed: Optional[List[bytes]],
+               callback: Callable[[Sequence, bool], None]) -> None:
+        """Retry the failed requests of a batch, or the whole batch when failed is None"""
+        if failed is None:
+            if self._serialized:
+                failed = list(batch)
+            else:
+                failed = [resource.SerializeToString() for resource in batch]
+        if not failed:
+            # Only payloads that cannot be exported at all failed
+            callback(batch, False)
+            return
+        retry_queue.add(failed, lambda success: callback(batch, success))
+
+    def submit(self, batch: Sequence, callback: Callable[[Sequence, bool], None], block: bool = True) -> bool:
+        """Export a batch asynchronously, then call callback(batch, success).
+        Blocks while the in-flight window is full, unless block is False, in
+        which case the batch is not submitted and False is returned."""
+        if not self._window.acquire(blocking=block):
+            return False
+        future = self._executor.submit(self._export, batch)
+
+        def done(completed: Future) -> None:
+            failed: Optional[List[bytes]]
+            try:
+                success, failed = completed.result()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Unexpected error while exporting %s", self.exporting)
+                success, failed = False, None
+            try:
+                if not success and self._retry_queue is not None:
+                    # Only the requests that failed are retried, so that the
+                    # collector does not receive the other ones twice. The
+                    # callback is called once the retries are over.
+                    self._retry(self._retry_queue, batch, failed, callback)
+                else:
+                    callback(batch, success)
+            finally:
+                self._window.release()
+
+        future.add_done_callback(done)
+        return True
+
+    def wait(self) -> None:
+        """Wait for all submitted batches to be exported"""
+        for _ in range(self._max_concurrent_exports):
+            self._window.acquire()
+        for _ in range(self._max_concurrent_exports):
+            self._window.release()
+
+    def force_flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait for submitted batches and for the batches being retried.
+        Return False if some are still pending after timeout seconds."""
+        self.wait()
+        if self._retry_queue is not None:
+            return self._retry_queue.wait(timeout)
+        return True
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """Wait for submitted batches, and for the batches being retried up to
+        timeout seconds, then shutdown the workers and their exporters.
+        Batches still failing are left in the retry journal."""
+        self._executor.shutdown(wait=True)
+        if self._retry_queue is not None:
+            self._retry_queue.shutdown(timeout, self._stop_exporters)
+        for exporter in self._exporters:
+            exporter.shutdown()
+
+    def _stop_exporters(self) -> None:
+        """Shutdown the gRPC exporters without waiting for the export in
+        progress, which stops its retries"""
+        for exporter in self._exporters:
+            if isinstance(exporter, OTLPExporterMixin):
+                exporter.shutdown(timeout_millis=0)
@@ -0,0 +1,250 @@
+"""
+fanout.py
+
+Spread the export requests of a kind of telemetry data over several
+collectors, each one with its own export engine.
+
+Spans are routed by trace id with rendezvous hashing, so that all the spans of
+a trace reach the same collector, as tail sampling requires, and only the
+traces of an unhealthy collector move to the other ones. A collector is
+unhealthy for a while after failing several times in a row or answering too
+slowly on average. A full in-flight window is only backpressure: spans wait
+for the collector owning their trace instead of moving to another one.
+Metrics and logs go round-robin to the collectors whose in-flight window has
+room, so that a slow collector only receives what it can take.
+"""
+import hashlib
+import logging
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Sequence, TypeVar
+
+from google.protobuf.message import DecodeError
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans, ScopeSpans
+
+from export_engine import ExportEngine
+from otlp_raw import iter_span_ids
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 5.0
+DEFAULT_MAX_COOLDOWN = 60.0
+DEFAULT_MAX_LATENCY = 5.0
+
+KeyT = TypeVar("KeyT", bound=Hashable)
+
+
+def split_resource_spans(resource: ResourceSpans,
+                         target: Callable[[bytes], KeyT]) -> Dict[KeyT, ResourceSpans]:
+    """Split the spans of a resource by the target of their trace id,
+    copying the resource and scopes into each part"""
+    copies: Dict[KeyT, ResourceSpans] = {}
+    for scope in resource.scope_spans:
+        scope_copies: Dict[KeyT, ScopeSpans] = {}
+        for span in scope.spans:
+            key = target(span.trace_id)
+            scope_copy = scope_copies.get(key)
+            if scope_copy is None:
+                resource_copy = copies.get(key)
+                if resource_copy is None:
+                    resource_copy = copies[key] = ResourceSpans(schema_url=resource.schema_url)
+                    resource_copy.resource.CopyFrom(resource.resource)
+                scope_copy = scope_copies[key] = resource_copy.scope_spans.add(schema_url=scope.schema_url)
+                scope_copy.scope.CopyFrom(scope.scope)
+            scope_copy.spans.add().CopyFrom(span)
+    return copies
+
+
+class EndpointHealth:
+    """Health of a collector endpoint, from the results of its export attempts.
+    An endpoint failing several times in a row, or whose average latency
+    exceeds max_latency, is avoided for a cooldown, doubled each time it is
+    avoided again before an export succeeds.
+    Args:
+        endpoint: Endpoint of the collector, for the logs
+        failure_threshold: Number of consecutive failures making the endpoint unhealthy
+        cooldown: Initial time in seconds during which an unhealthy endpoint is avoided
+        max_cooldown: Maximum cooldown in seconds
+        max_latency: Average latency in seconds making the endpoint unhealthy
+    """
+
+    def __init__(self, endpoint: str, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 cooldown: float = DEFAULT_COOLDOWN, max_cooldown: float = DEFAULT_MAX_COOLDOWN,
+                 max_latency: float = DEFAULT_MAX_LATENCY):
+        self.endpoint = endpoint
+        self._failure_threshold = failure_threshold
+        self._initial_cooldown = cooldown
+        self._max_cooldown = max_cooldown
+        self._max_latency = max_latency
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._cooldown = cooldown
+        self._unhealthy_until = 0.0
+        self.latency_seconds = 0.0
+
+    def record(self, success: bool, seconds: float) -> None:
+        """Account for the result and latency of an export attempt"""
+        with self._lock:
+            # Exponentially weighted moving average of the latency
+            self.latency_seconds += 0.1 * (seconds - self.latency_seconds)
+            if self.latency_seconds > self._max_latency:
+                # Measured again from scratch once the cooldown is over
+                self.latency_seconds = 0.0
+                self._avoid("too slow")
+            if success:
+                self._consecutive_failures = 0
+                self._cooldown = self._initial_cooldown
+                return
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self._failure_threshold:
+                self._consecutive_failures = 0
+                self._avoid("unhealthy")
+
+    def _avoid(self, reason: str) -> None:
+        logging.warning("Collector %s is %s, avoiding it for %.1f s", self.endpoint, reason, self._cooldown)
+        self._unhealthy_until = time.monotonic() + self._cooldown
+        self._cooldown = min(self._cooldown * 2, self._max_cooldown)
+
+    @property
+    def healthy(self) -> bool:
+        """Whether the endpoint should receive new requests"""
+        return time.monotonic() >= self._unhealthy_until
+
+
+class FanOutEngine:
+    """Export engine spreading batches over the export engines of several collectors
+    Args:
+        engine_factory: Creates the export engine of an endpoint, given the
+            endpoint and the on_export hook tracking its health
+        endpoints: Endpoints of the collectors
+        by_trace_id: Route spans by trace id instead of round-robin
+        serialized: Batches hold serialized resources
+    """
+
+    def __init__(
+        self,
+        engine_factory: Callable[..., ExportEngine],
+        endpoints: Sequence[str],
+        by_trace_id: bool = False,
+        serialized: bool = False,
+    ):
+        self._healths = [EndpointHealth(endpoint) for endpoint in endpoints]
+        self._engines = [
+            engine_factory(endpoint, on_export=health.record)
+            for endpoint, health in zip(endpoints, self._healths)
+        ]
+        # Hash keys of the endpoints for the rendezvous hashing
+        self._keys = [hashlib.blake2b(endpoint.encode(), digest_size=16).digest() for endpoint in endpoints]
+        self._by_trace_id = by_trace_id
+        self._serialized = serialized
+        self._next_engine = 0
+        self.exporting: str = self._engines[0].exporting
+
+    @property
+    def exporter(self):
+        """One of the exporters, to read the exporters configuration"""
+        return self._engines[0].exporter
+
+    def _healthy_indexes(self) -> List[int]:
+        healthy = [index for index, health in enumerate(self._healths) if health.healthy]
+        # Keep exporting somewhere when all the collectors are unhealthy
+        return healthy or list(range(len(self._engines)))
+
+    def _rendezvous(self, trace_id: bytes, candidates: Sequence[int]) -> int:
+        """Endpoint with the highest score for a trace id among candidates"""
+        return max(candidates, key=lambda index: hashlib.blake2b(
+            trace_id, digest_size=8, key=self._keys[index]).digest())
+
+    def _partition_spans(self, batch: Sequence, candidates: Sequence[int]) -> Dict[int, list]:
+        """Group the spans of a batch by target endpoint among candidates.
+        Resources whose spans all go to the same endpoint are passed as is,
+        serialized resources are only decoded when their spans must be split."""
+        targets: Dict[bytes, int] = {}
+
+        def target(trace_id: bytes) -> int:
+            index = targets.get(trace_id)
+            if index is None:
+                index = targets[trace_id] = self._rendezvous(trace_id, candidates)
+            return index
+
+        partitions: Dict[int, list] = {}
+        for resource in batch:
+            if self._serialized:
+                trace_ids = (trace_id for trace_id, _, _ in iter_span_ids(resource))
+            else:
+                trace_ids = (span.trace_id for scope in resource.scope_spans for span in scope.spans)
+            resource_targets = {target(trace_id) for trace_id in trace_ids}
+            if len(resource_targets) <= 1:
+                index = resource_targets.pop() if resource_targets else candidates[0]
+                partitions.setdefault(index, []).append(resource)
+                continue
+
+            if self._serialized:
+                resource = ResourceSpans.FromString(resource)
+            for index, resource_copy in split_resource_spans(resource, target).items():
+                partitions.setdefault(index, []).append(
+                    resource_copy.SerializeToString() if self._serialized else resource_copy)
+        return partitions
+
+    def _submit_by_trace_id(self, batch: Sequence, callback: Callable[[Sequence, bool], None]) -> None:
+        try:
+            partitions = self._partition_spans(batch, self._healthy_indexes())
+        except DecodeError:
+            # Let the exporter report the invalid payload
+            self._submit_round_robin(batch, callback)
+            return
+        if not partitions:
+            callback(batch, True)
+            return
+
+        # The batch succeeds once all its parts are exported
+        lock = threading.Lock()
+        pending = [len(partitions)]
+        succeeded = [True]
+
+        def part_done(_, success: bool) -> None:
+            with lock:
+                succeeded[0] = succeeded[0] and success
+                pending[0] -= 1
+                done = pending[0] == 0
+            if done:
+                callback(batch, succeeded[0])
+
+        # Send the parts whose collector has room first, then wait for the
+        # others: moving them to another collector would split their traces
+        waiting = [(index, part) for index, part in partitions.items()
+                   if not self._engines[index].submit(part, part_done, block=False)]
+        for index, part in waiting:
+            self._engines[index].submit(part, part_done)
+
+    def _submit_round_robin(self, batch: Sequence, callback: Callable[[Sequence, bool], None]) -> None:
+        candidates = self._healthy_indexes()
+        start = self._next_engine
+        ordered = sorted(candidates, key=lambda index: (index - start) % len(self._engines))
+        self._next_engine = (ordered[0] + 1) % len(self._engines)
+        # Skip the collectors whose window is full, wait for the next one if all are
+        for index in ordered:
+            if self._engines[index].submit(batch, callback, block=False):
+                self._next_engine = (index + 1) % len(self._engines)
+                return
+        self._engines[ordered[0]].submit(batch, callback)
+
+    def submit(self, batch: Sequence, callback: Callable[[Sequence, bool], None]) -> None:
+        """Export a batch asynchronously, then call callback(batch, success)"""
+        if self._by_trace_id:
+            self._submit_by_trace_id(batch, callback)
+        else:
+            self._submit_round_robin(batch, callback)
+
+    def wait(self) -> None:
+        """Wait for all submitted batches to be exported"""
+        for engine in self._engines:
+            engine.wait()
+
+    def force_flush(self, timeout=None) -> bool:
+        """Wait for submitted batches and for the batches being retried"""
+        return all([engine.force_flush(timeout) for engine in self._engines])
+
+    def shutdown(self, timeout=None) -> None:
+        """Shutdown the export engines of all the collectors"""
+        for engine in self._engines:
+            engine.shutdown(timeout)
@@ -0,0 +1,184 @@
+"""
+file_replayer.py
+
+Send the export requests stored in OTLP files by replayer.py --output-folder
+to an Opentelemetry collector. CTF traces are not read, so bt2 is not needed.
+
+The requests left in a retry journal by replayer.py --retry-journal-dir are
+sent before the files when the same folder is given to --retry-journal-dir.
+Requests of the journal still failing after --shutdown-timeout are retried
+while the files are sent.
+"""
+import logging
+import threading
+import time
+from argparse import ArgumentParser
+from functools import partial
+from pathlib import Path
+from typing import Optional, Sequence
+
+from google.protobuf.message import DecodeError
+from tqdm.auto import tqdm
+
+from export_engine import DEFAULT_MAX_CONCURRENT_EXPORTS, ExportEngine
+from otlp_file import file_signal, iter_file_requests
+from otlp_log_exporter import OTLPLogExporter
+from otlp_metrics_exporter import OTLPMetricExporter
+from otlp_raw import decode_request
+from otlp_span_exporter import OTLPSpanExporter
+
+EXPORTERS = {
+    "traces": OTLPSpanExporter,
+    "metrics": OTLPMetricExporter,
+    "logs": OTLPLogExporter,
+}
+
+DEFAULT_SHUTDOWN_TIMEOUT = 30.0
+
+
+def get_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        description="""
+            Send the OTLP files written by replayer.py --output-folder to an Opentelemetry collector
+            using OpenTelelemetry Protocol for GRPC.
+        """,
+        epilog="""
+            The collector can also be configured with the OTEL_EXPORTER_OTLP_* environment variables
+            supported by replayer.py.
+        """
+    )
+    parser.add_argument('-i', '--input',
+                        action='store',
+                        help='An OTLP file, or a folder of OTLP files. Optional with --retry-journal-dir',
+                        required=False,
+                        type=Path,
+                        dest='input_path')
+    parser.add_argument('-e', '--otel-exporter-otlp-endpoint',
+                        action='store',
+                        help='The OTLP GRPC endpoint of the OpenTelemetry collector',
+                        required=False,
+                        type=str,
+                        dest='otel_exporter_otlp_endpoint')
+    parser.add_argument('--max-concurrent-exports',
+                        action='store',
+                        help='The maximum number of export requests in flight for each kind of telemetry data',
+                        default=DEFAULT_MAX_CONCURRENT_EXPORTS,
+                        type=int,
+                        dest='max_concurrent_exports')
+    parser.add_argument('--ordered-exports',
+                        action='store_true',
+                        help='Send export requests of each kind of telemetry data one at a time, in order',
+                        dest='ordered_exports')
+    parser.add_argument('--retry-journal-dir',
+                        action='store',
+                        help='The retry journal folder of replayer.py, whose export requests are sent before '
+                             'the files. Requests still failing at the end are written back to it',
+                        default=None,
+                        type=Path,
+                        dest='retry_journal_dir')
+    parser.add_argument('--shutdown-timeout',
+                        action='store',
+                        help='The maximum time in seconds waited for failed export requests to be sent, '
+                             'for those of the retry journal before sending the files, and at the end',
+                        default=DEFAULT_SHUTDOWN_TIMEOUT,
+                        type=float,
+                        dest='shutdown_timeout')
+    parser.add_argument('--no-progress',
+                        action='store_false',
+                        help='Disable the progress bar',
+                        dest='progress')
+    return parser
+
+
+def find_otlp_files(input_path: Path) -> Sequence[Path]:
+    """OTLP files written by replayer.py, sorted by signal and rotation order"""
+    if input_path.is_file():
+        return [input_path]
+    return sorted(path for path in input_path.iterdir() if path.is_file() and file_signal(path) is not None)
+
+
+class FileReplayer:
+    """Stream OTLP files to a collector, without decoding the telemetry data
+    Args:
+        endpoint: OTLP GRPC endpoint of the collector
+        max_concurrent_exports: Maximum number of requests in flight for each signal
+        ordered: Send the requests of each signal one at a time, in order
+        retry_journal_dir: Retry journal whose requests are sent by send_journal, and
+            where the requests still failing at shutdown are written
+    """
+
+    def __init__(self, endpoint: str, max_concurrent_exports: int = DEFAULT_MAX_CONCURRENT_EXPORTS,
+                 ordered: bool = False, retry_journal_dir: Optional[Path] = None):
+        exporter_kwargs = {
+            "endpoint": endpoint,
+            "insecure": True if endpoint else None,
+        }
+        self._engines = {
+            signal: ExportEngine(partial(exporter_class, **exporter_kwargs),
+                                 max_concurrent_exports=max_concurrent_exports,
+                                 ordered=ordered, serialized=True, retry_journal_dir=retry_journal_dir)
+            for signal, exporter_class in EXPORTERS.items()
+        }
+        self._lock = threading.Lock()
+        self.n_requests = 0
+        self.n_exported = 0
+
+    def _on_exported(self, _batch, success: bool) -> None:
+        if success:
+            with self._lock:
+                self.n_exported += 1
+
+    def replay_file(self, path: Path, pbar: tqdm) -> None:
+        """Send all the export requests of an OTLP file"""
+        signal = file_signal(path)
+        if signal is None:
+            logging.error("Unable to tell the signal of %s from its name", path)
+            return
+        engine = self._engines[signal]
+        try:
+            for request in iter_file_requests(path, signal):
+                self.n_requests += 1
+                # Sent as a list of serialized resources, split if too large
+                engine.submit(decode_request(request), self._on_exported)
+                pbar.update(1)
+        except (DecodeError, ValueError):
+            logging.exception("Unable to read %s", path)
+
+    def send_journal(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the requests of the retry journal to be sent, up to timeout
+        seconds. Return False if some are still pending."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        sent = True
+        for engine in self._engines.values():
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            sent = engine.force_flush(remaining) and sent
+        return sent
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """Wait for the requests in flight, and for the failed ones up to
+        timeout seconds, then shutdown the exporters"""
+        for engine in self._engines.values():
+            engine.shutdown(timeout)
+
+
+if __name__ == "__main__":
+
+    logging.root.setLevel(logging.INFO)
+
+    parser = get_parser()
+    args = parser.parse_args()
+    if args.input_path is None and args.retry_journal_dir is None:
+        parser.error("-i/--input is required without --retry-journal-dir")
+    otlp_files = find_otlp_files(args.input_path) if args.input_path is not None else []
+    logging.info("Found %d OTLP files", len(otlp_files))
+
+    replayer = FileReplayer(args.otel_exporter_otlp_endpoint, args.max_concurrent_exports, args.ordered_exports,
+                            args.retry_journal_dir)
+    if args.retry_journal_dir is not None and not replayer.send_journal(args.shutdown_timeout):
+        logging.warning("Requests of the retry journal are still failing, they are retried while sending the files")
+    with tqdm(unit=" requests", disable=not args.progress) as requests_pbar:
+        for otlp_file in otlp_files:
+            replayer.replay_file(otlp_file, requests_pbar)
+        replayer.shutdown(args.shutdown_timeout)
+
+    logging.info("Exporting done. %d/%d requests exported.", replayer.n_exported, replayer.n_requests)
@@ -0,0 +1,154 @@
+"""
+follow.py
+
+Follow CTF traces while they are being written, either a ust traces folder
+growing on disk or an LTTng live session served by lttng-relayd.
+
+A folder is followed by reopening it once all its messages have been read,
+seeking to the last replayed event like a resumed replay does. LTTng writes a
+stream file per CPU, flushed independently, so the position is kept for each
+stream: the folder is reopened at the earliest stream position, and the
+events of each stream up to its own position are skipped. The events that a
+lagging stream flushes late are therefore still replayed. A live session
+is read from the lttng-live source of bt2, which asks to try again later when
+no new data is available yet. Following ends after an idle timeout, once an
+event past the end of the time range is read, or when asked to stop.
+"""
+import logging
+import time
+from typing import Callable, Dict, Hashable, Iterator, Optional
+
+import bt2
+
+from checkpoint import ReplayPosition, ResumeFilter
+
+DEFAULT_FOLLOW_POLL_INTERVAL = 1.0
+
+LTTNG_LIVE_URL_PREFIX = "net://"
+
+
+def _stream_key(stream) -> Hashable:
+    """Identity of a stream that is kept when its folder is opened again"""
+    trace = stream.trace
+    return trace.name, trace.uuid, stream.id
+
+
+def is_lttng_live_url(path: str) -> bool:
+    """Whether a path is the URL of an LTTng live session"""
+    return str(path).startswith(LTTNG_LIVE_URL_PREFIX)
+
+
+def open_traces(path: str, begin: Optional[float] = None,
+                end: Optional[float] = None) -> bt2.TraceCollectionMessageIterator:
+    """Message iterator of a ust traces folder between begin and end, or of an LTTng live session URL"""
+    if is_lttng_live_url(path):
+        source = bt2.ComponentSpec.from_named_plugin_and_component_class(
+            "ctf", "lttng-live", {"inputs": [path], "session-not-found-action": "continue"})
+        return bt2.TraceCollectionMessageIterator(source)
+    return bt2.TraceCollectionMessageIterator(path, begin=begin, end=end)
+
+
+class Follower:
+    """Iterate over the messages of traces still being written
+    Args:
+        path: ust traces folder or LTTng live session URL
+        begin: Timestamp in seconds to start from, as TraceCollectionMessageIterator
+        poll_interval: Time in seconds between two checks for new data
+        idle_timeout: Stop after this many seconds without new events, None to follow forever
+        on_idle: Called whenever no new data is available, for instance to export pending batches
+        end: Stop at the first event after this timestamp in seconds, None to follow forever
+        stop: Checked every poll interval, following stops once it returns True
+    """
+
+    def __init__(
+        self,
+        path: str,
+        begin: Optional[float] = None,
+        poll_interval: float = DEFAULT_FOLLOW_POLL_INTERVAL,
+        idle_timeout: Optional[float] = None,
+        on_idle: Optional[Callable[[], None]] = None,
+        end: Optional[float] = None,
+        stop: Optional[Callable[[], bool]] = None,
+    ):
+        self._path = path
+        self._begin = begin
+        self._end_ns = None if end is None else int(end * 1e9)
+        self._poll_interval = poll_interval
+        self._idle_timeout = idle_timeout
+        self._on_idle = on_idle
+        self._stop = stop
+        # Position of the replay in each stream
+        self._positions: Dict[Hashable, ReplayPosition] = {}
+        self._last_event_time = time.monotonic()
+        self._last_stop_check = 0.0
+
+    def _stopped(self) -> bool:
+        """Whether following was asked to stop, checked at most every poll interval"""
+        if self._stop is None:
+            return False
+        now = time.monotonic()
+        if now - self._last_stop_check < self._poll_interval:
+            return False
+        self._last_stop_check = now
+        return self._stop()
+
+    def _idle(self) -> bool:
+        """Wait for new data, return False once the idle timeout has elapsed"""
+        if self._on_idle is not None:
+            self._on_idle()
+        if self._idle_timeout is not None and time.monotonic() - self._last_event_time >= self._idle_timeout:
+            return False
+        time.sleep(self._poll_interval)
+        return not self._stopped()
+
+    def __iter__(self) -> Iterator:
+        live = is_lttng_live_url(self._path)
+        begin = self._begin
+        while True:
+            resume_filters = {key: ResumeFilter(position) for key, position in self._positions.items()}
+            try:
+                messages = iter(open_traces(self._path, begin))
+            except bt2._Error:  # pylint: disable=protected-access
+                # The metadata or the index can be incomplete while being written
+                logging.debug("Unable to open %s yet", self._path)
+                if not self._idle():
+                    return
+                continue
+
+            while True:
+                if self._stopped():
+                    return
+                try:
+                    msg = next(messages)
+                except StopIteration:
+                    break
+                except bt2.TryAgain:
+                    if not self._idle():
+                        return
+                    continue
+                except bt2._Error:  # pylint: disable=protected-access
+                    # A packet still being written, read it again on the next poll
+                    logging.debug("Incomplete data in %s", self._path)
+                    break
+                if isinstance(msg, bt2._EventMessageConst):  # pylint: disable=protected-access
+                    timestamp = msg.default_clock_snapshot.ns_from_origin
+                    if self._end_ns is not None and timestamp > self._end_ns:
+                        # Messages are read in time order, the following ones are past the end too
+                        return
+                    key = _stream_key(msg.event.stream)
+                    resume_filter = resume_filters.get(key)
+                    if resume_filter is not None and resume_filter.is_replayed(timestamp):
+                        continue
+                    position = self._positions.get(key)
+                    if position is None:
+                        position = self._positions[key] = ReplayPosition()
+                    position.advance(timestamp)
+                    self._last_event_time = time.monotonic()
+                yield msg
+
+            if live or not self._idle():
+                return
+            # Seek to the stream lagging the most instead of reading the folder again
+            earliest = min(self._positions.values(), key=lambda position: position.timestamp or 0, default=None)
+            if earliest is not None:
+                begin = earliest.begin_seconds() or begin
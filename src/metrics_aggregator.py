@@ -0,0 +1,328 @@
+"""
+metrics_aggregator.py
+
+Fold the metric data points replayed from CTF traces over a time window, and
+convert sums and histograms to the temporality preferred by the exporter.
+
+Within a window, the points of a stream (same resource, scope, metric and
+attributes) are folded: sums are added, histograms are merged and gauges keep
+their last value. Exponential histograms and summaries are forwarded as is.
+Streams without data points for several windows are forgotten, so that the
+memory used does not grow with the number of attribute sets over a long replay.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from opentelemetry.proto.metrics.v1.metrics_pb2 import (
+    AGGREGATION_TEMPORALITY_CUMULATIVE, AGGREGATION_TEMPORALITY_DELTA,
+    HistogramDataPoint, Metric, NumberDataPoint, ResourceMetrics, ScopeMetrics)
+from opentelemetry.sdk.metrics import Counter, Histogram, UpDownCounter
+from opentelemetry.sdk.metrics.export import AggregationTemporality
+
+from coalescer import resource_key, scope_key
+
+# Number of windows without data points after which a stream is forgotten
+DEFAULT_MAX_IDLE_WINDOWS = 10
+
+_TEMPORALITIES = {
+    AggregationTemporality.DELTA: AGGREGATION_TEMPORALITY_DELTA,
+    AggregationTemporality.CUMULATIVE: AGGREGATION_TEMPORALITY_CUMULATIVE,
+}
+
+
+def _attributes_key(data_point) -> bytes:
+    return b"".join(sorted(
+        attribute.SerializeToString(deterministic=True) for attribute in data_point.attributes))
+
+
+def _number_value(data_point: NumberDataPoint) -> float:
+    return data_point.as_int if data_point.WhichOneof("value") == "as_int" else data_point.as_double
+
+
+def _set_number_value(data_point: NumberDataPoint, value, is_int: bool) -> None:
+    if is_int:
+        data_point.as_int = int(value)
+    else:
+        data_point.as_double = value
+
+
+class _Stream:
+    """State of a metric stream: its window accumulation, kept as a delta,
+    and what is needed to convert between temporalities"""
+
+    def __init__(self, resource_metrics: ResourceMetrics, scope_metrics: ScopeMetrics, metric: Metric, kind: str):
+        # Resource and scope without metrics, to avoid keeping the replayed messages alive
+        self.resource_metrics = ResourceMetrics(schema_url=resource_metrics.schema_url)
+        self.resource_metrics.resource.CopyFrom(resource_metrics.resource)
+        self.scope_metrics = ScopeMetrics(schema_url=scope_metrics.schema_url)
+        self.scope_metrics.scope.CopyFrom(scope_metrics.scope)
+        # Metric description without data points
+        self.metric = Metric(name=metric.name, description=metric.description, unit=metric.unit)
+        self.kind = kind
+        if kind == "sum":
+            self.metric.sum.is_monotonic = metric.sum.is_monotonic
+
+        self.start_time: Optional[int] = None
+        # Data points of the kind of the metric, NumberDataPoint or HistogramDataPoint
+        # Last cumulative point received, to compute deltas
+        self.last_cumulative: Any = None
+        # Running total of the deltas, to compute cumulative points
+        self.cumulative: Any = None
+        # Accumulation of the current window and start time of its delta
+        self.window: Any = None
+        self.window_start_time: Optional[int] = None
+        # Time of the latest data point, to forget idle streams
+        self.last_time = 0
+
+    def reset(self) -> None:
+        """Forget the temporality conversion state, after a reset of the source"""
+        self.last_cumulative = None
+        self.cumulative = None
+        self.start_time = None
+        self.window_start_time = None
+
+
+class MetricsAggregator:
+    """Fold metric data points over a window of data point time
+    Args:
+        window_millis: Length of the aggregation window
+        preferred_temporality: Temporality of the exported sums and histograms by
+            instrument class, as configured on OTLPMetricExporter
+        max_idle_windows: Number of windows of data point time without data points
+            after which a stream is forgotten. A stream coming back afterwards
+            starts over, as after a reset of its source.
+    """
+
+    def __init__(self, window_millis: float, preferred_temporality: Dict[type, AggregationTemporality],
+                 max_idle_windows: int = DEFAULT_MAX_IDLE_WINDOWS):
+        self._window = int(window_millis * 1e6)
+        self._max_idle = max(1, max_idle_windows) * self._window
+        self._temporality = {
+            (True, "sum"): _TEMPORALITIES[preferred_temporality.get(Counter, AggregationTemporality.CUMULATIVE)],
+            (False, "sum"): _TEMPORALITIES[
+                preferred_temporality.get(UpDownCounter, AggregationTemporality.CUMULATIVE)],
+            (True, "histogram"): _TEMPORALITIES[
+                preferred_temporality.get(Histogram, AggregationTemporality.CUMULATIVE)],
+        }
+        self._streams: Dict[Tuple, _Stream] = {}
+        self._window_end: Optional[int] = None
+        self._last_time = 0
+        # Replayed ResourceMetrics not accounted for by an output yet
+        self.n_pending = 0
+
+    def add(self, resource_metrics: ResourceMetrics) -> List[Tuple[ResourceMetrics, int]]:
+        """Fold a replayed ResourceMetrics. Return the ResourceMetrics to export,
+        each one with the number of replayed ResourceMetrics it accounts for."""
+        output: List[Tuple[ResourceMetrics, int]] = []
+        passthrough = ResourceMetrics()
+        passthrough.resource.CopyFrom(resource_metrics.resource)
+        passthrough.schema_url = resource_metrics.schema_url
+        resource = resource_key(resource_metrics)
+        # Metrics forwarded unchanged, grouped by scope
+        passthrough_scopes: Dict[Tuple, ScopeMetrics] = {}
+
+        for scope_metrics in resource_metrics.scope_metrics:
+            scope = scope_key(scope_metrics)
+            for metric in scope_metrics.metrics:
+                kind = metric.WhichOneof("data")
+                if kind not in ("sum", "gauge", "histogram"):
+                    passthrough_scope = passthrough_scopes.get(scope)
+                    if passthrough_scope is None:
+                        passthrough_scope = passthrough.scope_metrics.add()
+                        passthrough_scope.scope.CopyFrom(scope_metrics.scope)
+                        passthrough_scope.schema_url = scope_metrics.schema_url
+                        passthrough_scopes[scope] = passthrough_scope
+                    passthrough_scope.metrics.add().CopyFrom(metric)
+                    continue
+                data = getattr(metric, kind)
+                for data_point in data.data_points:
+                    if self._window_end is not None and data_point.time_unix_nano >= self._window_end:
+                        output.extend(self.flush())
+                    if self._window_end is None:
+                        self._window_end = data_point.time_unix_nano + self._window
+                    key = (resource, scope, metric.name, kind, _attributes_key(data_point))
+                    stream = self._streams.get(key)
+                    if stream is None:
+                        stream = _Stream(resource_metrics, scope_metrics, metric, kind)
+                        self._streams[key] = stream
+                    stream.last_time = max(stream.last_time, data_point.time_unix_nano)
+                    self._last_time = max(self._last_time, data_point.time_unix_nano)
+                    if kind == "gauge":
+                        self._fold_gauge(stream, data_point)
+                    else:
+                        temporality = data.aggregation_temporality
+                        if kind == "sum":
+                            self._fold_sum(stream, data_point, temporality)
+                        else:
+                            self._fold_histogram(stream, data_point, temporality)
+
+        self.n_pending += 1
+        if passthrough.scope_metrics:
+            output.append((passthrough, self.n_pending))
+            self.n_pending = 0
+        return output
+
+    @staticmethod
+    def _fold_gauge(stream: _Stream, data_point: NumberDataPoint) -> None:
+        if stream.window is None or data_point.time_unix_nano >= stream.window.time_unix_nano:
+            stream.window = NumberDataPoint()
+            stream.window.CopyFrom(data_point)
+
+    @staticmethod
+    def _fold_sum(stream: _Stream, data_point: NumberDataPoint, temporality: int) -> None:
+        value = _number_value(data_point)
+        if temporality == AGGREGATION_TEMPORALITY_CUMULATIVE:
+            last = stream.last_cumulative
+            if last is not None and (data_point.start_time_unix_nano != last.start_time_unix_nano
+                                     or value < _number_value(last) and stream.metric.sum.is_monotonic):
+                stream.reset()
+                last = None
+            delta = value - _number_value(last) if last is not None else value
+            stream.last_cumulative = NumberDataPoint()
+            stream.last_cumulative.CopyFrom(data_point)
+        else:
+            delta = value
+
+        if stream.start_time is None:
+            stream.start_time = data_point.start_time_unix_nano
+        if stream.window is None:
+            if stream.window_start_time is None:
+                stream.window_start_time = data_point.start_time_unix_nano
+            stream.window = NumberDataPoint()
+            stream.window.CopyFrom(data_point)
+            _set_number_value(stream.window, delta, data_point.WhichOneof("value") == "as_int")
+            return
+        is_int = stream.window.WhichOneof("value") == "as_int"
+        _set_number_value(stream.window, _number_value(stream.window) + delta, is_int)
+        stream.window.time_unix_nano = max(stream.window.time_unix_nano, data_point.time_unix_nano)
+        stream.window.exemplars.extend(data_point.exemplars)
+
+    @staticmethod
+    def _fold_histogram(stream: _Stream, data_point: HistogramDataPoint, temporality: int) -> None:
+        delta = HistogramDataPoint()
+        delta.CopyFrom(data_point)
+        if temporality == AGGREGATION_TEMPORALITY_CUMULATIVE:
+            last = stream.last_cumulative
+            if last is not None and (data_point.start_time_unix_nano != last.start_time_unix_nano
+                                     or list(data_point.explicit_bounds) != list(last.explicit_bounds)
+                                     or data_point.count < last.count):
+                stream.reset()
+                last = None
+            if last is not None:
+                delta.count -= last.count
+                delta.sum -= last.sum
+                del delta.bucket_counts[:]
+                delta.bucket_counts.extend(
+                    current - previous for current, previous in zip(data_point.bucket_counts, last.bucket_counts))
+                # min and max of a difference are unknown
+                delta.ClearField("min")
+                delta.ClearField("max")
+            stream.last_cumulative = HistogramDataPoint()
+            stream.last_cumulative.CopyFrom(data_point)
+
+        if stream.start_time is None:
+            stream.start_time = data_point.start_time_unix_nano
+        window = stream.window
+        if window is not None and list(window.explicit_bounds) != list(delta.explicit_bounds):
+            # Buckets changed, restart the stream
+            stream.reset()
+            stream.start_time = data_point.start_time_unix_nano
+            window = None
+        if window is None:
+            if stream.window_start_time is None:
+                stream.window_start_time = delta.start_time_unix_nano
+            stream.window = delta
+            return
+        window.count += delta.count
+        window.sum += delta.sum
+        merged_counts = [a + b for a, b in zip(window.bucket_counts, delta.bucket_counts)]
+        del window.bucket_counts[:]
+        window.bucket_counts.extend(merged_counts)
+        if delta.HasField("min"):
+            window.min = min(window.min, delta.min) if window.HasField("min") else delta.min
+        if delta.HasField("max"):
+            window.max = max(window.max, delta.max) if window.HasField("max") else delta.max
+        window.time_unix_nano = max(window.time_unix_nano, delta.time_unix_nano)
+        window.exemplars.extend(delta.exemplars)
+
+    def _emit(self, stream: _Stream):
+        """Return the data point of the window in the preferred temporality"""
+        window = stream.window
+        stream.window = None
+        if stream.kind == "gauge":
+            return window, None
+
+        temporality = self._temporality[(stream.kind == "histogram" or stream.metric.sum.is_monotonic,
+                                         stream.kind)]
+        if temporality == AGGREGATION_TEMPORALITY_DELTA:
+            window.start_time_unix_nano = stream.window_start_time
+            stream.window_start_time = window.time_unix_nano
+            return window, temporality
+
+        # Cumulative: add the window delta to the running total
+        if stream.cumulative is None:
+            stream.cumulative = window
+        elif stream.kind == "sum":
+            is_int = stream.cumulative.WhichOneof("value") == "as_int"
+            _set_number_value(stream.cumulative, _number_value(stream.cumulative) + _number_value(window), is_int)
+            stream.cumulative.time_unix_nano = window.time_unix_nano
+        else:
+            cumulative = stream.cumulative
+            cumulative.count += window.count
+            cumulative.sum += window.sum
+            merged_counts = [a + b for a, b in zip(cumulative.bucket_counts, window.bucket_counts)]
+            del cumulative.bucket_counts[:]
+            cumulative.bucket_counts.extend(merged_counts)
+            if window.HasField("min"):
+                cumulative.min = min(cumulative.min, window.min) if cumulative.HasField("min") else window.min
+            if window.HasField("max"):
+                cumulative.max = max(cumulative.max, window.max) if cumulative.HasField("max") else window.max
+            cumulative.time_unix_nano = window.time_unix_nano
+        stream.cumulative.start_time_unix_nano = stream.start_time
+        data_point = type(window)()
+        data_point.CopyFrom(stream.cumulative)
+        # Exemplars belong to the window only
+        del data_point.exemplars[:]
+        data_point.exemplars.extend(window.exemplars)
+        return data_point, temporality
+
+    def flush(self) -> List[Tuple[ResourceMetrics, int]]:
+        """Emit the folded data points of the current window"""
+        self._window_end = None
+        resources: Dict[Tuple, Tuple[ResourceMetrics, Dict]] = {}
+        metrics: Dict[Tuple, Metric] = {}
+        idle_before = self._last_time - self._max_idle
+        for key, stream in list(self._streams.items()):
+            if stream.window is None:
+                if stream.last_time < idle_before:
+                    del self._streams[key]
+                continue
+            data_point, temporality = self._emit(stream)
+            resource, scope, name, kind, _ = key
+
+            if resource not in resources:
+                resource_metrics = ResourceMetrics()
+                resource_metrics.resource.CopyFrom(stream.resource_metrics.resource)
+                resource_metrics.schema_url = stream.resource_metrics.schema_url
+                resources[resource] = (resource_metrics, {})
+            resource_metrics, scopes = resources[resource]
+            if scope not in scopes:
+                scope_metrics = resource_metrics.scope_metrics.add()
+                scope_metrics.scope.CopyFrom(stream.scope_metrics.scope)
+                scope_metrics.schema_url = stream.scope_metrics.schema_url
+                scopes[scope] = scope_metrics
+            metric = metrics.get((resource, scope, name, kind))
+            if metric is None:
+                metric = scopes[scope].metrics.add()
+                metric.CopyFrom(stream.metric)
+                metrics[(resource, scope, name, kind)] = metric
+            data = getattr(metric, kind)
+            if temporality is not None:
+                data.aggregation_temporality = temporality
+            data.data_points.add().CopyFrom(data_point)
+
+        # Without output, the pending ResourceMetrics are accounted for by the next flush
+        output = []
+        for resource_metrics, _ in resources.values():
+            output.append((resource_metrics, self.n_pending))
+            self.n_pending = 0
+        return output
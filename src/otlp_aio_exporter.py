@@ -0,0 +1,236 @@
+"""
+otlp_aio_exporter.py
+
+OTLP exporters built on grpc.aio, used by the OTLPSink of the asyncio replayer.
+
+The synchronous exporters hold a lock for the whole duration of an export, so
+keeping several requests in flight takes several exporters and threads. Here
+exports are coroutines: any number of them can be awaited at once on a single
+channel, multiplexed over its HTTP/2 connection.
+"""
+import asyncio
+import logging
+from os import environ
+from typing import ClassVar, Optional, Sequence, Type, Union
+
+from google.protobuf.message import DecodeError, Message
+from google.rpc.error_details_pb2 import RetryInfo
+from grpc import ChannelCredentials, Compression, StatusCode, aio
+from opentelemetry.exporter.otlp.proto.grpc import _OTLP_GRPC_HEADERS
+from opentelemetry.exporter.otlp.proto.grpc.exporter import (
+    _get_credentials, environ_to_compression)
+from opentelemetry.proto.collector.logs.v1.logs_service_pb2 import (
+    ExportLogsServiceRequest, ExportLogsServiceResponse)
+from opentelemetry.proto.collector.metrics.v1.metrics_service_pb2 import (
+    ExportMetricsServiceRequest, ExportMetricsServiceResponse)
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import (
+    ExportTraceServiceRequest, ExportTraceServiceResponse)
+from opentelemetry.proto.logs.v1.logs_pb2 import ResourceLogs
+from opentelemetry.proto.metrics.v1.metrics_pb2 import ResourceMetrics
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
+from opentelemetry.sdk._logs._internal.export import LogExportResult
+from opentelemetry.sdk.metrics.export import MetricExportResult
+from opentelemetry.sdk.trace.export import SpanExportResult
+from opentelemetry.util.re import parse_env_headers
+
+from otlp_raw import encode_request
+from otlp_split import (DEFAULT_MAX_EXPORT_REQUEST_BYTES, split_resources,
+                        split_serialized)
+
+DEFAULT_ENDPOINT = "http://localhost:4317"
+DEFAULT_TIMEOUT = 10
+# Same retry policy as OTLPExporterMixin
+MAX_RETRY_DELAY = 64
+
+_TRANSIENT_ERRORS = frozenset([
+    StatusCode.CANCELLED,
+    StatusCode.DEADLINE_EXCEEDED,
+    StatusCode.RESOURCE_EXHAUSTED,
+    StatusCode.ABORTED,
+    StatusCode.OUT_OF_RANGE,
+    StatusCode.UNAVAILABLE,
+    StatusCode.DATA_LOSS,
+])
+
+
+def _environ(signal: str, name: str) -> Optional[str]:
+    """Value of OTEL_EXPORTER_OTLP_<SIGNAL>_<NAME>, or of OTEL_EXPORTER_OTLP_<NAME>"""
+    value = environ.get(f"OTEL_EXPORTER_OTLP_{signal.upper()}_{name}")
+    return value if value is not None else environ.get(f"OTEL_EXPORTER_OTLP_{name}")
+
+
+class _AsyncOTLPExporter:
+    """Base class of the grpc.aio OTLP exporters, configured like the OTLP exporters
+    Args:
+        endpoint: OpenTelemetry Collector receiver endpoint
+        insecure: Connection type
+        credentials: Credentials object for server authentication
+        headers: Headers to send when exporting
+        timeout: Backend request timeout in seconds
+        compression: gRPC compression method to use
+        max_export_batch_size: Maximum number of spans, metric data points or log records to
+            export in a single request. If not set there is no limit, otherwise bigger requests are split.
+        max_export_batch_bytes: Maximum serialized size of a single request, to stay under
+            gRPC's 4MB message size limit. Bigger requests are split.
+    """
+
+    # Defined by the exporter of each signal
+    _result: ClassVar[Union[Type[SpanExportResult], Type[MetricExportResult], Type[LogExportResult]]]
+    _exporting: ClassVar[str]
+    _method: ClassVar[str]
+    _request_class: ClassVar[Type[Message]]
+    _response_class: ClassVar[Type[Message]]
+    _resource_class: ClassVar[Type[Message]]
+    _resources_field: ClassVar[str]
+
+    def __init__(
+        self,
+        endpoint: Optional[str] = None,
+        insecure: Optional[bool] = None,
+        credentials: Optional[ChannelCredentials] = None,
+        headers: Optional[Sequence] = None,
+        timeout: Optional[int] = None,
+        compression: Optional[Compression] = None,
+        max_export_batch_size: Optional[int] = None,
+        max_export_batch_bytes: Optional[int] = DEFAULT_MAX_EXPORT_REQUEST_BYTES,
+    ):
+        signal = self._exporting
+        endpoint = endpoint or _environ(signal, "ENDPOINT") or DEFAULT_ENDPOINT
+        scheme, _, netloc = endpoint.rpartition("://")
+        if scheme == "https":
+            insecure = False
+        if insecure is None:
+            insecure_environ = _environ(signal, "INSECURE")
+            insecure = insecure_environ.lower() == "true" if insecure_environ is not None else scheme == "http"
+        self._endpoint = netloc.split("/", 1)[0]
+        if insecure:
+            self._credentials = None
+        else:
+            certificate_key = f"OTEL_EXPORTER_OTLP_{signal.upper()}_CERTIFICATE"
+            if environ.get(certificate_key) is None:
+                certificate_key = "OTEL_EXPORTER_OTLP_CERTIFICATE"
+            self._credentials = _get_credentials(credentials, certificate_key)
+
+        headers = headers or _environ(signal, "HEADERS")
+        if isinstance(headers, str):
+            headers = tuple(parse_env_headers(headers).items())
+        elif isinstance(headers, dict):
+            headers = tuple(headers.items())
+        self._headers = tuple(headers or ()) + tuple(_OTLP_GRPC_HEADERS)
+
+        if timeout is None:
+            environ_timeout = _environ(signal, "TIMEOUT")
+            timeout = int(environ_timeout) if environ_timeout is not None else DEFAULT_TIMEOUT
+        self._timeout = timeout
+        if compression is None:
+            compression = environ_to_compression(f"OTEL_EXPORTER_OTLP_{signal.upper()}_COMPRESSION")
+            if compression is None:
+                compression = environ_to_compression("OTEL_EXPORTER_OTLP_COMPRESSION")
+        self._compression = compression or Compression.NoCompression
+
+        self._max_export_batch_size = max_export_batch_size
+        self._max_export_batch_bytes = max_export_batch_bytes
+        # The channel is bound to the event loop running the first export
+        self._channel: Optional[aio.Channel] = None
+        self._export_call = None
+        self._shutdown = False
+
+    def _get_export_call(self):
+        if self._export_call is None:
+            if self._credentials is None:
+                self._channel = aio.insecure_channel(self._endpoint, compression=self._compression)
+            else:
+                self._channel = aio.secure_channel(self._endpoint, self._credentials, compression=self._compression)
+            # Requests are serialized beforehand
+            self._export_call = self._channel.unary_unary(
+                self._method, request_serializer=None, response_deserializer=self._response_class.FromString)
+        return self._export_call
+
+    async def _send(self, request: bytes):
+        """Send a serialized export request, retrying on transient errors"""
+        delay = 1
+        while not self._shutdown:
+            try:
+                await self._get_export_call()(request, metadata=self._headers, timeout=self._timeout)
+                return self._result.SUCCESS
+            except aio.AioRpcError as error:
+                if error.code() not in _TRANSIENT_ERRORS or delay >= MAX_RETRY_DELAY:
+                    logging.error("Failed to export %s, error code: %s", self._exporting, error.code())
+                    return self._result.FAILURE
+                retry_delay = delay
+                retry_info_bin = dict(error.trailing_metadata() or ()).get("google.rpc.retryinfo-bin")
+                if retry_info_bin is not None:
+                    retry_info = RetryInfo.FromString(retry_info_bin)
+                    retry_delay = retry_info.retry_delay.seconds + retry_info.retry_delay.nanos / 1.0e9
+                logging.warning("Transient error %s encountered while exporting %s, retrying in %ss.",
+                                error.code(), self._exporting, retry_delay)
+                await asyncio.sleep(retry_delay)
+                delay *= 2
+        logging.warning("Exporter already shutdown, ignoring batch")
+        return self._result.FAILURE
+
+    async def export(self, resources: Sequence):
+        """Export decoded resources, split in several requests if needed"""
+        result = self._result.SUCCESS
+        for chunk in split_resources(resources, self._max_export_batch_size, self._max_export_batch_bytes):
+            request = self._request_class(**{self._resources_field: chunk})
+            if await self._send(request.SerializeToString()) != self._result.SUCCESS:
+                result = self._result.FAILURE
+        return result
+
+    async def export_serialized(self, payloads: Sequence[bytes]):
+        """Export serialized resources without decoding them"""
+        result = self._result.SUCCESS
+        try:
+            for chunk in split_serialized(
+                    payloads, self._resource_class, self._max_export_batch_size, self._max_export_batch_bytes):
+                if await self._send(encode_request(chunk)) != self._result.SUCCESS:
+                    result = self._result.FAILURE
+        except DecodeError:
+            # A payload could not be decoded to be counted or split
+            return self._result.FAILURE
+        return result
+
+    async def shutdown(self, timeout: Optional[float] = None) -> None:
+        """Close the channel, letting the exports in progress finish within timeout seconds"""
+        if self._shutdown:
+            return
+        self._shutdown = True
+        if self._channel is not None:
+            await self._channel.close(grace=timeout)
+
+
+class AsyncOTLPSpanExporter(_AsyncOTLPExporter):
+    """OTLP span exporter for asyncio"""
+
+    _result = SpanExportResult
+    _exporting = "traces"
+    _method = "/opentelemetry.proto.collector.trace.v1.TraceService/Export"
+    _request_class = ExportTraceServiceRequest
+    _response_class = ExportTraceServiceResponse
+    _resource_class = ResourceSpans
+    _resources_field = "resource_spans"
+
+
+class AsyncOTLPMetricExporter(_AsyncOTLPExporter):
+    """OTLP metric exporter for asyncio"""
+
+    _result = MetricExportResult
+    _exporting = "metrics"
+    _method = "/opentelemetry.proto.collector.metrics.v1.MetricsService/Export"
+    _request_class = ExportMetricsServiceRequest
+    _response_class = ExportMetricsServiceResponse
+    _resource_class = ResourceMetrics
+    _resources_field = "resource_metrics"
+
+
+class AsyncOTLPLogExporter(_AsyncOTLPExporter):
+    """OTLP log exporter for asyncio"""
+
+    _result = LogExportResult
+    _exporting = "logs"
+    _method = "/opentelemetry.proto.collector.logs.v1.LogsService/Export"
+    _request_class = ExportLogsServiceRequest
+    _response_class = ExportLogsServiceResponse
+    _resource_class = ResourceLogs
+    _resources_field = "resource_logs"
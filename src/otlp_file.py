@@ -0,0 +1,281 @@
+"""
+otlp_file.py
+
+Write export requests to OTLP files instead of sending them to a collector,
+and read them back.
+
+Two formats are supported:
+- "proto": each Export*ServiceRequest is serialized and prefixed by its
+  length as a varint, like Java's writeDelimitedTo.
+- "json": one Export*ServiceRequest per line in the OTLP/JSON encoding, as
+  written by the file exporter of the collector.
+
+Files can be compressed with gzip, or with zstd when the zstandard package is
+installed, and are rotated once they hold a given amount of uncompressed data.
+"""
+import base64
+import gzip
+import io
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Optional, Sequence, Tuple, Type, Union
+
+from google.protobuf.json_format import MessageToDict, ParseDict
+from google.protobuf.message import DecodeError, Message
+from opentelemetry.proto.collector.logs.v1.logs_service_pb2 import \
+    ExportLogsServiceRequest
+from opentelemetry.proto.collector.metrics.v1.metrics_service_pb2 import \
+    ExportMetricsServiceRequest
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import \
+    ExportTraceServiceRequest
+from opentelemetry.sdk._logs.export import LogExportResult
+from opentelemetry.sdk.metrics.export import AggregationTemporality, MetricExportResult
+from opentelemetry.sdk.trace.export import SpanExportResult
+
+from otlp_raw import decode_varint, encode_request, encode_varint
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FILE_FORMATS = ("proto", "json")
+FILE_COMPRESSIONS = ("none", "gzip", "zstd")
+DEFAULT_MAX_FILE_BYTES = 256 * 1024 * 1024
+
+# Request message and export result of each signal
+SIGNALS: Dict[str, Tuple[Type[Message], Union[Type[SpanExportResult], Type[MetricExportResult],
+                                              Type[LogExportResult]]]] = {
+    "traces": (ExportTraceServiceRequest, SpanExportResult),
+    "metrics": (ExportMetricsServiceRequest, MetricExportResult),
+    "logs": (ExportLogsServiceRequest, LogExportResult),
+}
+
+_FORMAT_EXTENSIONS = {"proto": ".binpb", "json": ".jsonl"}
+_COMPRESSION_EXTENSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+_BinaryFile = Union[IO[bytes], gzip.GzipFile]
+
+# OTLP/JSON encodes trace and span ids in hexadecimal instead of base64
+_ID_FIELDS = ("traceId", "spanId", "parentSpanId")
+
+_READ_CHUNK_BYTES = 1024 * 1024
+
+
+def _convert_ids(value, convert):
+    if isinstance(value, dict):
+        for key, field in value.items():
+            if key in _ID_FIELDS and isinstance(field, str):
+                value[key] = convert(field)
+            else:
+                _convert_ids(field, convert)
+    elif isinstance(value, list):
+        for field in value:
+            _convert_ids(field, convert)
+    return value
+
+
+def request_to_json(request: bytes, signal: str) -> str:
+    """Convert a serialized export request to a line of OTLP/JSON"""
+    message = SIGNALS[signal][0]()
+    message.ParseFromString(request)
+    request_dict = MessageToDict(message, use_integers_for_enums=True)
+    _convert_ids(request_dict, lambda field: base64.b64decode(field).hex())
+    return json.dumps(request_dict, separators=(",", ":"))
+
+
+def request_from_json(line: str, signal: str) -> bytes:
+    """Convert a line of OTLP/JSON to a serialized export request"""
+    request_dict = _convert_ids(
+        json.loads(line), lambda field: base64.b64encode(bytes.fromhex(field)).decode("ascii"))
+    message = ParseDict(request_dict, SIGNALS[signal][0](), ignore_unknown_fields=True)
+    return message.SerializeToString()
+
+
+def _check_compression(compression: str) -> None:
+    if compression not in FILE_COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression}")
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("zstd compression requires the zstandard package")
+
+
+def _open(path: Path, mode: str, compression: str) -> _BinaryFile:
+    if compression == "gzip":
+        return gzip.GzipFile(path, mode)
+    if compression == "zstd":
+        if "w" in mode:
+            return zstandard.ZstdCompressor().stream_writer(open(path, mode))  # pylint: disable=consider-using-with
+        # Buffered to iterate over the lines of JSON files
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(open(path, mode)))  # pylint: disable=consider-using-with
+    return open(path, mode)  # pylint: disable=consider-using-with
+
+
+class OTLPFileWriter:
+    """Append export requests of one signal to rotated OTLP files
+    Args:
+        output_folder: Folder of the files, created if needed
+        signal: "traces", "metrics" or "logs"
+        file_format: "proto" for length-delimited protobuf, "json" for OTLP/JSON lines
+        compression: "none", "gzip" or "zstd"
+        max_file_bytes: Uncompressed size after which a new file is started
+    """
+
+    def __init__(
+        self,
+        output_folder: Path,
+        signal: str,
+        file_format: str = "proto",
+        compression: str = "none",
+        max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+    ):
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"Unknown OTLP file format {file_format}")
+        _check_compression(compression)
+        self._output_folder = Path(output_folder)
+        self._signal = signal
+        self._file_format = file_format
+        self._compression = compression
+        self._max_file_bytes = max_file_bytes
+
+        self._lock = threading.Lock()
+        self._file: Optional[_BinaryFile] = None
+        self._file_bytes = 0
+        self._file_index = 0
+        self.paths: List[Path] = []
+
+    def _open_next_file(self) -> _BinaryFile:
+        self._output_folder.mkdir(parents=True, exist_ok=True)
+        # Several replay processes can write to the same folder
+        path = self._output_folder / (
+            f"{self._signal}-{os.getpid()}-{self._file_index:05d}"
+            f"{_FORMAT_EXTENSIONS[self._file_format]}{_COMPRESSION_EXTENSIONS[self._compression]}")
+        self._file_index += 1
+        self._file = _open(path, "wb", self._compression)
+        self._file_bytes = 0
+        self.paths.append(path)
+        return self._file
+
+    def write(self, request: bytes) -> None:
+        """Append a serialized export request"""
+        if self._file_format == "json":
+            record = request_to_json(request, self._signal).encode("utf-8") + b"\n"
+        else:
+            record = encode_varint(len(request)) + request
+        with self._lock:
+            otlp_file = self._file
+            if otlp_file is not None and self._file_bytes + len(record) > self._max_file_bytes:
+                otlp_file.close()
+                otlp_file = self._file = None
+            if otlp_file is None:
+                otlp_file = self._open_next_file()
+            otlp_file.write(record)
+            self._file_bytes += len(record)
+
+    def close(self) -> None:
+        """Close the current file. Later writes start a new one."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class OTLPFileExporter:
+    """Exporter writing its requests with an OTLPFileWriter. It can replace
+    the OTLP gRPC exporters in an ExportEngine.
+    Args:
+        writer: Writer shared by all the exporters of a signal
+        signal: "traces", "metrics" or "logs"
+    """
+
+    def __init__(self, writer: OTLPFileWriter, signal: str):
+        self._writer = writer
+        self._request_class, self._result = SIGNALS[signal]
+        self._exporting = signal
+        # Read by the metrics aggregator, which then keeps cumulative temporalities
+        self._preferred_temporality: Dict[type, AggregationTemporality] = {}
+
+    def _write(self, request: bytes):
+        try:
+            self._writer.write(request)
+        except OSError:
+            logging.exception("Unable to write %s to an OTLP file", self._exporting)
+            return self._result.FAILURE
+        return self._result.SUCCESS
+
+    def export(self, resources: Sequence, failed: Optional[List[bytes]] = None):
+        """Write resources, which are serialized to failed if the write fails"""
+        request = self._request_class()
+        getattr(request, self._request_class.DESCRIPTOR.fields[0].name).extend(resources)
+        result = self._write(request.SerializeToString())
+        if result != self._result.SUCCESS and failed is not None:
+            failed.extend(resource.SerializeToString() for resource in resources)
+        return result
+
+    def export_serialized(self, payloads: Sequence[bytes], failed: Optional[List[bytes]] = None):
+        """Write serialized resources without decoding them. They are
+        appended to failed if the write fails."""
+        result = self._write(encode_request(payloads))
+        if result != self._result.SUCCESS and failed is not None:
+            failed.extend(payloads)
+        return result
+
+    def force_flush(self, timeout_millis: float = 10_000) -> bool:  # pylint: disable=unused-argument
+        return True
+
+    def shutdown(self) -> None:
+        self._writer.close()
+
+
+def file_signal(path: Path) -> Optional[str]:
+    """Signal of an OTLP file written by OTLPFileWriter, from its name"""
+    signal = path.name.split("-", 1)[0]
+    return signal if signal in SIGNALS else None
+
+
+def file_format_and_compression(path: Path):
+    """Format and compression of an OTLP file, from its extensions"""
+    suffixes = path.suffixes
+    compression = "none"
+    for name, extension in _COMPRESSION_EXTENSIONS.items():
+        if extension and suffixes and suffixes[-1] == extension:
+            compression = name
+            suffixes = suffixes[:-1]
+    file_format = "json" if suffixes and suffixes[-1] in (".jsonl", ".json") else "proto"
+    return file_format, compression
+
+
+def iter_file_requests(path: Path, signal: str) -> Iterator[bytes]:
+    """Yield the serialized export requests stored in an OTLP file"""
+    file_format, compression = file_format_and_compression(path)
+    _check_compression(compression)
+    with _open(path, "rb", compression) as otlp_file:
+        if file_format == "json":
+            for line in otlp_file:
+                if line.strip():
+                    yield request_from_json(line.decode("utf-8"), signal)
+            return
+
+        buffer = b""
+        position = 0
+        while True:
+            chunk = otlp_file.read(_READ_CHUNK_BYTES)
+            buffer = buffer[position:] + chunk
+            position = 0
+            while position < len(buffer):
+                try:
+                    length, start = decode_varint(buffer, position)
+                except DecodeError:
+                    # Length prefix split across chunks
+                    break
+                if start + length > len(buffer):
+                    break
+                yield buffer[start:start + length]
+                position = start + length
+            if not chunk:
+                if position < len(buffer):
+                    raise DecodeError(f"Truncated request at the end of {path}")
+                return
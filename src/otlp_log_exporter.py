@@ -1,11 +1,12 @@
+import logging
 from os import environ
-from typing import Optional, Sequence
+from typing import List, Optional, Sequence, Union
 
 from grpc import ChannelCredentials, Compression
 from opentelemetry.exporter.otlp.proto.grpc.exporter import (
     OTLPExporterMixin, _get_credentials, environ_to_compression)
-from opentelemetry.proto.collector.logs.v1.logs_service_pb2 import \
-    ExportLogsServiceRequest
+from opentelemetry.proto.collector.logs.v1.logs_service_pb2 import (
+    ExportLogsServiceRequest, ExportLogsServiceResponse)
 from opentelemetry.proto.collector.logs.v1.logs_service_pb2_grpc import \
     LogsServiceStub
 from opentelemetry.proto.logs.v1.logs_pb2 import ResourceLogs
@@ -17,6 +18,10 @@ from opentelemetry.sdk.environment_variables import (
     OTEL_EXPORTER_OTLP_LOGS_HEADERS, OTEL_EXPORTER_OTLP_LOGS_INSECURE,
     OTEL_EXPORTER_OTLP_LOGS_TIMEOUT)
 
+from otlp_raw import encode_request, with_serialized_export
+from otlp_split import (DEFAULT_MAX_EXPORT_REQUEST_BYTES, split_resources,
+                        split_serialized)
+
 
 # pylint: disable=no-member
 class OTLPLogExporter(
@@ -34,10 +39,18 @@ class OTLPLogExporter(
         headers: Headers to send when exporting
         timeout: Backend request timeout in seconds
         compression: gRPC compression method to use
+        max_export_batch_size: Maximum number of log records to export in a single request.
+            If not set there is no limit, otherwise bigger requests are split.
+        max_export_batch_bytes: Maximum serialized size of a single request, to stay under
+            gRPC's 4MB message size limit. Bigger requests are split.
     """
 
     _result = LogExportResult
-    _stub = LogsServiceStub
+    _stub = with_serialized_export(
+        LogsServiceStub,
+        "/opentelemetry.proto.collector.logs.v1.LogsService/Export",
+        ExportLogsServiceResponse,
+    )
 
     def __init__(
         self,
@@ -47,6 +60,8 @@ class OTLPLogExporter(
         headers: Optional[Sequence] = None,
         timeout: Optional[int] = None,
         compression: Optional[Compression] = None,
+        max_export_batch_size: Optional[int] = None,
+        max_export_batch_bytes: Optional[int] = DEFAULT_MAX_EXPORT_REQUEST_BYTES,
     ):
 
         if insecure is None:
@@ -87,22 +102,72 @@ class OTLPLogExporter(
             }
         )
 
-    def _translate_data(
-        self, data: Sequence[ResourceLogs]
-    ) -> ExportLogsServiceRequest:
+        self._max_export_batch_size: Optional[int] = max_export_batch_size
+        self._max_export_batch_bytes: Optional[int] = max_export_batch_bytes
+
+    # Serialized requests pass through, which the generic base class does not expect
+    def _translate_data(  # type: ignore[override]
+        self, data: Union[Sequence[ResourceLogs], bytes]
+    ) -> Union[ExportLogsServiceRequest, bytes]:
+        if isinstance(data, bytes):
+            # Request already serialized by export_serialized
+            return data
         return ExportLogsServiceRequest(
             resource_logs=data
         )
 
-    def export(self, logs: Sequence[ResourceLogs]) -> LogExportResult:
-        return self._export(logs)
+    def export(
+        self, logs: Sequence[ResourceLogs], failed: Optional[List[bytes]] = None,
+    ) -> LogExportResult:
+        """Export ResourceLogs, split in several requests if needed. The
+        resources of the requests that failed are serialized to failed."""
+        result = LogExportResult.SUCCESS
+        for chunk in split_resources(
+                logs, self._max_export_batch_size, self._max_export_batch_bytes):
+            if self._export(chunk) != LogExportResult.SUCCESS:
+                result = LogExportResult.FAILURE
+                if failed is not None:
+                    failed.extend(resource.SerializeToString() for resource in chunk)
+        return result
+
+    def export_serialized(
+        self, payloads: Sequence[bytes], failed: Optional[List[bytes]] = None,
+    ) -> LogExportResult:
+        """Export serialized ResourceLogs without decoding them. The payloads
+        of the requests that failed are appended to failed, but not the
+        payloads that could not be decoded to be counted or split."""
+        result = LogExportResult.SUCCESS
+        invalid: List[bytes] = []
+        for chunk in split_serialized(
+                payloads, ResourceLogs, self._max_export_batch_size, self._max_export_batch_bytes, invalid):
+            if self._export(encode_request(chunk)) != LogExportResult.SUCCESS:
+                result = LogExportResult.FAILURE
+                if failed is not None:
+                    failed.extend(chunk)
+        if invalid:
+            logging.error("Dropping %d %s payloads that could not be decoded", len(invalid), self._exporting)
+            result = LogExportResult.FAILURE
+        return result
 
-    def force_flush(self, timeout_millis: int = 30000) -> bool:
+    def force_flush(self, timeout_millis: float = 30_000) -> bool:
+        """Wait for the export in progress, if any. Exports are synchronous,
+        nothing else is buffered by the exporter."""
+        if not self._export_lock.acquire(timeout=timeout_millis / 1e3):
+            return False
+        self._export_lock.release()
         return True
 
     @property
     def _exporting(self):
         return "logs"
 
-    def shutdown(self):
-        pass
+    def shutdown(self, timeout_millis: float = 30_000, **kwargs) -> None:
+        """Wait for the export in progress, if any, then close the channel"""
+        if self._shutdown:
+            return
+        acquired = self._export_lock.acquire(timeout=timeout_millis / 1e3)
+        # Also stops the retries of an export still in progress
+        self._shutdown = True
+        if acquired:
+            self._export_lock.release()
+        self._client.close()
@@ -1,5 +1,6 @@
+import logging
 from os import environ
-from typing import Dict, Optional, Sequence
+from typing import Dict, List, Optional, Sequence, Union
 from grpc import ChannelCredentials, Compression
 from opentelemetry.sdk.metrics._internal.aggregation import Aggregation
 from opentelemetry.exporter.otlp.proto.grpc.exporter import (
@@ -9,6 +10,7 @@ from opentelemetry.exporter.otlp.proto.grpc.exporter import (
 )
 from opentelemetry.proto.collector.metrics.v1.metrics_service_pb2 import (
     ExportMetricsServiceRequest,
+    ExportMetricsServiceResponse,
 )
 from opentelemetry.proto.collector.metrics.v1.metrics_service_pb2_grpc import (
     MetricsServiceStub,
@@ -37,6 +39,10 @@ from opentelemetry.sdk.metrics.export import (
     MetricExportResult
 )
 
+from otlp_raw import encode_request, with_serialized_export
+from otlp_split import (DEFAULT_MAX_EXPORT_REQUEST_BYTES, split_resources,
+                        split_serialized)
+
 
 class OTLPMetricExporter(
     MetricExporter,
@@ -49,10 +55,15 @@ class OTLPMetricExporter(
         max_export_batch_size: Maximum number of data points to export in a single request. This is to deal with
             gRPC's 4MB message size limit. If not set there is no limit to the number of data points in a request.
             If it is set and the number of data points exceeds the max, the request will be split.
+        max_export_batch_bytes: Maximum serialized size of a single request. Bigger requests are split.
     """
 
     _result = MetricExportResult
-    _stub = MetricsServiceStub
+    _stub = with_serialized_export(
+        MetricsServiceStub,
+        "/opentelemetry.proto.collector.metrics.v1.MetricsService/Export",
+        ExportMetricsServiceResponse,
+    )
 
     def __init__(
         self,
@@ -65,6 +76,7 @@ class OTLPMetricExporter(
         preferred_temporality: Dict[type, AggregationTemporality] = None,
         preferred_aggregation: Dict[type, Aggregation] = None,
         max_export_batch_size: Optional[int] = None,
+        max_export_batch_bytes: Optional[int] = DEFAULT_MAX_EXPORT_REQUEST_BYTES,
     ):
 
         if insecure is None:
@@ -139,26 +151,71 @@ class OTLPMetricExporter(
         )
 
         self._max_export_batch_size: Optional[int] = max_export_batch_size
-
-    def _translate_data(
-        self, data: Sequence[ResourceMetrics]
-    ) -> ExportMetricsServiceRequest:
+        self._max_export_batch_bytes: Optional[int] = max_export_batch_bytes
+
+    # Serialized requests pass through, which the generic base class does not expect
+    def _translate_data(  # type: ignore[override]
+        self, data: Union[Sequence[ResourceMetrics], bytes]
+    ) -> Union[ExportMetricsServiceRequest, bytes]:
+        if isinstance(data, bytes):
+            # Request already serialized by export_serialized
+            return data
         return ExportMetricsServiceRequest(
             resource_metrics=data
         )
 
     def export(
-        self,
-        metrics: Sequence[ResourceMetrics],
+        self, metrics: Sequence[ResourceMetrics], failed: Optional[List[bytes]] = None,
+    ) -> MetricExportResult:
+        """Export ResourceMetrics, split in several requests if needed. The
+        resources of the requests that failed are serialized to failed."""
+        result = MetricExportResult.SUCCESS
+        for chunk in split_resources(
+                metrics, self._max_export_batch_size, self._max_export_batch_bytes):
+            if self._export(chunk) != MetricExportResult.SUCCESS:
+                result = MetricExportResult.FAILURE
+                if failed is not None:
+                    failed.extend(resource.SerializeToString() for resource in chunk)
+        return result
+
+    def export_serialized(
+        self, payloads: Sequence[bytes], failed: Optional[List[bytes]] = None,
     ) -> MetricExportResult:
-        return self._export(metrics)
+        """Export serialized ResourceMetrics without decoding them. The payloads
+        of the requests that failed are appended to failed, but not the
+        payloads that could not be decoded to be counted or split."""
+        result = MetricExportResult.SUCCESS
+        invalid: List[bytes] = []
+        for chunk in split_serialized(
+                payloads, ResourceMetrics, self._max_export_batch_size, self._max_export_batch_bytes, invalid):
+            if self._export(encode_request(chunk)) != MetricExportResult.SUCCESS:
+                result = MetricExportResult.FAILURE
+                if failed is not None:
+                    failed.extend(chunk)
+        if invalid:
+            logging.error("Dropping %d %s payloads that could not be decoded", len(invalid), self._exporting)
+            result = MetricExportResult.FAILURE
+        return result
 
     def shutdown(self, timeout_millis: float = 30_000, **kwargs) -> None:
-        pass
+        """Wait for the export in progress, if any, then close the channel"""
+        if self._shutdown:
+            return
+        acquired = self._export_lock.acquire(timeout=timeout_millis / 1e3)
+        # Also stops the retries of an export still in progress
+        self._shutdown = True
+        if acquired:
+            self._export_lock.release()
+        self._client.close()
 
     @property
     def _exporting(self) -> str:
         return "metrics"
 
     def force_flush(self, timeout_millis: float = 10_000) -> bool:
+        """Wait for the export in progress, if any. Exports are synchronous,
+        nothing else is buffered by the exporter."""
+        if not self._export_lock.acquire(timeout=timeout_millis / 1e3):
+            return False
+        self._export_lock.release()
         return True
@@ -0,0 +1,212 @@
+"""
+otlp_raw.py
+
+Build OTLP export requests from already serialized resources.
+
+Export{Trace,Metrics,Logs}ServiceRequest only hold a repeated length-delimited
+resource_{spans,metrics,logs} field with number 1. The wire request is
+therefore the concatenation of the serialized resources, each one prefixed by
+the field tag and its length, and can be assembled without decoding them.
+"""
+from typing import Iterator, List, Sequence, Tuple
+
+from google.protobuf.message import DecodeError
+
+# Field number 1, wire type LEN
+RESOURCES_FIELD_TAG = b"\x0a"
+
+WIRE_TYPE_VARINT = 0
+WIRE_TYPE_I64 = 1
+WIRE_TYPE_LEN = 2
+WIRE_TYPE_I32 = 5
+
+# Span.trace_id = 1, span_id = 2, parent_span_id = 4
+_SPAN_ID_FIELDS = {1: 0, 2: 1, 4: 2}
+
+# Metric.gauge = 5, sum = 7, histogram = 9, exponential_histogram = 10, summary = 11
+_METRIC_DATA_FIELDS = (5, 7, 9, 10, 11)
+
+
+def encode_varint(value: int) -> bytes:
+    """Encode a non negative integer as a protobuf varint"""
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def varint_size(value: int) -> int:
+    """Number of bytes needed to encode value as a protobuf varint"""
+    size = 1
+    while value > 0x7F:
+        value >>= 7
+        size += 1
+    return size
+
+
+def repeated_field_size(payload_size: int) -> int:
+    """Size of a length-delimited item in a repeated field, tag included"""
+    return 1 + varint_size(payload_size) + payload_size
+
+
+def decode_varint(buffer: bytes, position: int) -> Tuple[int, int]:
+    """Decode the varint at position, return its value and the next position"""
+    value = 0
+    shift = 0
+    while True:
+        if position >= len(buffer) or shift > 63:
+            raise DecodeError("Truncated or invalid varint")
+        byte = buffer[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def encode_request(payloads: Sequence[bytes]) -> bytes:
+    """Serialize an export request holding the serialized resources payloads"""
+    chunks = []
+    for payload in payloads:
+        chunks.append(RESOURCES_FIELD_TAG)
+        chunks.append(encode_varint(len(payload)))
+        chunks.append(payload)
+    return b"".join(chunks)
+
+
+def decode_request(request: bytes) -> List[bytes]:
+    """Split a serialized export request into its serialized resources"""
+    return [
+        request[value_start:value_end]
+        for field_number, wire_type, value_start, value_end in iter_fields(request)
+        if field_number == 1 and wire_type == WIRE_TYPE_LEN
+    ]
+
+
+def iter_fields(buffer: bytes, start: int = 0, end: int = -1) -> Iterator[Tuple[int, int, int, int]]:
+    """Walk the fields of a serialized message without decoding their values.
+    Yield the field number, wire type, and the bounds of the field value."""
+    if end < 0:
+        end = len(buffer)
+    position = start
+    while position < end:
+        tag, position = decode_varint(buffer, position)
+        field_number, wire_type = tag >> 3, tag & 0x07
+        if field_number == 0:
+            raise DecodeError("Invalid field number 0")
+        if wire_type == WIRE_TYPE_VARINT:
+            value_start = position
+            _, position = decode_varint(buffer, position)
+        elif wire_type == WIRE_TYPE_I64:
+            value_start = position
+            position += 8
+        elif wire_type == WIRE_TYPE_LEN:
+            length, value_start = decode_varint(buffer, position)
+            position = value_start + length
+        elif wire_type == WIRE_TYPE_I32:
+            value_start = position
+            position += 4
+        else:
+            raise DecodeError(f"Unsupported wire type {wire_type}")
+        if position > end:
+            raise DecodeError("Truncated field")
+        yield field_number, wire_type, value_start, position
+
+
+def validate_resource_payload(payload: bytes) -> bool:
+    """Light validation of a serialized ResourceSpans, ResourceMetrics or ResourceLogs.
+
+    Check the framing of the message and of its resource and scope
+    submessages, without decoding spans, metrics or logs."""
+    try:
+        for field_number, wire_type, value_start, value_end in iter_fields(payload):
+            # resource = 1, scope_{spans,metrics,logs} = 2, schema_url = 3
+            if field_number not in (1, 2, 3) or wire_type != WIRE_TYPE_LEN:
+                return False
+            if field_number in (1, 2):
+                for _ in iter_fields(payload, value_start, value_end):
+                    pass
+    except DecodeError:
+        return False
+    return True
+
+
+def iter_span_ids(payload: bytes) -> Iterator[Tuple[bytes, bytes, bytes]]:
+    """Trace id, span id and parent span id of the spans of a serialized
+    ResourceSpans, without decoding it"""
+    # ResourceSpans.scope_spans = 2, ScopeSpans.spans = 2
+    for field_number, wire_type, scope_start, scope_end in iter_fields(payload):
+        if field_number != 2 or wire_type != WIRE_TYPE_LEN:
+            continue
+        for field_number, wire_type, span_start, span_end in iter_fields(payload, scope_start, scope_end):
+            if field_number != 2 or wire_type != WIRE_TYPE_LEN:
+                continue
+            ids = [b"", b"", b""]
+            for field_number, wire_type, value_start, value_end in iter_fields(payload, span_start, span_end):
+                if wire_type == WIRE_TYPE_LEN and field_number in _SPAN_ID_FIELDS:
+                    ids[_SPAN_ID_FIELDS[field_number]] = payload[value_start:value_end]
+            yield ids[0], ids[1], ids[2]
+
+
+def count_payload_items(payload: bytes, metrics: bool = False) -> int:
+    """Number of spans or log records of a serialized ResourceSpans or
+    ResourceLogs, or of data points of a ResourceMetrics if metrics is set,
+    without decoding it"""
+    n_items = 0
+    # Resource{Spans,Metrics,Logs}.scope_* = 2, Scope{Spans,Metrics,Logs}.{spans,metrics,log_records} = 2
+    for field_number, wire_type, scope_start, scope_end in iter_fields(payload):
+        if field_number != 2 or wire_type != WIRE_TYPE_LEN:
+            continue
+        for field_number, wire_type, item_start, item_end in iter_fields(payload, scope_start, scope_end):
+            if field_number != 2 or wire_type != WIRE_TYPE_LEN:
+                continue
+            if not metrics:
+                n_items += 1
+                continue
+            for field_number, wire_type, data_start, data_end in iter_fields(payload, item_start, item_end):
+                if field_number not in _METRIC_DATA_FIELDS or wire_type != WIRE_TYPE_LEN:
+                    continue
+                # {Gauge,Sum,Histogram,ExponentialHistogram,Summary}.data_points = 1
+                n_items += sum(1 for field_number, wire_type, _, _ in iter_fields(payload, data_start, data_end)
+                               if field_number == 1 and wire_type == WIRE_TYPE_LEN)
+    return n_items
+
+
+class _ExportCallable:
+    """Send export requests as messages, or as bytes when already serialized"""
+
+    def __init__(self, export, export_serialized):
+        self._export = export
+        self._export_serialized = export_serialized
+
+    def __call__(self, request, *args, **kwargs):
+        if isinstance(request, bytes):
+            return self._export_serialized(request, *args, **kwargs)
+        return self._export(request, *args, **kwargs)
+
+
+def with_serialized_export(stub_class, method: str, response_class):
+    """Extend a generated OTLP service stub so that its Export method also
+    accepts serialized requests, which are sent without being encoded again"""
+
+    class SerializedExportStub(stub_class):
+        # pylint: disable=too-few-public-methods,invalid-name
+        def __init__(self, channel):
+            super().__init__(channel)
+            self._channel = channel
+            self.Export = _ExportCallable(
+                self.Export,
+                channel.unary_unary(
+                    method,
+                    request_serializer=None,
+                    response_deserializer=response_class.FromString,
+                ))
+
+        def close(self) -> None:
+            """Close the channel of the stub"""
+            self._channel.close()
+
+    SerializedExportStub.__name__ = stub_class.__name__
+    return SerializedExportStub
@@ -4,14 +4,15 @@ otlp_span_exporter.py
 The OTLP GRPC exporter class
 """
 
+import logging
 from os import environ
-from typing import Optional, Sequence
+from typing import List, Optional, Sequence, Union
 
 from grpc import ChannelCredentials, Compression
 from opentelemetry.exporter.otlp.proto.grpc.exporter import (
     OTLPExporterMixin, _get_credentials, environ_to_compression)
-from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import \
-    ExportTraceServiceRequest
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import (
+    ExportTraceServiceRequest, ExportTraceServiceResponse)
 from opentelemetry.proto.collector.trace.v1.trace_service_pb2_grpc import \
     TraceServiceStub
 from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
@@ -22,6 +23,10 @@ from opentelemetry.sdk.environment_variables import (
     OTEL_EXPORTER_OTLP_TRACES_TIMEOUT)
 from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
 
+from otlp_raw import encode_request, with_serialized_export
+from otlp_split import (DEFAULT_MAX_EXPORT_REQUEST_BYTES, split_resources,
+                        split_serialized)
+
 
 # pylint: disable=no-member
 class OTLPSpanExporter(
@@ -39,10 +44,18 @@ class OTLPSpanExporter(
         headers: Headers to send when exporting
         timeout: Backend request timeout in seconds
         compression: gRPC compression method to use
+        max_export_batch_size: Maximum number of spans to export in a single request.
+            If not set there is no limit, otherwise bigger requests are split.
+        max_export_batch_bytes: Maximum serialized size of a single request, to stay under
+            gRPC's 4MB message size limit. Bigger requests are split.
     """
 
     _result = SpanExportResult
-    _stub = TraceServiceStub
+    _stub = with_serialized_export(
+        TraceServiceStub,
+        "/opentelemetry.proto.collector.trace.v1.TraceService/Export",
+        ExportTraceServiceResponse,
+    )
 
     def __init__(
         self,
@@ -52,6 +65,8 @@ class OTLPSpanExporter(
         headers: Optional[Sequence] = None,
         timeout: Optional[int] = None,
         compression: Optional[Compression] = None,
+        max_export_batch_size: Optional[int] = None,
+        max_export_batch_bytes: Optional[int] = DEFAULT_MAX_EXPORT_REQUEST_BYTES,
     ):
 
         if insecure is None:
@@ -92,19 +107,72 @@ class OTLPSpanExporter(
             }
         )
 
-    def _translate_data(
-        self, data: Sequence[ResourceSpans]
-    ) -> ExportTraceServiceRequest:
+        self._max_export_batch_size: Optional[int] = max_export_batch_size
+        self._max_export_batch_bytes: Optional[int] = max_export_batch_bytes
+
+    # Serialized requests pass through, which the generic base class does not expect
+    def _translate_data(  # type: ignore[override]
+        self, data: Union[Sequence[ResourceSpans], bytes]
+    ) -> Union[ExportTraceServiceRequest, bytes]:
+        if isinstance(data, bytes):
+            # Request already serialized by export_serialized
+            return data
         return ExportTraceServiceRequest(
             resource_spans=data
         )
 
-    def export(self, spans: Sequence[ResourceSpans]) -> SpanExportResult:
-        return self._export(spans)
-
-    def force_flush(self, timeout_millis: int = 30000) -> bool:
+    def export(
+        self, spans: Sequence[ResourceSpans], failed: Optional[List[bytes]] = None,
+    ) -> SpanExportResult:
+        """Export ResourceSpans, split in several requests if needed. The
+        resources of the requests that failed are serialized to failed."""
+        result = SpanExportResult.SUCCESS
+        for chunk in split_resources(
+                spans, self._max_export_batch_size, self._max_export_batch_bytes):
+            if self._export(chunk) != SpanExportResult.SUCCESS:
+                result = SpanExportResult.FAILURE
+                if failed is not None:
+                    failed.extend(resource.SerializeToString() for resource in chunk)
+        return result
+
+    def export_serialized(
+        self, payloads: Sequence[bytes], failed: Optional[List[bytes]] = None,
+    ) -> SpanExportResult:
+        """Export serialized ResourceSpans without decoding them. The payloads
+        of the requests that failed are appended to failed, but not the
+        payloads that could not be decoded to be counted or split."""
+        result = SpanExportResult.SUCCESS
+        invalid: List[bytes] = []
+        for chunk in split_serialized(
+                payloads, ResourceSpans, self._max_export_batch_size, self._max_export_batch_bytes, invalid):
+            if self._export(encode_request(chunk)) != SpanExportResult.SUCCESS:
+                result = SpanExportResult.FAILURE
+                if failed is not None:
+                    failed.extend(chunk)
+        if invalid:
+            logging.error("Dropping %d %s payloads that could not be decoded", len(invalid), self._exporting)
+            result = SpanExportResult.FAILURE
+        return result
+
+    def force_flush(self, timeout_millis: float = 30_000) -> bool:
+        """Wait for the export in progress, if any. Exports are synchronous,
+        nothing else is buffered by the exporter."""
+        if not self._export_lock.acquire(timeout=timeout_millis / 1e3):
+            return False
+        self._export_lock.release()
         return True
 
+    def shutdown(self, timeout_millis: float = 30_000, **kwargs) -> None:
+        """Wait for the export in progress, if any, then close the channel"""
+        if self._shutdown:
+            return
+        acquired = self._export_lock.acquire(timeout=timeout_millis / 1e3)
+        # Also stops the retries of an export still in progress
+        self._shutdown = True
+        if acquired:
+            self._export_lock.release()
+        self._client.close()
+
     @property
     def _exporting(self):
         return "traces"
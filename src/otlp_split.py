@@ -0,0 +1,202 @@
+"""
+otlp_split.py
+
+Split export requests exceeding an item count or a serialized size.
+
+Chunks only copy the spans, log records or metric data points they hold; the
+resource, scope and metric descriptions are rebuilt for each chunk instead of
+deep copying the whole message. The size of a chunk accounts for these headers
+and for the length prefixes of the nested messages, bounded by the largest
+length a chunk can reach, so that a chunk never exceeds the size limit unless
+it holds a single item larger than it.
+"""
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+from google.protobuf.message import DecodeError
+from opentelemetry.proto.metrics.v1.metrics_pb2 import Metric, ResourceMetrics
+
+from coalescer import SCOPE_FIELDS
+from otlp_raw import count_payload_items, repeated_field_size, varint_size
+
+# gRPC refuses messages larger than 4 MiB by default. Keep some room for
+# the request envelope and headers.
+DEFAULT_MAX_EXPORT_REQUEST_BYTES = 4 * 1024 * 1024 - 64 * 1024
+
+
+def _metric_header(metric: Metric, kind: str) -> Metric:
+    """Copy of a metric of this kind without its data points"""
+    header = Metric(name=metric.name, description=metric.description, unit=metric.unit)
+    data = getattr(metric, kind)
+    header_data = getattr(header, kind)
+    header_data.SetInParent()
+    if kind in ("sum", "histogram", "exponential_histogram"):
+        header_data.aggregation_temporality = data.aggregation_temporality
+    if kind == "sum":
+        header_data.is_monotonic = data.is_monotonic
+    return header
+
+
+def _string_field_size(value: str) -> int:
+    return repeated_field_size(len(value.encode())) if value else 0
+
+
+def _leaf_groups(resource, scope) -> Iterator[Tuple[Optional[Metric], str, Sequence]]:
+    """Yield the items of a scope along with their parent metric and its kind, if any"""
+    if isinstance(resource, ResourceMetrics):
+        for metric in scope.metrics:
+            kind = metric.WhichOneof("data")
+            if kind is not None:
+                yield metric, kind, getattr(metric, kind).data_points
+    else:
+        _, items_field = SCOPE_FIELDS[type(resource)]
+        yield None, "", getattr(scope, items_field)
+
+
+def count_items(resources: Sequence) -> int:
+    """Number of spans, log records or metric data points held by resources"""
+    return sum(
+        len(items)
+        for resource in resources
+        for scope in getattr(resource, SCOPE_FIELDS[type(resource)][0])
+        for _, _, items in _leaf_groups(resource, scope)
+    )
+
+
+def _fits(resources: Sequence, max_items: Optional[int], max_bytes: Optional[int]) -> bool:
+    if max_bytes is not None and sum(
+            repeated_field_size(resource.ByteSize()) for resource in resources) > max_bytes:
+        return False
+    return max_items is None or count_items(resources) <= max_items
+
+
+def split_resources(
+    resources: Sequence,
+    max_items: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+) -> Iterator[List]:
+    """Split resource spans, metrics or logs into chunks of at most max_items
+    spans, log records or data points, and at most max_bytes once serialized.
+    A single item larger than max_bytes gets its own chunk."""
+    if not resources or _fits(resources, max_items, max_bytes):
+        if resources:
+            yield list(resources)
+        return
+
+    resource_type = type(resources[0])
+    scopes_field, items_field = SCOPE_FIELDS[resource_type]
+    # Tag and length of a nested message, whatever length it reaches in a chunk
+    prefix_bytes = 1 + varint_size(max_bytes) if max_bytes is not None else 0
+
+    chunk: List = []
+    n_items = 0
+    n_bytes = 0
+    # Headers of the chunk being built, keyed by their source message
+    current_resource = current_scope = current_metric = None
+    chunk_resource: Any = None
+    chunk_scope: Any = None
+    chunk_metric: Any = None
+
+    for resource in resources:
+        resource_bytes = (prefix_bytes + repeated_field_size(resource.resource.ByteSize())
+                          + _string_field_size(resource.schema_url))
+        for scope in getattr(resource, scopes_field):
+            scope_bytes = (prefix_bytes + repeated_field_size(scope.scope.ByteSize())
+                           + _string_field_size(scope.schema_url))
+            for metric, kind, items in _leaf_groups(resource, scope):
+                metric_header = None
+                metric_bytes = 0
+                if metric is not None:
+                    metric_header = _metric_header(metric, kind)
+                    # The data message of the metric also gets a length prefix
+                    metric_bytes = prefix_bytes + metric_header.ByteSize() + prefix_bytes - 2
+                for item in items:
+                    item_bytes = repeated_field_size(item.ByteSize())
+                    # Headers the item brings along in the chunk
+                    new_resource = current_resource is not resource
+                    new_scope = new_resource or current_scope is not scope
+                    new_metric = metric is not None and (new_scope or current_metric is not metric)
+                    added_bytes = (item_bytes + (resource_bytes if new_resource else 0)
+                                   + (scope_bytes if new_scope else 0) + (metric_bytes if new_metric else 0))
+                    if chunk and ((max_items is not None and n_items + 1 > max_items)
+                                  or (max_bytes is not None and n_bytes + added_bytes > max_bytes)):
+                        yield chunk
+                        chunk = []
+                        n_items = n_bytes = 0
+                        current_resource = current_scope = current_metric = None
+                        new_resource = new_scope = True
+                        new_metric = metric is not None
+                        added_bytes = item_bytes + resource_bytes + scope_bytes + metric_bytes
+
+                    if new_resource:
+                        chunk_resource = resource_type(schema_url=resource.schema_url)
+                        chunk_resource.resource.CopyFrom(resource.resource)
+                        chunk.append(chunk_resource)
+                        current_resource = resource
+                    if new_scope:
+                        chunk_scope = getattr(chunk_resource, scopes_field).add()
+                        chunk_scope.scope.CopyFrom(scope.scope)
+                        chunk_scope.schema_url = scope.schema_url
+                        current_scope = scope
+                    if metric is None:
+                        getattr(chunk_scope, items_field).add().CopyFrom(item)
+                    else:
+                        if new_metric:
+                            chunk_metric = chunk_scope.metrics.add()
+                            chunk_metric.CopyFrom(metric_header)
+                            current_metric = metric
+                        getattr(chunk_metric, kind).data_points.add().CopyFrom(item)
+                    n_items += 1
+                    n_bytes += added_bytes
+
+    if chunk:
+        yield chunk
+
+
+def split_serialized(
+    payloads: Sequence[bytes],
+    resource_type,
+    max_items: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    invalid: Optional[List[bytes]] = None,
+) -> Iterator[List[bytes]]:
+    """Group serialized resources into chunks of at most max_items items and
+    about max_bytes. Payloads are kept whole, except those larger than
+    max_bytes or holding more than max_items items, which are decoded and
+    split. Items are counted from the wire format, without decoding.
+    Payloads that cannot be decoded are appended to invalid, DecodeError is
+    raised without it."""
+    metrics = resource_type is ResourceMetrics
+    chunk: List[bytes] = []
+    n_bytes = 0
+    n_items = 0
+    for payload in payloads:
+        payload_bytes = repeated_field_size(len(payload))
+        try:
+            payload_items = count_payload_items(payload, metrics) if max_items is not None else 0
+            oversized = ((max_bytes is not None and payload_bytes > max_bytes)
+                         or (max_items is not None and payload_items > max_items))
+            resource = resource_type.FromString(payload) if oversized else None
+        except DecodeError:
+            if invalid is None:
+                raise
+            invalid.append(payload)
+            continue
+        if resource is not None:
+            # Keep the requests in order
+            if chunk:
+                yield chunk
+                chunk = []
+                n_bytes = n_items = 0
+            for resources_chunk in split_resources([resource], max_items, max_bytes):
+                yield [chunk_resource.SerializeToString() for chunk_resource in resources_chunk]
+            continue
+        if chunk and ((max_bytes is not None and n_bytes + payload_bytes > max_bytes)
+                      or (max_items is not None and n_items + payload_items > max_items)):
+            yield chunk
+            chunk = []
+            n_bytes = n_items = 0
+        chunk.append(payload)
+        n_bytes += payload_bytes
+        n_items += payload_items
+    if chunk:
+        yield chunk
@@ -0,0 +1,91 @@
+"""
+pacer.py
+
+Replay events following their original CTF timestamps, scaled by a speed factor.
+
+All the ust traces folders of a replay share a single timeline, anchored at
+the earliest timestamp of the folders, so that a folder starting later in the
+traces is also replayed later, and folders replayed in parallel keep their
+relative timing. The anchor is given in wall clock time, which the processes
+replaying folders in parallel have in common. The folders read at once by the
+threads of a process share their Pacer.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+# Sleeping is imprecise, wake up this early and spin until the target time
+SPIN_SECONDS = 0.0005
+
+
+class Pacer:
+    """Schedule events at their original pace
+    Args:
+        speed: Speed factor of the replay: 1 reproduces the original timing,
+            10 replays ten times faster and 0.5 twice slower
+        tick_millis: Events due within a tick are sent without waiting, so
+            that events falling in the same tick are batched together
+    """
+
+    def __init__(
+        self,
+        speed: float = 1.0,
+        tick_millis: float = 1.0,
+    ):
+        if speed <= 0:
+            raise ValueError("The replay speed must be positive")
+        self._speed = speed
+        self._tick = tick_millis / 1e3
+        self._lock = threading.Lock()
+
+        self._origin_timestamp: Optional[int] = None
+        self._origin_time = 0.0
+
+        self.n_events = 0
+        self.n_late = 0
+        self.total_drift = 0.0
+        self.max_drift = 0.0
+
+    def anchor(self, timestamp_ns: int, wall_time: float) -> None:
+        """Start the timeline: the event with this CTF timestamp is due at
+        this time.time(). Otherwise the first event starts it."""
+        self._origin_timestamp = timestamp_ns
+        self._origin_time = time.perf_counter() - (time.time() - wall_time)
+
+    def wait(self, timestamp_ns: int, on_wait: Optional[Callable[[], None]] = None) -> None:
+        """Wait until the event with this CTF timestamp is due. on_wait is
+        called before waiting, to send the events scheduled so far."""
+        now = time.perf_counter()
+        with self._lock:
+            if self._origin_timestamp is None:
+                self._origin_timestamp = timestamp_ns
+                self._origin_time = now
+            target = self._origin_time + (timestamp_ns - self._origin_timestamp) / 1e9 / self._speed
+
+        if target - now > self._tick:
+            if on_wait is not None:
+                on_wait()
+            remaining = target - time.perf_counter()
+            if remaining > SPIN_SECONDS:
+                time.sleep(remaining - SPIN_SECONDS)
+            while time.perf_counter() < target:
+                pass
+            now = time.perf_counter()
+
+        # Positive drift means the event is sent after its target time
+        drift = now - target
+        with self._lock:
+            self.n_events += 1
+            self.total_drift += abs(drift)
+            self.max_drift = max(self.max_drift, drift)
+            if drift > self._tick:
+                self.n_late += 1
+
+    def report(self) -> None:
+        """Log the drift between the target and the actual schedule"""
+        if not self.n_events:
+            return
+        logging.info(
+            "Paced %d events: mean drift %.3f ms, max drift %.3f ms, %d events late by more than a tick.",
+            self.n_events, self.total_drift / self.n_events * 1e3, self.max_drift * 1e3, self.n_late)
@@ -0,0 +1,212 @@
+"""
+payload_cache.py
+
+Cache the opentelemetry-c payloads extracted from ust traces folders, so that
+replaying the same traces again skips the CTF decoding.
+
+An entry is addressed by the path of the folder and the size and modification
+time of its files. It is made of two files:
+- "<key>.seg" holds the payloads, back to back.
+- "<key>.idx" holds a header, the event names table and one fixed size
+  record per event: payload offset and length, timestamp and event name index.
+Both files are memory-mapped when read. Entries are evicted in least recently
+used order once the cache exceeds its maximum size.
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_MAX_CACHE_BYTES = 10 * 1024 * 1024 * 1024
+
+_MAGIC = b"OTPC"
+_VERSION = 1
+# Magic, version, number of records, begin and end timestamps, names table size
+_HEADER = struct.Struct("<4sIQqqI")
+# Payload offset, payload length, timestamp, event name index
+_RECORD = struct.Struct("<QIqH")
+
+
+def folder_key(ust_traces_folder: str) -> str:
+    """Key of a ust traces folder, changing whenever one of its files changes"""
+    folder = os.path.abspath(ust_traces_folder)
+    digest = hashlib.sha256(folder.encode())
+    for directory, _, file_names in sorted(os.walk(folder)):
+        for file_name in sorted(file_names):
+            path = os.path.join(directory, file_name)
+            stat = os.stat(path)
+            digest.update(f"\0{os.path.relpath(path, folder)}\0{stat.st_size}\0{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+class CachedFolder:
+    """Events of a ust traces folder read from the cache
+    Args:
+        index_path: Path of the index file of the entry
+    """
+
+    def __init__(self, index_path: Path):
+        with open(index_path, "rb") as index_file:
+            self._index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.n_records, begin, end, names_size = _HEADER.unpack_from(self._index)
+        if magic != _MAGIC or version != _VERSION:
+            self._index.close()
+            raise ValueError(f"{index_path} is not a payload cache index")
+        self.time_range: Optional[Tuple[int, int]] = (begin, end) if self.n_records else None
+        self._names: List[str] = json.loads(self._index[_HEADER.size:_HEADER.size + names_size])
+        self._records_start = _HEADER.size + names_size
+
+        self._segment: Optional[mmap.mmap] = None
+        segment_path = index_path.with_suffix(".seg")
+        if segment_path.stat().st_size:
+            with open(segment_path, "rb") as segment_file:
+                self._segment = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __iter__(self) -> Iterator[Tuple[str, int, bytes]]:
+        """Yield the event name, timestamp and payload of each event"""
+        names = self._names
+        index = self._index
+        # Without segment, every payload is empty
+        segment = self._segment if self._segment is not None else b""
+        unpack_record = _RECORD.unpack_from
+        records_end = self._records_start + self.n_records * _RECORD.size
+        for position in range(self._records_start, records_end, _RECORD.size):
+            offset, length, timestamp, name_index = unpack_record(index, position)
+            # Slicing copies the payload out of the mapping
+            payload = segment[offset:offset + length] if length else b""
+            yield names[name_index], timestamp, payload
+
+    def close(self) -> None:
+        """Unmap the entry files"""
+        self._index.close()
+        if self._segment is not None:
+            self._segment.close()
+
+
+class PayloadCacheWriter:
+    """Record the events of a ust traces folder into a new cache entry.
+    The entry only becomes visible once committed.
+    Args:
+        cache: Cache receiving the entry
+        key: Key of the ust traces folder
+    """
+
+    def __init__(self, cache: "PayloadCache", key: str):
+        self._cache = cache
+        self._key = key
+        self._index_path = cache.cache_dir / f"{key}.idx"
+        self._segment_path = cache.cache_dir / f"{key}.seg"
+        self._suffix = f".{os.getpid()}.tmp"
+        cache.cache_dir.mkdir(parents=True, exist_ok=True)
+        # pylint: disable=consider-using-with
+        self._segment = open(str(self._segment_path) + self._suffix, "wb")
+        self._records = open(str(self._index_path) + self._suffix + ".records", "wb")
+        self._names: Dict[str, int] = {}
+        self._offset = 0
+        self._n_records = 0
+        self._begin = 0
+        self._end = 0
+
+    def add(self, name: str, timestamp: int, payload: bytes) -> None:
+        """Append an event"""
+        name_index = self._names.setdefault(name, len(self._names))
+        self._segment.write(payload)
+        self._records.write(_RECORD.pack(self._offset, len(payload), timestamp, name_index))
+        self._offset += len(payload)
+        if not self._n_records:
+            self._begin = timestamp
+        self._end = timestamp
+        self._n_records += 1
+
+    def commit(self) -> None:
+        """Make the entry visible, then evict old entries if the cache is full"""
+        self._segment.close()
+        self._records.close()
+        records_path = str(self._index_path) + self._suffix + ".records"
+        names = json.dumps(list(self._names)).encode()
+        index_temporary_path = str(self._index_path) + self._suffix
+        with open(index_temporary_path, "wb") as index_file, open(records_path, "rb") as records_file:
+            index_file.write(_HEADER.pack(_MAGIC, _VERSION, self._n_records, self._begin, self._end, len(names)))
+            index_file.write(names)
+            while True:
+                chunk = records_file.read(1024 * 1024)
+                if not chunk:
+                    break
+                index_file.write(chunk)
+        os.remove(records_path)
+        # The index is renamed last, its presence means the entry is complete
+        os.replace(str(self._segment_path) + self._suffix, self._segment_path)
+        os.replace(index_temporary_path, self._index_path)
+        self._cache.evict(keep=self._key)
+
+    def abort(self) -> None:
+        """Discard the entry"""
+        self._segment.close()
+        self._records.close()
+        for path in (str(self._segment_path) + self._suffix, str(self._index_path) + self._suffix + ".records"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class PayloadCache:
+    """Content-addressed cache of the payloads of ust traces folders
+    Args:
+        cache_dir: Folder of the cache entries
+        max_bytes: Size of the cache above which the least recently used entries are evicted
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = DEFAULT_MAX_CACHE_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self._max_bytes = max_bytes
+
+    def open(self, key: str) -> Optional[CachedFolder]:
+        """Open the entry of a key, or return None if it is not cached"""
+        index_path = self.cache_dir / f"{key}.idx"
+        try:
+            cached_folder = CachedFolder(index_path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error):
+            logging.warning("Ignoring unreadable payload cache entry %s", index_path)
+            return None
+        # The modification time of the index tracks the last use of the entry
+        os.utime(index_path)
+        return cached_folder
+
+    def writer(self, key: str) -> PayloadCacheWriter:
+        """Start a new entry for a key"""
+        return PayloadCacheWriter(self, key)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Remove the least recently used entries until the cache fits in its maximum size"""
+        entries = []
+        total_bytes = 0
+        for index_path in self.cache_dir.glob("*.idx"):
+            segment_path = index_path.with_suffix(".seg")
+            try:
+                size = index_path.stat().st_size + segment_path.stat().st_size
+                last_use = index_path.stat().st_mtime
+            except FileNotFoundError:
+                # Evicted by another replay process
+                continue
+            entries.append((last_use, index_path, segment_path, size))
+            total_bytes += size
+
+        for _, index_path, segment_path, size in sorted(entries):
+            if total_bytes <= self._max_bytes:
+                return
+            if index_path.stem == keep:
+                continue
+            logging.info("Evicting payload cache entry %s", index_path.stem)
+            for path in (index_path, segment_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total_bytes -= size
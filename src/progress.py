@@ -0,0 +1,162 @@
+"""
+progress.py
+
+Estimate the replay progress of ust traces folders without decoding them twice.
+"""
+import logging
+import queue
+import time
+from typing import Optional, Tuple
+
+import bt2
+from tqdm.auto import tqdm
+
+PROGRESS_MODES = ("time", "exact", "none")
+
+
+def query_time_range(ust_traces_folder: str) -> Optional[Tuple[int, int]]:
+    """Return the (begin, end) range in ns from origin covered by the streams of
+    a CTF traces folder, using the stream indexes instead of the events"""
+    try:
+        ctf_fs = bt2.find_plugin("ctf").source_component_classes["fs"]
+        trace_infos = bt2.QueryExecutor(
+            ctf_fs, "babeltrace.trace-infos", {"inputs": [ust_traces_folder]}).query()
+    except (bt2._Error, KeyError, TypeError):  # pylint: disable=protected-access
+        logging.warning("Unable to query the time range of %s", ust_traces_folder)
+        return None
+
+    ranges = [
+        (int(stream_info["range-ns"]["begin"]), int(stream_info["range-ns"]["end"]))
+        for trace_info in trace_infos
+        for stream_info in trace_info["stream-infos"]
+        if "range-ns" in stream_info
+    ]
+    if not ranges:
+        return None
+    return min(begin for begin, _ in ranges), max(end for _, end in ranges)
+
+
+class FolderProgress:
+    """Progress of the replay of a single ust traces folder
+    Args:
+        ust_traces_folder: Path of the ust traces folder
+        mode: "time" estimates the progress from the event timestamps relative to
+            the traces time range, "exact" counts all messages up front (decoding
+            the traces twice) and "none" disables progress tracking
+        time_range: Time range of the traces, when already known
+        n_messages: Number of messages of the traces, when already known
+    """
+
+    def __init__(self, ust_traces_folder: str, mode: str = "time",
+                 time_range: Optional[Tuple[int, int]] = None, n_messages: Optional[int] = None):
+        self._mode = mode
+        self._begin = 0
+        self._position = 0
+        self._done = 0.0
+        self.total = 0.0
+
+        if mode == "exact":
+            if n_messages is None:
+                n_messages = sum(1 for _ in bt2.TraceCollectionMessageIterator(ust_traces_folder))
+            self.total = float(n_messages)
+        elif mode == "time":
+            if time_range is None:
+                time_range = query_time_range(ust_traces_folder)
+            if time_range is not None:
+                self._begin, end = time_range
+                self._position = self._begin
+                self.total = (end - self._begin) / 1e9
+
+    def advance(self, msg) -> float:
+        """Account for one message, return the progress made in bar units"""
+        if self._mode == "exact":
+            self._done += 1
+            return 1
+        # pylint: disable=protected-access
+        if self._mode != "time" or not self.total or not isinstance(msg, bt2._EventMessageConst):
+            return 0
+        try:
+            timestamp = msg.default_clock_snapshot.ns_from_origin
+        except (ValueError, OverflowError):
+            return 0
+        return self._advance_to(timestamp)
+
+    def advance_event(self, timestamp: int) -> float:
+        """Account for one event read without bt2, return the progress made in bar units"""
+        if self._mode == "exact":
+            self._done += 1
+            return 1
+        if self._mode != "time" or not self.total:
+            return 0
+        return self._advance_to(timestamp)
+
+    def _advance_to(self, timestamp: int) -> float:
+        if timestamp <= self._position:
+            return 0
+        delta = min((timestamp - self._position) / 1e9, self.total - self._done)
+        self._position = timestamp
+        self._done += delta
+        return delta
+
+    def finish(self) -> float:
+        """Mark the folder as fully replayed, return the remaining progress"""
+        remaining = self.total - self._done
+        self._done = self.total
+        return remaining
+
+
+def progress_unit(mode: str) -> str:
+    """Unit displayed by the progress bar for a progress mode"""
+    return "msg" if mode == "exact" else "s"
+
+
+class ProgressBar(tqdm):
+    """Progress bar whose total grows as ust traces folders are opened"""
+
+    def add_total(self, total: float) -> None:
+        """Increase the total of the progress bar"""
+        self.total += total
+        self.refresh()
+
+    def drain(self, progress_queue) -> None:
+        """Apply the progress reported by worker processes"""
+        while True:
+            try:
+                total, progress = progress_queue.get_nowait()
+            except queue.Empty:
+                return
+            if total:
+                self.add_total(total)
+            if progress:
+                self.update(progress)
+
+
+class RemoteProgressBar:
+    """Report the progress of a worker process to the ProgressBar of the main process
+    Args:
+        progress_queue: Queue drained by ProgressBar.drain
+        min_interval: Minimum time in seconds between two progress reports
+    """
+
+    def __init__(self, progress_queue, min_interval: float = 0.1):
+        self._queue = progress_queue
+        self._min_interval = min_interval
+        self._pending = 0.0
+        self._last_report = time.monotonic()
+
+    def add_total(self, total: float) -> None:
+        """Increase the total of the progress bar"""
+        self._queue.put((total, 0.0))
+
+    def update(self, progress: float) -> None:
+        """Report some progress, grouping updates to limit inter-process traffic"""
+        self._pending += progress
+        if self._pending and time.monotonic() - self._last_report >= self._min_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """Report the pending progress"""
+        if self._pending:
+            self._queue.put((0.0, self._pending))
+            self._pending = 0.0
+        self._last_report = time.monotonic()
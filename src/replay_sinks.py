@@ -0,0 +1,148 @@
+"""
+replay_sinks.py
+
+Destinations of the batches of telemetry data exported by a Replayer.
+
+OTLPSink exports through grpc.aio channels from the event loop and
+OTLPFileSink writes OTLP files. EngineSink hands the batches over to the
+thread pools of export engines, which retry the failed requests, spill them
+to a journal and spread them over several collectors.
+"""
+import abc
+import asyncio
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Union
+
+from export_engine import ExportEngine
+from fanout import FanOutEngine
+from otlp_aio_exporter import (AsyncOTLPLogExporter, AsyncOTLPMetricExporter,
+                               AsyncOTLPSpanExporter)
+from otlp_file import DEFAULT_MAX_FILE_BYTES, OTLPFileExporter, OTLPFileWriter
+
+
+class ReplaySink(abc.ABC):
+    """Destination of the batches of telemetry data of a Replayer. Subclasses
+    implement export, and shutdown when they hold resources."""
+
+    @abc.abstractmethod
+    async def export(self, signal: str, batch: Sequence, serialized: bool) -> bool:
+        """Export a batch of ResourceSpans, ResourceMetrics or ResourceLogs,
+        serialized or not, return whether it succeeded"""
+
+    async def submit(self, signal: str, batch: Sequence, serialized: bool) -> "asyncio.Future[bool]":
+        """Hand a batch over to the sink, return a future of whether its export
+        succeeded. Sinks exporting in the background return as soon as they can
+        take the batch, by default it is exported before returning."""
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(await self.export(signal, batch, serialized))
+        return future
+
+    async def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the batches handed over to be exported, up to timeout seconds
+        for the ones being retried. Return False if some are still pending."""
+        return True
+
+    async def shutdown(self) -> None:
+        """Release the resources of the sink once the replay is done"""
+
+
+class OTLPSink(ReplaySink):
+    """Export to an OpenTelemetry collector with the grpc.aio exporters
+    Args:
+        endpoint: OpenTelemetry Collector receiver endpoint
+        exporter_kwargs: Other arguments of the exporters, such as insecure or headers
+    """
+
+    def __init__(self, endpoint: Optional[str] = None, **exporter_kwargs):
+        self._exporters = {
+            "traces": AsyncOTLPSpanExporter(endpoint, **exporter_kwargs),
+            "metrics": AsyncOTLPMetricExporter(endpoint, **exporter_kwargs),
+            "logs": AsyncOTLPLogExporter(endpoint, **exporter_kwargs),
+        }
+
+    async def export(self, signal: str, batch: Sequence, serialized: bool) -> bool:
+        exporter = self._exporters[signal]
+        if serialized:
+            result = await exporter.export_serialized(batch)
+        else:
+            result = await exporter.export(batch)
+        return result == exporter._result.SUCCESS  # pylint: disable=protected-access
+
+    async def shutdown(self) -> None:
+        await asyncio.gather(*(exporter.shutdown() for exporter in self._exporters.values()))
+
+
+class OTLPFileSink(ReplaySink):
+    """Write the export requests to OTLP files, from a worker thread
+    Args:
+        output_folder: Folder of the files, created if needed
+        file_format: "proto" for length-delimited protobuf, "json" for OTLP/JSON lines
+        compression: "none", "gzip" or "zstd"
+        max_file_bytes: Uncompressed size after which a new file is started
+    """
+
+    def __init__(self, output_folder: Path, file_format: str = "proto", compression: str = "none",
+                 max_file_bytes: int = DEFAULT_MAX_FILE_BYTES):
+        self._exporters = {
+            signal: OTLPFileExporter(
+                OTLPFileWriter(output_folder, signal, file_format, compression, max_file_bytes), signal)
+            for signal in ("traces", "metrics", "logs")
+        }
+
+    async def export(self, signal: str, batch: Sequence, serialized: bool) -> bool:
+        exporter = self._exporters[signal]
+        export = exporter.export_serialized if serialized else exporter.export
+        return await asyncio.to_thread(export, batch) == exporter._result.SUCCESS  # pylint: disable=protected-access
+
+    async def shutdown(self) -> None:
+        for exporter in self._exporters.values():
+            await asyncio.to_thread(exporter.shutdown)
+
+
+def _set_result(future: "asyncio.Future[bool]", success: bool) -> None:
+    if not future.done():
+        future.set_result(success)
+
+
+class EngineSink(ReplaySink):
+    """Export through the export engines of each signal, whose threads keep
+    several requests in flight and retry the failed ones in the background
+    Args:
+        engines: ExportEngine or FanOutEngine of the "traces", "metrics" and "logs" signals.
+            Their serialized setting must match the batches of the Replayer.
+        shutdown_timeout: Maximum time in seconds waited at shutdown for the batches being retried
+    """
+
+    def __init__(self, engines: Dict[str, Union[ExportEngine, FanOutEngine]],
+                 shutdown_timeout: Optional[float] = None):
+        self.engines = engines
+        self._shutdown_timeout = shutdown_timeout
+        # Batches are handed over one at a time, so that ordered engines keep their order
+        self._locks = {signal: asyncio.Lock() for signal in engines}
+
+    async def export(self, signal: str, batch: Sequence, serialized: bool) -> bool:
+        return await (await self.submit(signal, batch, serialized))
+
+    async def submit(self, signal: str, batch: Sequence, serialized: bool) -> "asyncio.Future[bool]":
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def done(_, success: bool) -> None:
+            try:
+                loop.call_soon_threadsafe(_set_result, future, success)
+            except RuntimeError:
+                # The event loop is closed
+                pass
+
+        # Submitting blocks while the in-flight window of the engine is full
+        async with self._locks[signal]:
+            await asyncio.to_thread(self.engines[signal].submit, batch, done)
+        return future
+
+    async def flush(self, timeout: Optional[float] = None) -> bool:
+        return await asyncio.to_thread(
+            lambda: all([engine.force_flush(timeout) for engine in self.engines.values()]))
+
+    async def shutdown(self) -> None:
+        for engine in self.engines.values():
+            await asyncio.to_thread(engine.shutdown, self._shutdown_timeout)
@@ -0,0 +1,99 @@
+"""
+replay_stages.py
+
+Stages transforming the telemetry data of a source between their decoding
+and their batching, in the thread reading the source.
+
+A stage returns the telemetry data to batch along with their size and the
+number of replayed telemetry data each one accounts for, so that the counts
+of the replay stay exact when data are folded, grouped or split.
+"""
+import abc
+from typing import Dict, List, Optional, Tuple
+
+from opentelemetry.sdk.metrics.export import AggregationTemporality
+
+from metrics_aggregator import MetricsAggregator
+from trace_assembler import (DEFAULT_MAX_PENDING_BYTES, DEFAULT_MAX_PENDING_TRACES,
+                             TraceAssembler)
+
+# Telemetry data to batch, its size and the number of replayed telemetry data
+# it accounts for. The telemetry data is None when the replayed ones are left
+# with nothing to export.
+StageOutput = Tuple[Optional[object], int, int]
+
+
+class ReplayStage(abc.ABC):
+    """Transformation of the telemetry data of a signal, created for each source"""
+
+    # Signal whose telemetry data go through the stage
+    signal = ""
+
+    @abc.abstractmethod
+    def add(self, item, size: int, timestamp: Optional[int]) -> List[StageOutput]:
+        """Take a replayed telemetry data of size bytes, read at a timestamp in ns,
+        return the telemetry data to batch"""
+
+    def flush_expired(self) -> List[StageOutput]:
+        """Return the telemetry data held for too long, when no new data arrive"""
+        return []
+
+    @abc.abstractmethod
+    def flush(self) -> List[StageOutput]:
+        """Return all the telemetry data held"""
+
+    def report(self) -> None:
+        """Log a summary of the stage once its source is replayed"""
+
+
+class MetricsAggregationStage(ReplayStage):
+    """Fold the metric data points of decoded ResourceMetrics
+    Args:
+        window_millis: Length of the aggregation window
+        preferred_temporality: Temporality of the exported sums and histograms by instrument class
+    """
+
+    signal = "metrics"
+
+    def __init__(self, window_millis: float, preferred_temporality: Dict[type, AggregationTemporality]):
+        self._aggregator = MetricsAggregator(window_millis, preferred_temporality)
+
+    def add(self, item, size: int, timestamp: Optional[int]) -> List[StageOutput]:
+        return [(resource_metrics, resource_metrics.ByteSize(), n_items)
+                for resource_metrics, n_items in self._aggregator.add(item)]
+
+    def flush(self) -> List[StageOutput]:
+        output: List[StageOutput] = [(resource_metrics, resource_metrics.ByteSize(), n_items)
+                                     for resource_metrics, n_items in self._aggregator.flush()]
+        # Without anything left to fold, the pending ResourceMetrics had no data points
+        if self._aggregator.n_pending:
+            output.append((None, 0, self._aggregator.n_pending))
+            self._aggregator.n_pending = 0
+        return output
+
+
+class TraceAssemblyStage(ReplayStage):
+    """Group the spans of ResourceSpans, serialized or not, by trace
+    Args:
+        window_millis: Maximum CTF time a trace waits for its missing spans
+        max_pending_traces: Maximum number of traces held at once
+        max_pending_bytes: Maximum size of the telemetry data held at once
+    """
+
+    signal = "traces"
+
+    def __init__(self, window_millis: float, max_pending_traces: int = DEFAULT_MAX_PENDING_TRACES,
+                 max_pending_bytes: int = DEFAULT_MAX_PENDING_BYTES):
+        self._assembler = TraceAssembler(window_millis, max_pending_traces, max_pending_bytes)
+
+    def add(self, item, size: int, timestamp: Optional[int]) -> List[StageOutput]:
+        return self._assembler.add(item, size, timestamp)
+
+    def flush_expired(self) -> List[StageOutput]:
+        return self._assembler.flush_expired()
+
+    def flush(self) -> List[StageOutput]:
+        return self._assembler.flush()
+
+    def report(self) -> None:
+        self._assembler.report()
@@ -0,0 +1,196 @@
+"""
+replay_stats.py
+
+Throughput and latency statistics of the replay stages.
+"""
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, TypeVar
+
+ItemT = TypeVar("ItemT")
+
+# Upper bounds in milliseconds of the export latency histogram buckets
+LATENCY_BUCKETS_MILLIS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000]
+
+
+class LatencyHistogram:
+    """Histogram of latencies with fixed buckets"""
+
+    def __init__(self):
+        # The last bucket holds latencies above the highest bound
+        self.counts: List[int] = [0] * (len(LATENCY_BUCKETS_MILLIS) + 1)
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float) -> None:
+        """Add one latency measure"""
+        millis = seconds * 1e3
+        index = 0
+        while index < len(LATENCY_BUCKETS_MILLIS) and millis > LATENCY_BUCKETS_MILLIS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def quantile(self, fraction: float) -> float:
+        """Upper bound in milliseconds of the bucket holding the quantile"""
+        target = fraction * sum(self.counts)
+        cumulated = 0
+        for index, count in enumerate(self.counts):
+            cumulated += count
+            if count and cumulated >= target:
+                if index < len(LATENCY_BUCKETS_MILLIS):
+                    return float(LATENCY_BUCKETS_MILLIS[index])
+                return self.max_seconds * 1e3
+        return 0.0
+
+    def merge(self, histogram: Dict) -> None:
+        """Add the measures of a histogram exported with to_dict"""
+        self.counts = [a + b for a, b in zip(self.counts, histogram["counts"])]
+        self.total_seconds += histogram["total_seconds"]
+        self.max_seconds = max(self.max_seconds, histogram["max_seconds"])
+
+    def to_dict(self) -> Dict:
+        """Serializable view of the histogram"""
+        count = sum(self.counts)
+        return {
+            "bucket_bounds_millis": LATENCY_BUCKETS_MILLIS,
+            "counts": self.counts,
+            "total_seconds": self.total_seconds,
+            "max_seconds": self.max_seconds,
+            "mean_millis": self.total_seconds / count * 1e3 if count else 0.0,
+            "p50_millis": self.quantile(0.5),
+            "p99_millis": self.quantile(0.99),
+        }
+
+
+class SignalStats:
+    """Export statistics of one kind of telemetry data"""
+
+    def __init__(self):
+        self.requests = 0
+        self.exported = 0
+        self.failed = 0
+        self.retries = 0
+        self.latency = LatencyHistogram()
+
+    def merge(self, signal_stats: Dict) -> None:
+        """Add statistics exported with to_dict"""
+        self.requests += signal_stats["requests"]
+        self.exported += signal_stats["exported"]
+        self.failed += signal_stats["failed"]
+        self.retries += signal_stats["retries"]
+        self.latency.merge(signal_stats["latency"])
+
+    def to_dict(self) -> Dict:
+        """Serializable view of the statistics"""
+        return {
+            "requests": self.requests,
+            "exported": self.exported,
+            "failed": self.failed,
+            "retries": self.retries,
+            "latency": self.latency.to_dict(),
+        }
+
+
+class ReplayStats:
+    """Counters and timers of the replay stages.
+
+    Stages are "decode" (bt2 message iteration), "cache" (payload cache
+    reads), "payload" (payload extraction), "parse" (protobuf parsing or
+    validation) and "export" (export calls, summed over all threads). Export statistics are
+    updated from the export threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start_time = time.perf_counter()
+        self._last_log_time = self._start_time
+        self._last_log_events = 0
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.stage_seconds: Dict[str, float] = defaultdict(float)
+        self.signals: Dict[str, SignalStats] = defaultdict(SignalStats)
+
+    def reset(self) -> None:
+        """Clear all statistics, keeping the start time"""
+        with self._lock:
+            self.counters.clear()
+            self.stage_seconds.clear()
+            self.signals.clear()
+            # The next periodic line measures the rate from the cleared counters
+            self._last_log_time = time.perf_counter()
+            self._last_log_events = 0
+
+    def timed(self, iterable: Iterable[ItemT], stage: str) -> Iterator[ItemT]:
+        """Iterate over iterable, accounting the time spent in next() to stage"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.stage_seconds[stage] += time.perf_counter() - start
+            yield item
+
+    def record_export(self, signal: str, n_items: int, seconds: float, success: bool) -> None:
+        """Record one export request"""
+        with self._lock:
+            signal_stats = self.signals[signal]
+            signal_stats.requests += 1
+            signal_stats.latency.record(seconds)
+            if success:
+                signal_stats.exported += n_items
+            else:
+                signal_stats.failed += n_items
+            self.stage_seconds["export"] += seconds
+
+    def record_retry(self, signal: str) -> None:
+        """Record that an export request is retried"""
+        with self._lock:
+            self.signals[signal].retries += 1
+
+    def merge(self, stats: Dict) -> None:
+        """Add statistics exported with to_dict, by a worker process for instance"""
+        with self._lock:
+            for name, value in stats["counters"].items():
+                self.counters[name] += value
+            for stage, seconds in stats["stage_seconds"].items():
+                self.stage_seconds[stage] += seconds
+            for signal, signal_stats in stats["signals"].items():
+                self.signals[signal].merge(signal_stats)
+
+    def to_dict(self) -> Dict:
+        """Serializable view of the statistics"""
+        with self._lock:
+            elapsed = time.perf_counter() - self._start_time
+            return {
+                "elapsed_seconds": elapsed,
+                "events_per_second": self.counters["events"] / elapsed if elapsed else 0.0,
+                "payload_bytes_per_second": self.counters["payload_bytes"] / elapsed if elapsed else 0.0,
+                "counters": dict(self.counters),
+                "stage_seconds": dict(self.stage_seconds),
+                "signals": {signal: signal_stats.to_dict() for signal, signal_stats in self.signals.items()},
+            }
+
+    def write_json(self, path: str) -> None:
+        """Write the statistics summary as JSON"""
+        with open(path, "w", encoding="utf-8") as stats_file:
+            json.dump(self.to_dict(), stats_file, indent=2)
+
+    def log_periodically(self, interval: float) -> None:
+        """Log a statistics line if interval seconds have elapsed since the last one"""
+        now = time.perf_counter()
+        if now - self._last_log_time < interval:
+            return
+        events = self.counters["events"]
+        with self._lock:
+            exported = {signal: signal_stats.exported for signal, signal_stats in self.signals.items()}
+        logging.info("%.0f events/s, %.2f MB payload, exported %s",
+                     (events - self._last_log_events) / (now - self._last_log_time),
+                     self.counters["payload_bytes"] / 1e6, exported)
+        self._last_log_time = now
+        self._last_log_events = events
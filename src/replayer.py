@@ -4,23 +4,47 @@ replayer.py
 Read all opentelemetry-c CTF traces and send them to an
 Opentelemetry collector using OpenTelelemetry Protocol for GRPC.
 """
+import asyncio
 import logging
-from argparse import ArgumentParser
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from argparse import ArgumentParser, Namespace
+from functools import partial
 from pathlib import Path
+from typing import (Callable, Dict, Iterable, Iterator, List, Optional,
+                    Sequence, Tuple, Union)
 
-import bt2
-from google.protobuf.message import DecodeError
-from opentelemetry.proto.logs.v1.logs_pb2 import ResourceLogs
-from opentelemetry.proto.metrics.v1.metrics_pb2 import ResourceMetrics
-from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
-from opentelemetry.sdk._logs._internal.export import LogExportResult
-from opentelemetry.sdk.metrics.export import MetricExportResult
-from opentelemetry.sdk.trace.export import SpanExportResult
-from tqdm.auto import tqdm
-
+from async_replayer import (DEFAULT_MAX_EXPORT_BATCH_BYTES,
+                            DEFAULT_MAX_EXPORT_BATCH_SIZE,
+                            DEFAULT_SCHEDULE_DELAY_MILLIS, Replayer)
+from checkpoint import DEFAULT_CHECKPOINT_INTERVAL
+from coalescer import coalesce
+from discovery import discover_ust_folders
+from event_filter import SIGNAL_EVENTS, EventFilter
+from export_engine import DEFAULT_MAX_CONCURRENT_EXPORTS, ExportEngine
+from fanout import FanOutEngine
+from follow import DEFAULT_FOLLOW_POLL_INTERVAL, is_lttng_live_url
+from otlp_file import (DEFAULT_MAX_FILE_BYTES, FILE_COMPRESSIONS,
+                       FILE_FORMATS, OTLPFileExporter, OTLPFileWriter,
+                       zstandard)
 from otlp_log_exporter import OTLPLogExporter
 from otlp_metrics_exporter import OTLPMetricExporter
 from otlp_span_exporter import OTLPSpanExporter
+from pacer import Pacer
+from payload_cache import DEFAULT_MAX_CACHE_BYTES, PayloadCache
+from progress import (PROGRESS_MODES, ProgressBar, RemoteProgressBar,
+                      progress_unit, query_time_range)
+from replay_sinks import EngineSink
+from replay_stages import (MetricsAggregationStage, ReplayStage,
+                           TraceAssemblyStage)
+from replay_stats import ReplayStats
+from retry_queue import DEFAULT_MAX_EXPORT_ATTEMPTS, DEFAULT_RETRY_QUEUE_BYTES
+from trace_assembler import DEFAULT_MAX_PENDING_BYTES, DEFAULT_MAX_PENDING_TRACES
+
+DEFAULT_SHUTDOWN_TIMEOUT = 30.0
 
 
 def get_parser() -> ArgumentParser:
@@ -47,135 +71,586 @@ def get_parser() -> ArgumentParser:
     parser.add_argument('-i', '--ctf-traces-folder-path',
                         action='store',
                         help='The path of folder where ctf traces',
-                        required=True,
+                        required=False,
                         type=Path,
                         dest='input_folder')
-    parser.add_argument('-e', '--otel-exporter-otlp-endpoint',
+    parser.add_argument('--include',
+                        action='append',
+                        help='Only replay the ust traces folders whose path relative to the CTF traces folder '
+                             'matches this glob. Can be repeated',
+                        default=[],
+                        type=str,
+                        dest='include')
+    parser.add_argument('--exclude',
+                        action='append',
+                        help='Skip the ust traces folders, or the folders holding them, whose path relative to '
+                             'the CTF traces folder matches this glob. Can be repeated',
+                        default=[],
+                        type=str,
+                        dest='exclude')
+    parser.add_argument('--manifest',
+                        action='store',
+                        help='Read the ust traces folders from this file instead of scanning the CTF traces folder. '
+                             'The file is written by the first scan',
+                        default=None,
+                        type=Path,
+                        dest='manifest')
+    parser.add_argument('--signals',
+                        action='store',
+                        help='The kinds of telemetry data to replay',
+                        nargs='+',
+                        choices=list(SIGNAL_EVENTS),
+                        default=list(SIGNAL_EVENTS),
+                        type=str,
+                        dest='signals')
+    parser.add_argument('--service-name',
+                        action='append',
+                        help='Only replay the telemetry data whose resource has this service.name. Can be repeated',
+                        default=[],
+                        type=str,
+                        dest='service_names')
+    parser.add_argument('--begin',
+                        action='store',
+                        help='Only replay the events from this timestamp, in seconds from the clock origin',
+                        default=None,
+                        type=float,
+                        dest='begin')
+    parser.add_argument('--end',
                         action='store',
-                        help='The OTel collector GRPC server endpoint. If set, we assume the endpoint is insecure',
+                        help='Only replay the events up to this timestamp, in seconds from the clock origin',
+                        default=None,
+                        type=float,
+                        dest='end')
+    parser.add_argument('--trace-id-ratio',
+                        action='store',
+                        help='Only replay the spans and logs of this fraction of the traces, chosen from their trace id',
+                        default=1.0,
+                        type=float,
+                        dest='trace_id_ratio')
+    parser.add_argument('-e', '--otel-exporter-otlp-endpoint',
+                        action='append',
+                        help='The OTel collector GRPC server endpoint. If set, we assume the endpoint is insecure. '
+                             'Can be repeated to spread the exports over several collectors: spans are routed by '
+                             'trace id, metrics and logs round-robin',
                         required=False,
                         type=str,
-                        dest='otel_exporter_otlp_endpoint')
+                        dest='otel_exporter_otlp_endpoints')
+    parser.add_argument('--max-export-batch-size',
+                        action='store',
+                        help='The maximum number of resource spans, metrics or logs sent in a single request',
+                        default=DEFAULT_MAX_EXPORT_BATCH_SIZE,
+                        type=int,
+                        dest='max_export_batch_size')
+    parser.add_argument('--max-export-batch-bytes',
+                        action='store',
+                        help='The maximum serialized size in bytes of a single request',
+                        default=DEFAULT_MAX_EXPORT_BATCH_BYTES,
+                        type=int,
+                        dest='max_export_batch_bytes')
+    parser.add_argument('--max-export-items',
+                        action='store',
+                        help='The maximum number of spans, metric data points or log records sent in a single '
+                             'request, bigger requests are split. Not limited by default',
+                        default=None,
+                        type=int,
+                        dest='max_export_items')
+    parser.add_argument('--schedule-delay-millis',
+                        action='store',
+                        help='The maximum time in milliseconds telemetry data waits before being exported',
+                        default=DEFAULT_SCHEDULE_DELAY_MILLIS,
+                        type=float,
+                        dest='schedule_delay_millis')
+    parser.add_argument('--max-concurrent-exports',
+                        action='store',
+                        help='The maximum number of export requests in flight for each kind of telemetry data',
+                        default=DEFAULT_MAX_CONCURRENT_EXPORTS,
+                        type=int,
+                        dest='max_concurrent_exports')
+    parser.add_argument('--ordered-exports',
+                        action='store_true',
+                        help='Send export requests of each kind of telemetry data one at a time, in order',
+                        dest='ordered_exports')
+    parser.add_argument('--retry-queue-bytes',
+                        action='store',
+                        help='The size in bytes of the failed export requests kept in memory for each kind of '
+                             'telemetry data, to be sent again with an exponential backoff. 0 disables retries',
+                        default=DEFAULT_RETRY_QUEUE_BYTES,
+                        type=int,
+                        dest='retry_queue_bytes')
+    parser.add_argument('--retry-journal-dir',
+                        action='store',
+                        help='The folder where failed export requests are written beyond --retry-queue-bytes, '
+                             'and when the replay ends before they could be sent. They are sent by the next replay',
+                        default=None,
+                        type=Path,
+                        dest='retry_journal_dir')
+    parser.add_argument('--max-export-attempts',
+                        action='store',
+                        help='The number of attempts after which a failed export request is dropped',
+                        default=DEFAULT_MAX_EXPORT_ATTEMPTS,
+                        type=int,
+                        dest='max_export_attempts')
+    parser.add_argument('--shutdown-timeout',
+                        action='store',
+                        help='The maximum time in seconds waited at the end of the replay for failed export '
+                             'requests to be sent',
+                        default=DEFAULT_SHUTDOWN_TIMEOUT,
+                        type=float,
+                        dest='shutdown_timeout')
+    parser.add_argument('--progress',
+                        action='store',
+                        help='How to track the replay progress: "time" estimates it from the event timestamps, '
+                             '"exact" counts all events beforehand but decodes the traces twice, '
+                             '"none" disables the progress bar',
+                        choices=PROGRESS_MODES,
+                        default='time',
+                        type=str,
+                        dest='progress')
+    parser.add_argument('-j', '--jobs',
+                        action='store',
+                        help='The number of processes replaying ust traces folders in parallel',
+                        default=1,
+                        type=int,
+                        dest='jobs')
+    parser.add_argument('--pass-through',
+                        action='store_true',
+                        help='Forward the serialized telemetry data to the collector without decoding them',
+                        dest='pass_through')
+    parser.add_argument('--skip-validation',
+                        action='store_false',
+                        help='In pass-through mode, do not check the framing of the serialized telemetry data',
+                        dest='validate_payloads')
+    parser.add_argument('--coalesce',
+                        action='store_true',
+                        help='Merge the telemetry data sharing the same resource and instrumentation scope '
+                             'in each export request',
+                        dest='coalesce')
+    parser.add_argument('--metrics-aggregation-window-millis',
+                        action='store',
+                        help='Fold the metric data points of each stream over windows of this length, '
+                             'and convert them to the temporality preferred by the metrics exporter',
+                        default=None,
+                        type=float,
+                        dest='metrics_aggregation_window_millis')
+    parser.add_argument('--trace-assembly-window-millis',
+                        action='store',
+                        help='Hold the spans back until their trace is complete, or until they have waited '
+                             'this long in trace time, so that the spans of a trace are exported together',
+                        default=None,
+                        type=float,
+                        dest='trace_assembly_window_millis')
+    parser.add_argument('--trace-assembly-max-traces',
+                        action='store',
+                        help='The maximum number of traces held back, the oldest ones are exported incomplete '
+                             'beyond it',
+                        default=DEFAULT_MAX_PENDING_TRACES,
+                        type=int,
+                        dest='trace_assembly_max_traces')
+    parser.add_argument('--trace-assembly-max-bytes',
+                        action='store',
+                        help='The maximum size of the spans held back, the oldest traces are exported incomplete '
+                             'beyond it',
+                        default=DEFAULT_MAX_PENDING_BYTES,
+                        type=int,
+                        dest='trace_assembly_max_bytes')
+    parser.add_argument('--pace',
+                        action='store',
+                        help='Reproduce the original timing of the events, scaled by this speed factor '
+                             '(1 for the original pace, 10 for ten times faster, 0.5 for twice slower). '
+                             'All the folders share the same timeline, except when following traces, '
+                             'where each one starts at its first event',
+                        default=None,
+                        type=float,
+                        dest='pace')
+    parser.add_argument('--checkpoint-dir',
+                        action='store',
+                        help='The folder where the replay state of each ust traces folder is periodically saved',
+                        default=None,
+                        type=Path,
+                        dest='checkpoint_dir')
+    parser.add_argument('--checkpoint-interval',
+                        action='store',
+                        help='The time in seconds between two checkpoints',
+                        default=DEFAULT_CHECKPOINT_INTERVAL,
+                        type=float,
+                        dest='checkpoint_interval')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='Resume the replay from the checkpoints saved in --checkpoint-dir',
+                        dest='resume')
+    parser.add_argument('--follow',
+                        action='store_true',
+                        help='Keep replaying the events appended to the ust traces folders while they are being '
+                             'written, until interrupted or --follow-idle-timeout',
+                        dest='follow')
+    parser.add_argument('--lttng-live',
+                        action='append',
+                        help='Follow an LTTng live session, given by its URL '
+                             '(net://relayd-host/host/target-host/session-name). Can be repeated',
+                        default=[],
+                        type=str,
+                        dest='lttng_live_urls')
+    parser.add_argument('--follow-poll-interval',
+                        action='store',
+                        help='The time in seconds between two checks for new events when following traces',
+                        default=DEFAULT_FOLLOW_POLL_INTERVAL,
+                        type=float,
+                        dest='follow_poll_interval')
+    parser.add_argument('--follow-idle-timeout',
+                        action='store',
+                        help='Stop following traces after this many seconds without new events',
+                        default=None,
+                        type=float,
+                        dest='follow_idle_timeout')
+    parser.add_argument('--payload-cache-dir',
+                        action='store',
+                        help='Cache the payloads of the ust traces folders in this folder, so that replaying '
+                             'them again does not decode the CTF traces',
+                        default=None,
+                        type=Path,
+                        dest='payload_cache_dir')
+    parser.add_argument('--payload-cache-max-bytes',
+                        action='store',
+                        help='The size in bytes above which the least recently used cache entries are evicted',
+                        default=DEFAULT_MAX_CACHE_BYTES,
+                        type=int,
+                        dest='payload_cache_max_bytes')
+    parser.add_argument('--output-folder',
+                        action='store',
+                        help='Write the export requests to OTLP files in this folder instead of sending them '
+                             'to a collector. Send them later with file_replayer.py',
+                        default=None,
+                        type=Path,
+                        dest='output_folder')
+    parser.add_argument('--output-format',
+                        action='store',
+                        help='The format of the OTLP files: "proto" for length-delimited protobuf, '
+                             '"json" for OTLP/JSON lines',
+                        choices=FILE_FORMATS,
+                        default='proto',
+                        type=str,
+                        dest='output_format')
+    parser.add_argument('--output-compression',
+                        action='store',
+                        help='The compression of the OTLP files, zstd requires the zstandard package',
+                        choices=FILE_COMPRESSIONS,
+                        default='none',
+                        type=str,
+                        dest='output_compression')
+    parser.add_argument('--output-max-file-bytes',
+                        action='store',
+                        help='The uncompressed size in bytes after which a new OTLP file is started',
+                        default=DEFAULT_MAX_FILE_BYTES,
+                        type=int,
+                        dest='output_max_file_bytes')
+    parser.add_argument('--stats-json',
+                        action='store',
+                        help='Write throughput and latency statistics of the replay stages to this JSON file',
+                        default=None,
+                        type=Path,
+                        dest='stats_json')
+    parser.add_argument('--stats-interval',
+                        action='store',
+                        help='Log a statistics line every this many seconds',
+                        default=None,
+                        type=float,
+                        dest='stats_interval')
     return parser
 
 
-if __name__ == "__main__":
+def log_found_folders(ust_traces_folders: Iterable[str]) -> Iterator[str]:
+    """Log the ust traces folders as they are discovered"""
+    for ust_traces_folder in ust_traces_folders:
+        logging.info("Found ust traces folder %s", ust_traces_folder)
+        yield ust_traces_folder
+
+
+def pace_origin_timestamp(ust_traces_folders: Sequence[str], begin: Optional[float]) -> Optional[int]:
+    """Earliest event timestamp in ns from origin of the ust traces folders, from
+    their stream indexes, or None if it cannot be queried"""
+    begins = []
+    for ust_traces_folder in ust_traces_folders:
+        time_range = query_time_range(ust_traces_folder)
+        if time_range is not None:
+            begins.append(time_range[0])
+    if not begins:
+        return None
+    origin = min(begins)
+    # Events before --begin are trimmed
+    if begin is not None:
+        origin = max(origin, int(begin * 1e9))
+    return origin
+
+
 
+
+def create_engines(args: Namespace, stats: Optional[ReplayStats] = None) -> Dict[str, Union[ExportEngine, FanOutEngine]]:
+    """Create the span, metrics and logs export engines, by signal. Each export
+    engine owns several exporters to keep multiple requests in flight."""
+    endpoints = args.otel_exporter_otlp_endpoints or [None]
+    exporter_kwargs = {
+        # Split single payloads bigger than a batch, or holding too many data points
+        "max_export_batch_size": args.max_export_items,
+        "max_export_batch_bytes": args.max_export_batch_bytes,
+    }
+    engine_kwargs = {
+        "max_concurrent_exports": args.max_concurrent_exports,
+        "ordered": args.ordered_exports,
+        "serialized": args.pass_through,
+        "stats": stats,
+        "retry_queue_bytes": args.retry_queue_bytes,
+        "retry_journal_dir": args.retry_journal_dir,
+        "max_export_attempts": args.max_export_attempts,
+    }
+    engines: Tuple[Union[ExportEngine, FanOutEngine], ...]
+    if args.output_folder is None and len(endpoints) > 1:
+        # One export engine per collector, spans of a trace go to the same one
+        engines = tuple(
+            FanOutEngine(
+                lambda endpoint, on_export, exporter_class=exporter_class: ExportEngine(
+                    partial(exporter_class, endpoint=endpoint, insecure=True, **exporter_kwargs),
+                    on_export=on_export, **engine_kwargs),
+                endpoints, by_trace_id=exporter_class is OTLPSpanExporter, serialized=args.pass_through)
+            for exporter_class in (OTLPSpanExporter, OTLPMetricExporter, OTLPLogExporter)
+        )
+    else:
+        if args.output_folder is None:
+            exporter_kwargs["endpoint"] = endpoints[0]
+            exporter_kwargs["insecure"] = True if endpoints[0] else None
+            exporter_factories: Tuple[Callable, ...] = (
+                partial(OTLPSpanExporter, **exporter_kwargs),
+                partial(OTLPMetricExporter, **exporter_kwargs),
+                partial(OTLPLogExporter, **exporter_kwargs),
+            )
+        else:
+            # The exporters of a signal share the same files
+            exporter_factories = tuple(
+                partial(OTLPFileExporter,
+                        OTLPFileWriter(args.output_folder, signal, args.output_format,
+                                       args.output_compression, args.output_max_file_bytes),
+                        signal)
+                for signal in ("traces", "metrics", "logs")
+            )
+        engines = tuple(ExportEngine(exporter_factory, **engine_kwargs) for exporter_factory in exporter_factories)
+    return dict(zip(("traces", "metrics", "logs"), engines))
+
+
+def create_replayer(args: Namespace, ust_traces_folders: Iterable[str], pbar=None,
+                    stop_following: Optional[Callable[[], bool]] = None) -> Replayer:
+    """Create a Replayer of ust traces folders, configured from the command line arguments"""
+    stats = ReplayStats()
+    engines = create_engines(args, stats)
+
+    stages: List[Callable[[], ReplayStage]] = []
+    if args.metrics_aggregation_window_millis is not None:
+        # Fold metric data points before batching them
+        stages.append(partial(
+            MetricsAggregationStage, args.metrics_aggregation_window_millis,
+            engines["metrics"].exporter._preferred_temporality))  # pylint: disable=protected-access
+    if args.trace_assembly_window_millis is not None:
+        # Group spans by trace before batching them
+        stages.append(partial(TraceAssemblyStage, args.trace_assembly_window_millis,
+                              args.trace_assembly_max_traces, args.trace_assembly_max_bytes))
+
+    # Send the events at their original pace
+    pacer: Optional[Pacer] = None
+    if args.pace is not None:
+        pacer = Pacer(args.pace)
+        # Folders share the timeline set by main, otherwise the first event starts it
+        if args.pace_origin is not None:
+            pacer.anchor(*args.pace_origin)
+
+    payload_cache: Optional[PayloadCache] = None
+    if args.payload_cache_dir is not None:
+        payload_cache = PayloadCache(args.payload_cache_dir, args.payload_cache_max_bytes)
+
+    return Replayer(
+        ust_traces_folders,
+        [EngineSink(engines, args.shutdown_timeout)],
+        EventFilter(args.signals, args.service_names, args.begin, args.end, args.trace_id_ratio),
+        pass_through=args.pass_through,
+        validate_payloads=args.validate_payloads,
+        follow=args.follow,
+        follow_poll_interval=args.follow_poll_interval,
+        follow_idle_timeout=args.follow_idle_timeout,
+        stop_following=stop_following,
+        max_export_batch_size=args.max_export_batch_size,
+        max_export_batch_bytes=args.max_export_batch_bytes,
+        schedule_delay_millis=args.schedule_delay_millis,
+        max_concurrent_exports=args.max_concurrent_exports,
+        # Each process replays its folders one after another
+        max_concurrent_sources=1,
+        prepare=coalesce if args.coalesce else None,
+        stages=stages,
+        pacer=pacer,
+        checkpoint_dir=args.checkpoint_dir,
+        checkpoint_interval=args.checkpoint_interval,
+        resume=args.resume,
+        payload_cache=payload_cache,
+        progress_mode=args.progress,
+        pbar=pbar,
+        shutdown_timeout=args.shutdown_timeout,
+        # Statistics are only timed when requested
+        time_stages=args.stats_json is not None or args.stats_interval is not None,
+        stats_interval=args.stats_interval,
+        stats=stats,
+    )
+
+
+def _replay_in_worker(args: Namespace, folder_queue, result_queue, progress_queue, stop_following) -> None:
+    """Replay the ust traces folders of folder_queue until None is received, then
+    hand the counts and statistics of the replay over to the main process"""
     logging.root.setLevel(logging.INFO)
+    # Ctrl-C is handled by the main process, which asks the workers to stop following
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    pbar = RemoteProgressBar(progress_queue)
+    replayer = create_replayer(args, iter(folder_queue.get, None), pbar, stop_following.is_set)
+    try:
+        asyncio.run(replayer.run())
+    finally:
+        pbar.flush()
+    result_queue.put((replayer.n_tel_data, replayer.n_tel_data_exported, replayer.stats.to_dict()))
+
 
-    args = get_parser().parse_args()
+def replay_folders_in_parallel(args: Namespace, ust_traces_folders: Iterable[str], pbar: ProgressBar,
+                               stats: ReplayStats) -> Tuple[int, int]:
+    """Replay ust traces folders with processes, each one with its own Replayer
+    and exporters. Statistics of the workers are merged into stats.
+    Return the number of telemetry data found and exported."""
+    # Exporters open gRPC channels, which are not fork safe
+    context = multiprocessing.get_context("spawn")
+    folder_queue = context.Queue()
+    result_queue = context.Queue()
+    progress_queue = context.Queue()
+    stop_following = context.Event()
+    workers = [
+        context.Process(target=_replay_in_worker, daemon=True,
+                        args=(args, folder_queue, result_queue, progress_queue, stop_following))
+        for _ in range(args.jobs)
+    ]
+    for worker in workers:
+        worker.start()
 
-    if not args.input_folder.is_dir():
+    # Folders are handed over to the workers as they are discovered
+    for ust_traces_folder in ust_traces_folders:
+        folder_queue.put(ust_traces_folder)
+        pbar.drain(progress_queue)
+    for _ in workers:
+        folder_queue.put(None)
+
+    n_tel_data = 0
+    n_tel_data_exported = 0
+    n_results = 0
+    while n_results < len(workers):
+        try:
+            pbar.drain(progress_queue)
+            worker_n_tel_data, worker_n_tel_data_exported, worker_stats = result_queue.get(timeout=0.1)
+        except queue.Empty:
+            if any(worker.exitcode for worker in workers):
+                raise RuntimeError("A replay worker exited unexpectedly")
+            continue
+        except KeyboardInterrupt:
+            if not args.follow or stop_following.is_set():
+                raise
+            # The workers stop following and export their pending telemetry data
+            logging.info("Stopped following the traces")
+            stop_following.set()
+            continue
+        n_results += 1
+        n_tel_data += worker_n_tel_data
+        n_tel_data_exported += worker_n_tel_data_exported
+        stats.merge(worker_stats)
+    for worker in workers:
+        worker.join()
+    pbar.drain(progress_queue)
+    return n_tel_data, n_tel_data_exported
+
+
+def _stop_following(stop_following: threading.Event, *_) -> None:
+    """Stop following the traces on Ctrl-C, pending telemetry data are still exported"""
+    logging.info("Stopped following the traces")
+    stop_following.set()
+    # Ctrl-C again interrupts the replay
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+
+def main() -> None:
+    """Command line entry point"""
+    logging.root.setLevel(logging.INFO)
+
+    parser = get_parser()
+    args = parser.parse_args()
+    if args.resume and args.checkpoint_dir is None:
+        parser.error("--resume requires --checkpoint-dir")
+    if args.pass_through and (args.coalesce or args.metrics_aggregation_window_millis is not None):
+        parser.error("--coalesce and --metrics-aggregation-window-millis need decoded telemetry data, "
+                     "they cannot be used with --pass-through")
+    if args.output_compression == "zstd" and zstandard is None:
+        parser.error("--output-compression zstd requires the zstandard package")
+
+    if args.input_folder is None and not args.lttng_live_urls:
+        parser.error("the CTF traces folder (-i) or an LTTng live session (--lttng-live) is required")
+    if args.lttng_live_urls:
+        if not all(is_lttng_live_url(url) for url in args.lttng_live_urls):
+            parser.error("--lttng-live URLs must start with net://")
+        args.follow = True
+
+    if args.input_folder is not None and not args.input_folder.is_dir():
         logging.fatal(
             "The path of the CTF traces must be passed as first argument of the script.")
         exit(1)
 
-    # Create the span exporter
-    span_exporter = OTLPSpanExporter(
-        endpoint=args.otel_exporter_otlp_endpoint,
-        insecure=True if args.otel_exporter_otlp_endpoint else None
-    )
-
-    # Create the metrics exporter
-    metric_exporter = OTLPMetricExporter(
-        endpoint=args.otel_exporter_otlp_endpoint,
-        insecure=True if args.otel_exporter_otlp_endpoint else None
-    )
+    # Folders are replayed while the scan goes on
+    ust_traces_folders: Iterable[str] = ()
+    if args.input_folder is not None:
+        ust_traces_folders = log_found_folders(discover_ust_folders(
+            args.input_folder, args.include, args.exclude, args.manifest))
 
-    # Create the logs exporter
-    log_exporter = OTLPLogExporter(
-        endpoint=args.otel_exporter_otlp_endpoint,
-        insecure=True if args.otel_exporter_otlp_endpoint else None
-    )
+    if args.follow:
+        # Followed traces have no known end, and are all followed at the same time
+        args.progress = "none"
+        followed_folders = list(ust_traces_folders) + args.lttng_live_urls
+        if len(followed_folders) > 1 and args.jobs < len(followed_folders):
+            logging.info("Following %d traces with as many jobs", len(followed_folders))
+            args.jobs = len(followed_folders)
+        ust_traces_folders = followed_folders
 
-    ust_traces_folders = list(
-        str(p) for p in args.input_folder.glob("**/ust") if p.is_dir())
-    logging.info("Found %d ust traces folders : %s", len(ust_traces_folders), str(ust_traces_folders))
+    # Pace all the folders on a single timeline, starting at their earliest event
+    args.pace_origin = None
+    if args.pace is not None and not args.follow:
+        ust_traces_folders = list(ust_traces_folders)
+        pace_origin = pace_origin_timestamp(ust_traces_folders, args.begin)
+        if pace_origin is not None:
+            args.pace_origin = (pace_origin, time.time())
 
-    # Create a progress bar
-    n_ust_events = sum(sum(
-        1 for _ in bt2.TraceCollectionMessageIterator(p)) for p in ust_traces_folders)
-    logging.info("Found %d ust trace events", n_ust_events)
-    pbar = tqdm(total=n_ust_events)
+    # Create a progress bar, sized as folders are replayed
+    pbar = ProgressBar(total=0,
+                       unit=progress_unit(args.progress),
+                       disable=args.progress == "none")
 
     # Iterate over trace events
     logging.info("Exporting telemetry data ...")
-    n_tel_data = 0
-    n_tel_data_exported = 0
-    for ust_traces_folder in ust_traces_folders:
-        for msg in bt2.TraceCollectionMessageIterator(ust_traces_folder):
-            pbar.update(1)
-            # pylint: disable=protected-access
-            if not isinstance(msg, bt2._EventMessageConst):
-                continue
-            # An event message holds a trace event.
-            ev = msg.event
-
-            if ev.name.startswith("opentelemetry:"):
-                n_tel_data += 1
-
-            if ev.name == "opentelemetry:resource_spans":
-                # Export resource spans
-                resource_spans_bytes = bytes(list(ev['resource_spans']))
-
-                # resource_spans_str_as_bytes = resource_spans_str.encode()
-                # print(type(resource_spans_str_as_bytes))
-                resource_spans = ResourceSpans()
-                try:
-                    resource_spans.ParseFromString(resource_spans_bytes)
-                except DecodeError:
-                    logging.error("Unable to parse one %s event", ev.name)
-                    continue
-                # TODO (augustinsangam): In future export spans in group
-                # Exporting spans one by one
-                if span_exporter.export([resource_spans]) == SpanExportResult.SUCCESS:
-                    n_tel_data_exported += 1
-                else:
-                    logging.error(
-                        "Unable to export trace id %s",
-                        resource_spans.scope_spans[0].spans[0].trace_id)
-
-            elif ev.name == "opentelemetry:resource_metrics":
-                # Export resource metrics
-                resource_metrics_bytes = bytes(list(ev['resource_metrics']))
-
-                resource_metrics = ResourceMetrics()
-                try:
-                    resource_metrics.ParseFromString(resource_metrics_bytes)
-                except DecodeError:
-                    logging.error("Unable to parse one %s event", ev.name)
-                    continue
-
-                # TODO (augustinsangam): In future export metrics in group
-                # Exporting metrics one by one
-                if metric_exporter.export([resource_metrics]) == MetricExportResult.SUCCESS:
-                    n_tel_data_exported += 1
-                else:
-                    logging.error(
-                        "Unable to export trace id %s",
-                        resource_metrics.scope_metrics[0].metrics[0].name)
-
-            elif ev.name == "opentelemetry:resource_logs":
-                # Export resource logs
-                resource_logs_bytes = bytes(list(ev['resource_logs']))
-
-                resource_logs = ResourceLogs()
-                try:
-                    resource_logs.ParseFromString(resource_logs_bytes)
-                except DecodeError:
-                    logging.error("Unable to parse one %s event", ev.name)
-                    continue
-                # TODO (augustinsangam): In future export logs in group
-                # Exporting logs one by one
-                if log_exporter.export([resource_logs]) == LogExportResult.SUCCESS:
-                    n_tel_data_exported += 1
-                else:
-                    logging.error(
-                        "Unable to export trace id %s",
-                        resource_logs.scope_logs[0].log_records[0].trace_id)
+    if args.jobs > 1:
+        stats = ReplayStats()
+        n_tel_data, n_tel_data_exported = replay_folders_in_parallel(args, ust_traces_folders, pbar, stats)
+    else:
+        stop_following = threading.Event()
+        if args.follow:
+            signal.signal(signal.SIGINT, partial(_stop_following, stop_following))
+        replayer = create_replayer(args, ust_traces_folders, pbar, stop_following.is_set)
+        asyncio.run(replayer.run())
+        n_tel_data, n_tel_data_exported = replayer.n_tel_data, replayer.n_tel_data_exported
+        stats = replayer.stats
 
     # Stop and cleanup progress bar
     pbar.close()
 
     logging.info("Exporting done. %d/%d telemetry data exported.",
                  n_tel_data_exported, n_tel_data)
+    if args.stats_json is not None:
+        stats.write_json(args.stats_json)
+        logging.info("Replay statistics written to %s", args.stats_json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+retry_queue.py
+
+Keep the batches whose export failed and export them again with an
+exponential backoff, so that telemetry data survives collector restarts.
+
+Batches are kept in memory as serialized resources, up to a number of bytes.
+Beyond it, batches are spilled to a journal folder on disk, one file per
+batch holding the serialized export request. Journal files left by a previous
+run are exported again once the collector is reachable.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Deque, List, Optional, Tuple
+
+from google.protobuf.message import DecodeError
+
+from otlp_raw import decode_request, encode_request
+from replay_stats import ReplayStats
+
+DEFAULT_RETRY_QUEUE_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_EXPORT_ATTEMPTS = 10
+DEFAULT_INITIAL_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 60.0
+
+_JOURNAL_SUFFIX = ".req"
+_CLAIMED_SUFFIX = ".claimed"
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Batch:
+    def __init__(self, payloads: Optional[List[bytes]], on_done: Optional[Callable[[bool], None]],
+                 journal_path: Optional[Path] = None):
+        self.payloads = payloads
+        self.on_done = on_done
+        self.journal_path = journal_path
+        self.attempts = 1
+        self.n_bytes = sum(len(payload) for payload in payloads) if payloads else 0
+
+
+class RetryQueue:
+    """Failed batches of one kind of telemetry data, exported again in order
+    Args:
+        export: Exports a batch of serialized resources, returns whether it succeeded
+            and the resources of the requests that failed, which are retried alone
+        exporting: Kind of telemetry data, for the logs and the statistics
+        max_bytes: Maximum size of the batches kept in memory
+        journal_dir: Folder where batches are spilled once max_bytes is reached.
+            Without it, those batches are dropped.
+        max_attempts: Number of export attempts after which a batch is dropped
+        initial_backoff: Time in seconds before the first retry
+        max_backoff: Maximum time in seconds between two retries
+        stats: Statistics counting the retries
+    """
+
+    def __init__(
+        self,
+        export: Callable[[List[bytes]], Tuple[bool, List[bytes]]],
+        exporting: str,
+        max_bytes: int = DEFAULT_RETRY_QUEUE_BYTES,
+        journal_dir: Optional[Path] = None,
+        max_attempts: int = DEFAULT_MAX_EXPORT_ATTEMPTS,
+        initial_backoff: float = DEFAULT_INITIAL_BACKOFF,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+        stats: Optional[ReplayStats] = None,
+    ):
+        self._export = export
+        self._exporting = exporting
+        self._max_bytes = max_bytes
+        self._journal_dir = journal_dir / exporting if journal_dir is not None else None
+        self._max_attempts = max_attempts
+        self._initial_backoff = initial_backoff
+        self._max_backoff = max_backoff
+        self._stats = stats
+
+        self._condition = threading.Condition()
+        self._batches: Deque[_Batch] = deque()
+        self._n_bytes = 0
+        self._journal_sequence = 0
+        self._backoff = initial_backoff
+        self._next_attempt = time.monotonic()
+        self._retrying = False
+        # Batch whose export is in progress
+        self._current: Optional[_Batch] = None
+        self._stopped = False
+
+        if self._journal_dir is not None:
+            self._load_journal(self._journal_dir)
+        self._thread = threading.Thread(target=self._run, name=f"retry-{exporting}", daemon=True)
+        self._thread.start()
+
+    def _load_journal(self, journal_dir: Path) -> None:
+        journal_dir.mkdir(parents=True, exist_ok=True)
+        journal_paths = []
+        for journal_path in sorted(journal_dir.iterdir()):
+            if journal_path.suffix == _CLAIMED_SUFFIX:
+                # Claimed by a replay process that did not exit cleanly
+                owner = int(journal_path.stem.rsplit(".", 1)[-1])
+                if _is_alive(owner):
+                    continue
+            elif journal_path.suffix != _JOURNAL_SUFFIX:
+                continue
+            # Claim the file so that other replay processes leave it alone
+            claimed_path = self._claimed_path(journal_dir, journal_path.name.split(".", 1)[0])
+            try:
+                os.rename(journal_path, claimed_path)
+            except FileNotFoundError:
+                continue
+            journal_paths.append(claimed_path)
+            self._batches.append(_Batch(None, None, claimed_path))
+        if journal_paths:
+            logging.info("Exporting %d %s batches left in the retry journal", len(journal_paths), self._exporting)
+
+    @staticmethod
+    def _claimed_path(journal_dir: Path, name: str) -> Path:
+        return journal_dir / f"{name}.{os.getpid()}{_CLAIMED_SUFFIX}"
+
+    def _spill(self, batch: _Batch) -> bool:
+        """Move the payloads of a batch to the journal, return False without journal"""
+        if self._journal_dir is None or batch.payloads is None:
+            return False
+        journal_path = self._claimed_path(self._journal_dir, self._journal_name())
+        self._write_journal(journal_path, batch.payloads)
+        batch.journal_path = journal_path
+        batch.payloads = None
+        return True
+
+    def _journal_name(self) -> str:
+        # Names sort in the order they were given
+        name = f"{time.time_ns():020d}-{self._journal_sequence:06d}"
+        self._journal_sequence += 1
+        return name
+
+    @staticmethod
+    def _write_journal(journal_path: Path, payloads: List[bytes]) -> None:
+        temporary_path = journal_path.with_suffix(".tmp")
+        with open(temporary_path, "wb") as journal_file:
+            journal_file.write(encode_request(payloads))
+        os.replace(temporary_path, journal_path)
+
+    def _keep_failed(self, batch: _Batch, failed: List[bytes]) -> None:
+        """Keep only the payloads whose export failed in a batch"""
+        if batch.journal_path is None:
+            n_bytes = sum(len(payload) for payload in failed)
+            with self._condition:
+                self._n_bytes += n_bytes - batch.n_bytes
+                batch.payloads = failed
+                batch.n_bytes = n_bytes
+            return
+        try:
+            self._write_journal(batch.journal_path, failed)
+        except OSError:
+            # The whole batch is exported again
+            logging.exception("Unable to rewrite the retry journal file %s", batch.journal_path)
+
+    def add(self, payloads: List[bytes], on_done: Callable[[bool], None]) -> None:
+        """Queue a batch whose export failed. on_done(success) is called once
+        the batch is exported, dropped, or left in the journal at shutdown."""
+        batch = _Batch(payloads, on_done)
+        with self._condition:
+            if self._n_bytes + batch.n_bytes > self._max_bytes:
+                try:
+                    spilled = self._spill(batch)
+                except OSError:
+                    logging.exception("Unable to write %s to the retry journal", self._exporting)
+                    spilled = False
+                if not spilled:
+                    logging.error("Retry queue of %s is full, dropping a batch", self._exporting)
+                    on_done(False)
+                    return
+            else:
+                self._n_bytes += batch.n_bytes
+            self._batches.append(batch)
+            self._condition.notify_all()
+
+    def _load(self, batch: _Batch) -> Optional[List[bytes]]:
+        if batch.journal_path is None:
+            return batch.payloads
+        try:
+            with open(batch.journal_path, "rb") as journal_file:
+                return decode_request(journal_file.read())
+        except (OSError, DecodeError):
+            logging.exception("Unable to read the retry journal file %s", batch.journal_path)
+            return None
+
+    def _done(self, batch: _Batch, success: bool) -> None:
+        if batch.journal_path is not None:
+            try:
+                os.remove(batch.journal_path)
+            except FileNotFoundError:
+                pass
+        if batch.on_done is not None:
+            batch.on_done(success)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._stopped and (
+                        not self._batches or time.monotonic() < self._next_attempt):
+                    self._condition.wait(
+                        None if not self._batches else self._next_attempt - time.monotonic())
+                if self._stopped:
+                    return
+                batch = self._current = self._batches[0]
+                self._retrying = True
+
+            payloads = self._load(batch)
+            if self._stats is not None:
+                self._stats.record_retry(self._exporting)
+            success = False
+            failed: List[bytes] = []
+            if payloads is not None:
+                success, failed = self._export(payloads)
+                if not success and failed and len(failed) < len(payloads):
+                    self._keep_failed(batch, failed)
+
+            with self._condition:
+                batch.attempts += 1
+                # Nothing is left to retry when only undecodable payloads failed
+                finished = success or not failed or batch.attempts >= self._max_attempts
+                # Shutdown no longer waits for this batch, keep it in the journal
+                kept = not finished and self._stopped
+                if finished or kept:
+                    self._batches.popleft()
+                    if batch.payloads is not None:
+                        self._n_bytes -= batch.n_bytes
+                self._current = None
+                if success:
+                    # The collector is reachable again, drain the queue without waiting
+                    self._backoff = self._initial_backoff
+                    self._next_attempt = time.monotonic()
+                else:
+                    self._next_attempt = time.monotonic() + self._backoff
+                    self._backoff = min(self._backoff * 2, self._max_backoff)
+
+            if finished:
+                if not success:
+                    logging.error("Dropping a %s batch after %d export attempts", self._exporting, batch.attempts)
+                self._done(batch, success)
+            elif kept:
+                self._keep([batch])
+            with self._condition:
+                self._retrying = False
+                self._condition.notify_all()
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._batches)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until all queued batches are exported or dropped, return False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._batches or self._retrying:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def shutdown(self, timeout: Optional[float] = None, interrupt: Optional[Callable[[], None]] = None) -> None:
+        """Wait for the queued batches up to timeout seconds, then keep the
+        remaining ones in the journal. interrupt is called on timeout to stop
+        the export in progress, which is otherwise left to finish on its own."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        exported = self.wait(timeout)
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if not exported and interrupt is not None:
+            interrupt()
+        self._thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+        with self._condition:
+            # The batch being exported is kept by the retry thread once the export returns
+            remaining = [batch for batch in self._batches if batch is not self._current]
+            self._batches = deque(batch for batch in self._batches if batch is self._current)
+        self._keep(remaining)
+
+    def _keep(self, batches: List[_Batch]) -> None:
+        """Leave batches in the journal for the next replay, or drop them without journal"""
+        n_kept = 0
+        for batch in batches:
+            if batch.payloads is not None:
+                try:
+                    self._spill(batch)
+                except OSError:
+                    logging.exception("Unable to write %s to the retry journal", self._exporting)
+            if batch.journal_path is not None:
+                # Release the file for the next replay, renamed so that the
+                # batches are exported again in the order they were queued
+                try:
+                    os.rename(batch.journal_path,
+                              batch.journal_path.parent / (self._journal_name() + _JOURNAL_SUFFIX))
+                    n_kept += 1
+                except OSError:
+                    logging.exception("Unable to release the retry journal file %s", batch.journal_path)
+            if batch.on_done is not None:
+                batch.on_done(False)
+        if n_kept:
+            logging.warning("%d %s batches left in the retry journal %s", n_kept, self._exporting, self._journal_dir)
+        elif batches:
+            logging.error("Dropping %d %s batches that could not be exported", len(batches), self._exporting)
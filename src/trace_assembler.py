@@ -0,0 +1,183 @@
+"""
+trace_assembler.py
+
+Hold the replayed spans back until their trace is complete, so that the spans
+of a trace are exported together to tail sampling collectors and backends.
+
+A trace is complete once its root span has been seen along with the parent of
+every span. Since spans are recorded when they end, this is usually when the
+root span arrives. Traces are also released, incomplete, once they have waited
+for a window of CTF time, and the oldest ones are evicted early when too many
+traces or bytes are held, which bounds the memory used. Serialized
+ResourceSpans that cannot be parsed are passed through unassembled, for the
+exporter to report them.
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Set, Tuple
+
+from google.protobuf.message import DecodeError
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
+
+from fanout import split_resource_spans
+from otlp_raw import iter_span_ids
+
+DEFAULT_MAX_PENDING_TRACES = 10_000
+DEFAULT_MAX_PENDING_BYTES = 256 * 1024 * 1024
+
+# Approximate memory used to track the ids of a span, on top of its payload
+_SPAN_OVERHEAD_BYTES = 128
+
+
+def _iter_span_ids(item) -> Iterator[Tuple[bytes, bytes, bytes]]:
+    if isinstance(item, bytes):
+        return iter_span_ids(item)
+    return ((span.trace_id, span.span_id, span.parent_span_id)
+            for scope in item.scope_spans for span in scope.spans)
+
+
+class _Trace:
+    """Spans of a trace waiting to be exported"""
+
+    def __init__(self, timestamp: Optional[int]):
+        self.first_timestamp = timestamp
+        self.arrival_time = time.monotonic()
+        self.parts: List[Tuple[object, int, int]] = []
+        self.n_bytes = 0
+        self.has_root = False
+        self.span_ids: Set[bytes] = set()
+        # Parents referenced by the spans but not received yet
+        self.missing_parents: Set[bytes] = set()
+
+    def add_span(self, span_id: bytes, parent_span_id: bytes) -> None:
+        self.span_ids.add(span_id)
+        self.missing_parents.discard(span_id)
+        if not parent_span_id:
+            self.has_root = True
+        elif parent_span_id not in self.span_ids:
+            self.missing_parents.add(parent_span_id)
+        self.n_bytes += _SPAN_OVERHEAD_BYTES
+
+    @property
+    def complete(self) -> bool:
+        return self.has_root and not self.missing_parents
+
+
+class TraceAssembler:
+    """Group the replayed ResourceSpans by trace
+    Args:
+        window_millis: Maximum CTF time a trace waits for its missing spans
+        max_pending_traces: Maximum number of traces held at once
+        max_pending_bytes: Maximum size of the telemetry data held at once
+    """
+
+    def __init__(self, window_millis: float, max_pending_traces: int = DEFAULT_MAX_PENDING_TRACES,
+                 max_pending_bytes: int = DEFAULT_MAX_PENDING_BYTES):
+        self._window = int(window_millis * 1e6)
+        self._max_pending_traces = max(1, max_pending_traces)
+        self._max_pending_bytes = max_pending_bytes
+        # Traces in order of arrival of their first span
+        self._traces: "OrderedDict[bytes, _Trace]" = OrderedDict()
+        self._n_bytes = 0
+        self.n_completed = 0
+        self.n_timed_out = 0
+        self.n_evicted = 0
+        self.n_invalid = 0
+
+    def add(self, item, size: int, timestamp: Optional[int] = None) -> List[Tuple[object, int, int]]:
+        """Hold a replayed ResourceSpans, serialized or not, received at a
+        timestamp in ns. Return the ResourceSpans to export, each one with its
+        size and the number of replayed ResourceSpans it accounts for."""
+        try:
+            spans = list(_iter_span_ids(item))
+            trace_ids = {trace_id for trace_id, _, _ in spans}
+            if len(trace_ids) == 1:
+                parts = {trace_ids.pop(): (item, size)}
+            elif trace_ids:
+                # Spans of several traces, each trace gets its own copy of the resource
+                serialized = isinstance(item, bytes)
+                resource = ResourceSpans.FromString(item) if serialized else item
+                parts = {}
+                for trace_id, part in split_resource_spans(resource, lambda trace_id: trace_id).items():
+                    if serialized:
+                        payload = part.SerializeToString()
+                        parts[trace_id] = (payload, len(payload))
+                    else:
+                        parts[trace_id] = (part, part.ByteSize())
+            else:
+                return [(item, size, 1)]
+        except DecodeError:
+            # Not validated in pass-through mode
+            self.n_invalid += 1
+            return [(item, size, 1)]
+
+        output: List[Tuple[object, int, int]] = []
+        # The replayed ResourceSpans is accounted for by its first part
+        n_items = 1
+        for trace_id, (part, part_size) in parts.items():
+            if not trace_id:
+                # Spans without trace cannot be grouped
+                output.append((part, part_size, n_items))
+            else:
+                trace = self._traces.get(trace_id)
+                if trace is None:
+                    trace = self._traces[trace_id] = _Trace(timestamp)
+                trace.parts.append((part, part_size, n_items))
+                trace.n_bytes += part_size
+                self._n_bytes += part_size
+            n_items = 0
+        for trace_id, span_id, parent_span_id in spans:
+            trace = self._traces.get(trace_id)
+            if trace is not None:
+                trace.add_span(span_id, parent_span_id)
+                self._n_bytes += _SPAN_OVERHEAD_BYTES
+
+        for trace_id in parts:
+            trace = self._traces.get(trace_id)
+            if trace is not None and trace.complete:
+                self.n_completed += 1
+                output.extend(self._release(trace_id))
+
+        if timestamp is not None:
+            while self._traces:
+                oldest_id, oldest = next(iter(self._traces.items()))
+                if oldest.first_timestamp is not None and oldest.first_timestamp + self._window > timestamp:
+                    break
+                self.n_timed_out += 1
+                output.extend(self._release(oldest_id))
+        while self._traces and (len(self._traces) > self._max_pending_traces
+                                or self._n_bytes > self._max_pending_bytes):
+            self.n_evicted += 1
+            output.extend(self._release(next(iter(self._traces))))
+        return output
+
+    def _release(self, trace_id: bytes) -> List[Tuple[object, int, int]]:
+        trace = self._traces.pop(trace_id)
+        self._n_bytes -= trace.n_bytes
+        return trace.parts
+
+    def flush_expired(self) -> List[Tuple[object, int, int]]:
+        """Release the traces held for longer than the window in wall clock
+        time, when no new span arrives to move the CTF time forward"""
+        output: List[Tuple[object, int, int]] = []
+        deadline = time.monotonic() - self._window / 1e9
+        while self._traces and next(iter(self._traces.values())).arrival_time <= deadline:
+            self.n_timed_out += 1
+            output.extend(self._release(next(iter(self._traces))))
+        return output
+
+    def flush(self) -> List[Tuple[object, int, int]]:
+        """Release all the traces held"""
+        output: List[Tuple[object, int, int]] = []
+        while self._traces:
+            output.extend(self._release(next(iter(self._traces))))
+        return output
+
+    def report(self) -> None:
+        """Log how the traces were released"""
+        if self.n_timed_out or self.n_evicted:
+            logging.info("Assembled %d complete traces, %d timed out, %d evicted to bound the memory.",
+                         self.n_completed, self.n_timed_out, self.n_evicted)
+        if self.n_invalid:
+            logging.warning("%d invalid ResourceSpans were exported without being assembled.", self.n_invalid)
@@ -0,0 +1,27 @@
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
+
+from coalescer import coalesce
+
+
+def make_resource_spans(service: str, scope: str, span: str) -> ResourceSpans:
+    resource_spans = ResourceSpans()
+    resource_spans.resource.attributes.add(key="service.name").value.string_value = service
+    scope_spans = resource_spans.scope_spans.add()
+    scope_spans.scope.name = scope
+    scope_spans.spans.add(name=span)
+    return resource_spans
+
+
+def test_coalesce():
+    merged = coalesce([
+        make_resource_spans("a", "x", "1"),
+        make_resource_spans("b", "x", "2"),
+        make_resource_spans("a", "y", "3"),
+        make_resource_spans("a", "x", "4"),
+    ])
+    assert [(resource.resource.attributes[0].value.string_value,
+             [(scope.scope.name, [span.name for span in scope.spans]) for scope in resource.scope_spans])
+            for resource in merged] == [
+        ("a", [("x", ["1", "4"]), ("y", ["3"])]),
+        ("b", [("x", ["2"])]),
+    ]
@@ -0,0 +1,56 @@
+import pytest
+from google.protobuf.message import DecodeError
+from opentelemetry.proto.logs.v1.logs_pb2 import ResourceLogs
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
+
+from event_filter import EventFilter, resource_service_name
+
+MALFORMED = b"\x0a\x50abc"
+
+
+def make_resource_spans(service: str, trace_ids) -> ResourceSpans:
+    resource_spans = ResourceSpans()
+    resource_spans.resource.attributes.add(key="service.name").value.string_value = service
+    scope_spans = resource_spans.scope_spans.add()
+    for trace_id in trace_ids:
+        scope_spans.spans.add(trace_id=trace_id, span_id=b"s" * 8)
+    return resource_spans
+
+
+def test_service_name():
+    payload = make_resource_spans("checkout", []).SerializeToString()
+    assert resource_service_name(payload) == "checkout"
+    event_filter = EventFilter(service_names=["checkout"])
+    assert event_filter.accepts_payload(payload)
+    assert not event_filter.accepts_payload(make_resource_spans("cart", []).SerializeToString())
+
+
+def test_time_range():
+    event_filter = EventFilter(begin=1.0, end=2.0)
+    assert not event_filter.accepts_timestamp(999_999_999)
+    assert event_filter.accepts_timestamp(1_500_000_000)
+    assert not event_filter.accepts_timestamp(2_000_000_001)
+
+
+def test_sampling_by_trace_id():
+    kept_trace = (0).to_bytes(16, "big")
+    dropped_trace = (2 ** 64 - 1).to_bytes(16, "big")
+    event_filter = EventFilter(trace_id_ratio=0.5)
+    sampled = event_filter.sample_item(
+        make_resource_spans("a", [kept_trace, dropped_trace]).SerializeToString(), ResourceSpans)
+    assert [span.trace_id for span in ResourceSpans.FromString(sampled).scope_spans[0].spans] == [kept_trace]
+    assert event_filter.sample_item(make_resource_spans("a", [dropped_trace]), ResourceSpans) is None
+    # Logs without trace id are kept
+    resource_logs = ResourceLogs()
+    resource_logs.scope_logs.add().log_records.add(body={"string_value": "log"})
+    assert event_filter.sample_item(resource_logs, ResourceLogs) is resource_logs
+
+
+def test_malformed_payload():
+    with pytest.raises(DecodeError):
+        EventFilter(service_names=["checkout"]).accepts_payload(MALFORMED)
+    with pytest.raises(DecodeError):
+        EventFilter(trace_id_ratio=0.5).sample_item(MALFORMED, ResourceSpans)
+    # Nothing is parsed without service names nor sampling
+    assert EventFilter().accepts_payload(MALFORMED)
+    assert EventFilter().sample_item(MALFORMED, ResourceSpans) == MALFORMED
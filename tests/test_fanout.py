@@ -0,0 +1,56 @@
+import threading
+import time
+from typing import List
+
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
+
+from fanout import FanOutEngine
+
+
+class FakeEngine:
+    """Engine with a single request in flight, slow to export for the "slow" endpoint"""
+
+    def __init__(self, endpoint: str, on_export):
+        self.endpoint = endpoint
+        self.on_export = on_export
+        self.exporting = "traces"
+        self.received: List[ResourceSpans] = []
+        self._window = threading.Semaphore(1)
+
+    def submit(self, batch, callback, block: bool = True) -> bool:
+        if not self._window.acquire(blocking=block):
+            return False
+
+        def export():
+            time.sleep(0.05 if self.endpoint == "slow" else 0.001)
+            self.received.extend(batch)
+            callback(batch, True)
+            self._window.release()
+
+        threading.Thread(target=export).start()
+        return True
+
+    def wait(self):
+        self._window.acquire()
+        self._window.release()
+
+
+def test_full_window_keeps_traces_on_their_collector():
+    engine = FanOutEngine(FakeEngine, ["slow", "a", "b"], by_trace_id=True)
+    results = []
+    for batch_index in range(10):
+        resource_spans = ResourceSpans()
+        scope_spans = resource_spans.scope_spans.add()
+        for trace_index in range(8):
+            scope_spans.spans.add(trace_id=bytes([trace_index]) * 16, span_id=bytes([batch_index]) * 8)
+        engine.submit([resource_spans], lambda _, success: results.append(success))
+    engine.wait()
+    collectors = {}
+    for collector in engine._engines:  # pylint: disable=protected-access
+        for resource_spans in collector.received:
+            for scope_spans in resource_spans.scope_spans:
+                for span in scope_spans.spans:
+                    collectors.setdefault(span.trace_id, set()).add(collector.endpoint)
+    assert results == [True] * 10
+    assert len(collectors) == 8
+    assert all(len(endpoints) == 1 for endpoints in collectors.values())
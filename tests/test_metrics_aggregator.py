@@ -0,0 +1,123 @@
+from opentelemetry.proto.metrics.v1.metrics_pb2 import (
+    AGGREGATION_TEMPORALITY_CUMULATIVE, AGGREGATION_TEMPORALITY_DELTA,
+    ResourceMetrics)
+from opentelemetry.proto.metrics.v1.metrics_pb2 import \
+    AggregationTemporality as ProtoTemporality
+from opentelemetry.sdk.metrics import Counter, Histogram
+from opentelemetry.sdk.metrics.export import AggregationTemporality
+
+from metrics_aggregator import MetricsAggregator
+
+WINDOW_NS = 1_000_000_000
+
+
+def make_sum(time_ns: int, value: int, temporality: "ProtoTemporality.V", start_ns: int = 0,
+             attribute: str = "a") -> ResourceMetrics:
+    resource_metrics = ResourceMetrics()
+    metric = resource_metrics.scope_metrics.add().metrics.add(name="requests")
+    metric.sum.aggregation_temporality = temporality
+    metric.sum.is_monotonic = True
+    data_point = metric.sum.data_points.add(start_time_unix_nano=start_ns, time_unix_nano=time_ns, as_int=value)
+    data_point.attributes.add(key="key").value.string_value = attribute
+    return resource_metrics
+
+
+def make_histogram(time_ns: int, count: int, bucket_counts, temporality: "ProtoTemporality.V") -> ResourceMetrics:
+    resource_metrics = ResourceMetrics()
+    metric = resource_metrics.scope_metrics.add().metrics.add(name="latency")
+    metric.histogram.aggregation_temporality = temporality
+    metric.histogram.data_points.add(time_unix_nano=time_ns, count=count, sum=float(count),
+                                     bucket_counts=bucket_counts, explicit_bounds=[1.0])
+    return resource_metrics
+
+
+def points(output):
+    return [(data.aggregation_temporality, data_point)
+            for resource_metrics, _ in output
+            for scope_metrics in resource_metrics.scope_metrics
+            for metric in scope_metrics.metrics
+            for data in [getattr(metric, metric.WhichOneof("data"))]
+            for data_point in data.data_points]
+
+
+def replay(aggregator, resources):
+    output = []
+    for resource_metrics in resources:
+        output.extend(aggregator.add(resource_metrics))
+    return output + aggregator.flush()
+
+
+def test_cumulative_to_delta():
+    aggregator = MetricsAggregator(1000, {Counter: AggregationTemporality.DELTA})
+    output = replay(aggregator, [
+        make_sum(0, 10, AGGREGATION_TEMPORALITY_CUMULATIVE),
+        make_sum(WINDOW_NS // 2, 15, AGGREGATION_TEMPORALITY_CUMULATIVE),
+        make_sum(WINDOW_NS, 40, AGGREGATION_TEMPORALITY_CUMULATIVE),
+    ])
+    assert [(temporality, point.as_int) for temporality, point in points(output)] == [
+        (AGGREGATION_TEMPORALITY_DELTA, 15), (AGGREGATION_TEMPORALITY_DELTA, 25)]
+    # Consecutive deltas cover adjacent intervals
+    assert points(output)[1][1].start_time_unix_nano == points(output)[0][1].time_unix_nano
+
+
+def test_delta_to_cumulative():
+    aggregator = MetricsAggregator(1000, {Counter: AggregationTemporality.CUMULATIVE})
+    output = replay(aggregator, [
+        make_sum(0, 10, AGGREGATION_TEMPORALITY_DELTA),
+        make_sum(WINDOW_NS, 5, AGGREGATION_TEMPORALITY_DELTA),
+        make_sum(2 * WINDOW_NS, 7, AGGREGATION_TEMPORALITY_DELTA),
+    ])
+    assert [(temporality, point.as_int) for temporality, point in points(output)] == [
+        (AGGREGATION_TEMPORALITY_CUMULATIVE, 10), (AGGREGATION_TEMPORALITY_CUMULATIVE, 15),
+        (AGGREGATION_TEMPORALITY_CUMULATIVE, 22)]
+
+
+def test_cumulative_reset():
+    aggregator = MetricsAggregator(1000, {Counter: AggregationTemporality.DELTA})
+    output = replay(aggregator, [
+        make_sum(0, 10, AGGREGATION_TEMPORALITY_CUMULATIVE),
+        make_sum(WINDOW_NS, 30, AGGREGATION_TEMPORALITY_CUMULATIVE),
+        # The source restarted, its counter starts over
+        make_sum(2 * WINDOW_NS, 4, AGGREGATION_TEMPORALITY_CUMULATIVE, start_ns=2 * WINDOW_NS),
+    ])
+    assert [point.as_int for _, point in points(output)] == [10, 20, 4]
+
+
+def test_histogram_cumulative_to_delta():
+    aggregator = MetricsAggregator(1000, {Histogram: AggregationTemporality.DELTA})
+    output = replay(aggregator, [
+        make_histogram(0, 3, [1, 2], AGGREGATION_TEMPORALITY_CUMULATIVE),
+        make_histogram(WINDOW_NS, 10, [4, 6], AGGREGATION_TEMPORALITY_CUMULATIVE),
+    ])
+    assert [(point.count, list(point.bucket_counts)) for _, point in points(output)] == [(3, [1, 2]), (7, [3, 4])]
+
+
+def test_points_folded_within_window():
+    aggregator = MetricsAggregator(1000, {Counter: AggregationTemporality.DELTA})
+    output = replay(aggregator, [make_sum(index, 1, AGGREGATION_TEMPORALITY_DELTA) for index in range(5)])
+    assert [point.as_int for _, point in points(output)] == [5]
+    # All the replayed ResourceMetrics are accounted for
+    assert sum(n_items for _, n_items in output) == 5
+
+
+def test_idle_streams_forgotten():
+    aggregator = MetricsAggregator(1000, {}, max_idle_windows=2)
+    for index in range(5):
+        aggregator.add(make_sum(index * WINDOW_NS, 1, AGGREGATION_TEMPORALITY_DELTA, attribute=str(index)))
+    aggregator.flush()
+    # Streams idle for more than 2 windows are forgotten
+    assert len(aggregator._streams) == 3  # pylint: disable=protected-access
+
+
+def test_passthrough_metrics_share_their_scope():
+    resource_metrics = ResourceMetrics()
+    scope_metrics = resource_metrics.scope_metrics.add()
+    scope_metrics.scope.name = "scope"
+    for name in ("summary", "exponential"):
+        scope_metrics.metrics.add(name=f"{name}-a").summary.data_points.add(time_unix_nano=1)
+        scope_metrics.metrics.add(name=f"{name}-b").exponential_histogram.data_points.add(time_unix_nano=1)
+    aggregator = MetricsAggregator(1000, {})
+    [(passthrough, n_items)] = aggregator.add(resource_metrics)
+    assert n_items == 1
+    assert len(passthrough.scope_metrics) == 1
+    assert len(passthrough.scope_metrics[0].metrics) == 4
@@ -0,0 +1,42 @@
+import pytest
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
+from opentelemetry.sdk.trace.export import SpanExportResult
+
+from otlp_file import (OTLPFileExporter, OTLPFileWriter, file_signal,
+                       iter_file_requests)
+from otlp_raw import decode_request
+
+
+def make_resource_spans(name: str) -> ResourceSpans:
+    resource_spans = ResourceSpans()
+    resource_spans.scope_spans.add().spans.add(trace_id=b"t" * 16, span_id=b"s" * 8, name=name)
+    return resource_spans
+
+
+@pytest.mark.parametrize("file_format", ["proto", "json"])
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+def test_round_trip(tmp_path, file_format, compression):
+    writer = OTLPFileWriter(tmp_path, "traces", file_format, compression, max_file_bytes=100)
+    exporter = OTLPFileExporter(writer, "traces")
+    resources = [make_resource_spans(f"span-{index}") for index in range(5)]
+    for resource in resources:
+        assert exporter.export([resource]) == SpanExportResult.SUCCESS
+    exporter.export_serialized([resources[0].SerializeToString()])
+    exporter.shutdown()
+
+    # Files are rotated past max_file_bytes
+    assert len(writer.paths) > 1
+    requests = [request for path in writer.paths for request in iter_file_requests(path, "traces")]
+    assert all(file_signal(path) == "traces" for path in writer.paths)
+    assert [ResourceSpans.FromString(payload) for request in requests
+            for payload in decode_request(request)] == resources + resources[:1]
+
+
+def test_failed_write_reported(tmp_path):
+    # The output folder cannot be created under a file
+    (tmp_path / "file").touch()
+    exporter = OTLPFileExporter(OTLPFileWriter(tmp_path / "file", "traces"), "traces")
+    failed = []
+    payloads = [make_resource_spans("span").SerializeToString()]
+    assert exporter.export_serialized(payloads, failed) == SpanExportResult.FAILURE
+    assert failed == payloads
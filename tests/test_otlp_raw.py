@@ -0,0 +1,70 @@
+import pytest
+from google.protobuf.message import DecodeError
+from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import \
+    ExportTraceServiceRequest
+from opentelemetry.proto.metrics.v1.metrics_pb2 import ResourceMetrics
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
+
+from otlp_raw import (count_payload_items, decode_request, decode_varint,
+                      encode_request, encode_varint, iter_span_ids,
+                      repeated_field_size, validate_resource_payload,
+                      varint_size)
+
+
+def make_resource_spans(*spans) -> ResourceSpans:
+    resource_spans = ResourceSpans()
+    resource_spans.resource.attributes.add(key="service.name").value.string_value = "service"
+    scope_spans = resource_spans.scope_spans.add()
+    for trace_id, span_id, parent_span_id in spans:
+        scope_spans.spans.add(trace_id=trace_id, span_id=span_id, parent_span_id=parent_span_id, name="span")
+    return resource_spans
+
+
+@pytest.mark.parametrize("value", [0, 1, 127, 128, 300, 2 ** 32, 2 ** 63])
+def test_varint_round_trip(value):
+    encoded = encode_varint(value)
+    assert len(encoded) == varint_size(value)
+    assert decode_varint(encoded, 0) == (value, len(encoded))
+
+
+def test_truncated_varint():
+    with pytest.raises(DecodeError):
+        decode_varint(b"\x80\x80", 0)
+
+
+def test_encode_request_matches_protobuf():
+    resources = [make_resource_spans((b"t" * 16, b"s" * 8, b"")),
+                 make_resource_spans((b"u" * 16, b"r" * 8, b"p" * 8))]
+    payloads = [resource.SerializeToString() for resource in resources]
+    request = encode_request(payloads)
+    assert request == ExportTraceServiceRequest(resource_spans=resources).SerializeToString()
+    assert len(request) == sum(repeated_field_size(len(payload)) for payload in payloads)
+    assert decode_request(request) == payloads
+
+
+def test_iter_span_ids():
+    spans = [(b"t" * 16, b"a" * 8, b""), (b"t" * 16, b"b" * 8, b"a" * 8)]
+    payload = make_resource_spans(*spans).SerializeToString()
+    assert list(iter_span_ids(payload)) == spans
+
+
+def test_iter_span_ids_malformed():
+    with pytest.raises(DecodeError):
+        list(iter_span_ids(b"\x12\x03\x12\x01\xff"))
+
+
+def test_validate_resource_payload():
+    assert validate_resource_payload(make_resource_spans((b"t" * 16, b"a" * 8, b"")).SerializeToString())
+    assert not validate_resource_payload(b"\x0a\x50abc")
+
+
+def test_count_payload_items():
+    spans = [(b"t" * 16, bytes([index]) * 8, b"") for index in range(3)]
+    assert count_payload_items(make_resource_spans(*spans).SerializeToString()) == 3
+    resource_metrics = ResourceMetrics()
+    scope_metrics = resource_metrics.scope_metrics.add()
+    scope_metrics.metrics.add(name="sum").sum.data_points.add(as_int=1)
+    histogram = scope_metrics.metrics.add(name="histogram").histogram
+    histogram.data_points.add(count=1)
+    histogram.data_points.add(count=2)
+    assert count_payload_items(resource_metrics.SerializeToString(), metrics=True) == 3
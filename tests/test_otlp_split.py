@@ -0,0 +1,97 @@
+import pytest
+from google.protobuf.message import DecodeError
+from opentelemetry.proto.metrics.v1.metrics_pb2 import (
+    AGGREGATION_TEMPORALITY_CUMULATIVE, ResourceMetrics)
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
+
+from otlp_raw import encode_request, repeated_field_size
+from otlp_split import count_items, split_resources, split_serialized
+
+
+def make_resource_spans(service: str, n_spans: int) -> ResourceSpans:
+    resource_spans = ResourceSpans()
+    resource_spans.resource.attributes.add(key="service.name").value.string_value = service
+    scope_spans = resource_spans.scope_spans.add()
+    scope_spans.scope.name = "scope"
+    for index in range(n_spans):
+        scope_spans.spans.add(trace_id=bytes(16), span_id=index.to_bytes(8, "big"), name=f"span-{index}")
+    return resource_spans
+
+
+def make_resource_metrics(n_points: int) -> ResourceMetrics:
+    resource_metrics = ResourceMetrics()
+    metric = resource_metrics.scope_metrics.add().metrics.add(name="counter")
+    metric.sum.aggregation_temporality = AGGREGATION_TEMPORALITY_CUMULATIVE
+    metric.sum.is_monotonic = True
+    for index in range(n_points):
+        metric.sum.data_points.add(time_unix_nano=index, as_int=index)
+    return resource_metrics
+
+
+def span_names(resources):
+    return [span.name for resource in resources for scope in resource.scope_spans for span in scope.spans]
+
+
+def request_bytes(resources) -> int:
+    return sum(repeated_field_size(resource.ByteSize()) for resource in resources)
+
+
+def test_split_by_items():
+    resources = [make_resource_spans("a", 5), make_resource_spans("b", 4)]
+    chunks = list(split_resources(resources, max_items=3))
+    assert [count_items(chunk) for chunk in chunks] == [3, 3, 3]
+    assert span_names(resource for chunk in chunks for resource in chunk) == span_names(resources)
+
+
+@pytest.mark.parametrize("max_bytes", [60, 100, 250, 1000])
+def test_split_by_bytes(max_bytes):
+    resources = [make_resource_spans("a", 7), make_resource_spans("b", 9)]
+    chunks = list(split_resources(resources, max_bytes=max_bytes))
+    for chunk in chunks:
+        # Only a chunk holding a single span may exceed the limit
+        assert request_bytes(chunk) <= max_bytes or count_items(chunk) == 1
+    assert span_names(resource for chunk in chunks for resource in chunk) == span_names(resources)
+
+
+def test_split_metric_data_points():
+    resources = [make_resource_metrics(10)]
+    chunks = list(split_resources(resources, max_items=4))
+    assert [count_items(chunk) for chunk in chunks] == [4, 4, 2]
+    metric = chunks[1][0].scope_metrics[0].metrics[0]
+    assert metric.name == "counter" and metric.sum.is_monotonic
+    assert [point.as_int for point in metric.sum.data_points] == [4, 5, 6, 7]
+
+
+def test_split_serialized_keeps_order():
+    small = make_resource_spans("small", 1).SerializeToString()
+    large = make_resource_spans("large", 20).SerializeToString()
+    max_bytes = len(large) // 2
+    chunks = list(split_serialized([small, large, small], ResourceSpans, max_bytes=max_bytes))
+    assert chunks[0] == [small]
+    assert chunks[-1] == [small]
+    for chunk in chunks:
+        assert len(encode_request(chunk)) <= max_bytes
+    names = span_names(ResourceSpans.FromString(payload) for chunk in chunks for payload in chunk)
+    assert names == span_names([make_resource_spans("small", 1), make_resource_spans("large", 20),
+                                make_resource_spans("small", 1)])
+
+
+def test_split_serialized_malformed():
+    # Resource field longer than the payload
+    malformed = b"\x0a\x7f" + b"x" * 60
+    with pytest.raises(DecodeError):
+        list(split_serialized([malformed], ResourceSpans, max_bytes=50))
+    invalid = []
+    small = make_resource_spans("small", 1).SerializeToString()
+    assert list(split_serialized([malformed, small], ResourceSpans, max_bytes=50, invalid=invalid)) == [[small]]
+    assert invalid == [malformed]
+
+
+def test_split_serialized_by_items():
+    small = [make_resource_spans(name, 2).SerializeToString() for name in ("a", "b", "c")]
+    assert list(split_serialized(small, ResourceSpans, max_items=4)) == [small[:2], small[2:]]
+    large = make_resource_spans("large", 6).SerializeToString()
+    chunks = list(split_serialized([large], ResourceSpans, max_items=4))
+    assert [count_items([ResourceSpans.FromString(payload) for payload in chunk]) for chunk in chunks] == [4, 2]
+    metrics = [make_resource_metrics(3).SerializeToString()] * 2
+    assert len(list(split_serialized(metrics, ResourceMetrics, max_items=4))) == 2
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import time
+from typing import List
+
+from replay_sinks import EngineSink
+
+
+class FakeEngine:
+    """Engine exporting from a thread, failing the batches holding "fail" """
+
+    def __init__(self, flushed: bool = True):
+        self.received: List[str] = []
+        self.flush_timeouts: List[float] = []
+        self.shutdown_timeouts: List[float] = []
+        self._flushed = flushed
+
+    def submit(self, batch, callback) -> None:
+        self.received.extend(batch)
+
+        def export():
+            time.sleep(0.01)
+            callback(batch, "fail" not in batch)
+
+        threading.Thread(target=export).start()
+
+    def force_flush(self, timeout=None) -> bool:
+        self.flush_timeouts.append(timeout)
+        return self._flushed
+
+    def shutdown(self, timeout=None) -> None:
+        self.shutdown_timeouts.append(timeout)
+
+
+def test_batches_are_exported_in_the_background():
+    engine = FakeEngine()
+    sink = EngineSink({"traces": engine}, shutdown_timeout=3)
+
+    async def replay():
+        futures = [await sink.submit("traces", [str(index)], False) for index in range(5)]
+        # Handed over before being exported
+        assert not any(future.done() for future in futures)
+        results = await asyncio.gather(*futures)
+        failed = await sink.export("traces", ["fail"], False)
+        await sink.shutdown()
+        return results, failed
+
+    results, failed = asyncio.run(replay())
+    assert results == [True] * 5
+    assert not failed
+    assert engine.received == ["0", "1", "2", "3", "4", "fail"]
+    assert engine.shutdown_timeouts == [3]
+
+
+def test_flush_waits_for_every_engine():
+    engines = {"traces": FakeEngine(), "logs": FakeEngine(flushed=False)}
+    sink = EngineSink(engines)
+    assert not asyncio.run(sink.flush(0.5))
+    assert [engine.flush_timeouts for engine in engines.values()] == [[0.5], [0.5]]
@@ -0,0 +1,45 @@
+from opentelemetry.proto.metrics.v1.metrics_pb2 import (
+    AGGREGATION_TEMPORALITY_CUMULATIVE, ResourceMetrics)
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
+
+from replay_stages import MetricsAggregationStage, TraceAssemblyStage
+
+
+def make_sum(time_ns: int, value: int) -> ResourceMetrics:
+    resource_metrics = ResourceMetrics()
+    metric = resource_metrics.scope_metrics.add().metrics.add(name="requests")
+    metric.sum.aggregation_temporality = AGGREGATION_TEMPORALITY_CUMULATIVE
+    metric.sum.is_monotonic = True
+    metric.sum.data_points.add(time_unix_nano=time_ns, as_int=value)
+    return resource_metrics
+
+
+def test_folded_metrics_account_for_all_replayed_ones():
+    stage = MetricsAggregationStage(1000, {})
+    assert stage.add(make_sum(1, 1), 0, 1) == []
+    assert stage.add(make_sum(2, 2), 0, 2) == []
+    # Nothing to fold in this one
+    assert stage.add(ResourceMetrics(), 0, 3) == []
+    output = stage.flush()
+    assert len(output) == 1
+    resource_metrics, size, n_items = output[0]
+    assert size == resource_metrics.ByteSize()
+    assert n_items == 3
+    assert stage.flush() == []
+
+
+def test_metrics_without_data_points_are_accounted_for():
+    stage = MetricsAggregationStage(1000, {})
+    assert stage.add(ResourceMetrics(), 0, 1) == []
+    assert stage.flush() == [(None, 0, 1)]
+
+
+def test_spans_are_released_with_their_trace():
+    stage = TraceAssemblyStage(1000)
+    child = ResourceSpans()
+    child.scope_spans.add().spans.add(trace_id=b"a" * 16, span_id=b"child", parent_span_id=b"root")
+    root = ResourceSpans()
+    root.scope_spans.add().spans.add(trace_id=b"a" * 16, span_id=b"root")
+    assert stage.add(child, child.ByteSize(), 0) == []
+    assert stage.add(root, root.ByteSize(), 1) == [(child, child.ByteSize(), 1), (root, root.ByteSize(), 1)]
+    assert stage.flush() == []
@@ -0,0 +1,25 @@
+import logging
+
+from replay_stats import ReplayStats
+
+
+def test_reset_restarts_the_periodic_rate(caplog):
+    stats = ReplayStats()
+    stats.counters["events"] += 1000
+    stats.log_periodically(0)
+    stats.reset()
+    stats.counters["events"] += 10
+    with caplog.at_level(logging.INFO):
+        stats.log_periodically(0)
+    assert not caplog.records[-1].getMessage().startswith("-")
+
+
+def test_merge_adds_worker_statistics():
+    stats = ReplayStats()
+    worker_stats = ReplayStats()
+    worker_stats.counters["events"] += 3
+    worker_stats.record_export("traces", 5, 0.01, True)
+    stats.merge(worker_stats.to_dict())
+    stats.merge(worker_stats.to_dict())
+    assert stats.counters["events"] == 6
+    assert stats.signals["traces"].exported == 10
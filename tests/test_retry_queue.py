@@ -0,0 +1,112 @@
+import threading
+import time
+from typing import List
+
+from retry_queue import RetryQueue
+
+
+class FakeExport:
+    """Export failing the payloads in fail, recording the others"""
+
+    def __init__(self, fail=(), delay: float = 0.0):
+        self.fail = set(fail)
+        self.delay = delay
+        self.exported: List[bytes] = []
+        self.attempts = 0
+
+    def __call__(self, payloads):
+        self.attempts += 1
+        time.sleep(self.delay)
+        failed = [payload for payload in payloads if payload in self.fail]
+        self.exported.extend(payload for payload in payloads if payload not in self.fail)
+        return not failed, failed
+
+
+def wait_for(condition, timeout: float = 1.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def make_queue(export, **kwargs):
+    kwargs.setdefault("initial_backoff", 0.01)
+    kwargs.setdefault("max_backoff", 0.01)
+    return RetryQueue(export, "traces", **kwargs)
+
+
+def test_retry_until_exported():
+    export = FakeExport(fail=[b"a"])
+    queue = make_queue(export)
+    results = []
+    queue.add([b"a"], results.append)
+    time.sleep(0.05)
+    export.fail.clear()
+    assert queue.wait(1)
+    assert results == [True]
+    assert export.exported == [b"a"]
+    queue.shutdown(1)
+
+
+def test_only_failed_payloads_retried():
+    export = FakeExport(fail=[b"b"])
+    queue = make_queue(export)
+    results = []
+    queue.add([b"a", b"b", b"c"], results.append)
+    assert wait_for(lambda: export.exported)
+    export.fail.clear()
+    assert queue.wait(1)
+    assert results == [True]
+    # The payloads exported by the first attempt are not sent again
+    assert export.exported == [b"a", b"c", b"b"]
+    queue.shutdown(1)
+
+
+def test_dropped_after_max_attempts():
+    export = FakeExport(fail=[b"a"])
+    queue = make_queue(export, max_attempts=3)
+    results = []
+    queue.add([b"a"], results.append)
+    assert queue.wait(1)
+    assert results == [False]
+    # The first attempt was made before the batch was queued
+    assert export.attempts == 2
+    queue.shutdown(1)
+
+
+def test_journal_replayed(tmp_path):
+    failing = FakeExport(fail=[b"a", b"b", b"c"])
+    queue = make_queue(failing, max_bytes=2, journal_dir=tmp_path)
+    results = []
+    queue.add([b"a"], results.append)
+    # Spilled to the journal, beyond max_bytes
+    queue.add([b"b", b"c"], results.append)
+    queue.shutdown(0.05)
+    # A batch still being exported at shutdown is kept once its export returns
+    assert wait_for(lambda: len(results) == 2)
+    assert results == [False, False]
+    assert len(list((tmp_path / "traces").glob("*.req"))) == 2
+
+    export = FakeExport()
+    queue = make_queue(export, journal_dir=tmp_path)
+    assert queue.wait(1)
+    assert export.exported == [b"a", b"b", b"c"]
+    queue.shutdown(1)
+    assert not list((tmp_path / "traces").iterdir())
+
+
+def test_shutdown_bounded(tmp_path):
+    export = FakeExport(fail=[b"a"], delay=0.5)
+    queue = make_queue(export, journal_dir=tmp_path)
+    interrupted = threading.Event()
+    queue.add([b"a"], lambda success: None)
+    time.sleep(0.1)
+    start = time.monotonic()
+    queue.shutdown(0.1, interrupted.set)
+    assert time.monotonic() - start < 0.4
+    assert interrupted.is_set()
+    # The batch being exported is kept in the journal once the export returns
+    time.sleep(0.6)
+    assert len(list((tmp_path / "traces").glob("*.req"))) == 1
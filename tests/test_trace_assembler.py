@@ -0,0 +1,76 @@
+from opentelemetry.proto.trace.v1.trace_pb2 import ResourceSpans
+
+from trace_assembler import TraceAssembler
+
+TRACE_A = b"a" * 16
+TRACE_B = b"b" * 16
+
+
+def make_resource_spans(*spans) -> ResourceSpans:
+    resource_spans = ResourceSpans()
+    scope_spans = resource_spans.scope_spans.add()
+    for trace_id, span_id, parent_span_id in spans:
+        scope_spans.spans.add(trace_id=trace_id, span_id=span_id, parent_span_id=parent_span_id)
+    return resource_spans
+
+
+def add(assembler, resource_spans, timestamp=0, serialized=False):
+    item = resource_spans.SerializeToString() if serialized else resource_spans
+    return assembler.add(item, resource_spans.ByteSize(), timestamp)
+
+
+def span_ids(output, serialized=False):
+    return [span.span_id for item, _, _ in output
+            for scope in (ResourceSpans.FromString(item) if serialized else item).scope_spans
+            for span in scope.spans]
+
+
+def test_released_once_complete():
+    assembler = TraceAssembler(1000)
+    assert add(assembler, make_resource_spans((TRACE_A, b"child", b"root"))) == []
+    output = add(assembler, make_resource_spans((TRACE_A, b"root", b"")))
+    assert span_ids(output) == [b"child", b"root"]
+    # Both replayed ResourceSpans are accounted for
+    assert sum(n_items for _, _, n_items in output) == 2
+    assert assembler.n_completed == 1
+
+
+def test_waits_for_missing_parent():
+    assembler = TraceAssembler(1000)
+    assert add(assembler, make_resource_spans((TRACE_A, b"root", b""), (TRACE_A, b"leaf", b"middle"))) == []
+    output = add(assembler, make_resource_spans((TRACE_A, b"middle", b"root")))
+    assert span_ids(output) == [b"root", b"leaf", b"middle"]
+
+
+def test_split_by_trace_serialized():
+    assembler = TraceAssembler(1000)
+    output = add(assembler, make_resource_spans((TRACE_A, b"root-a", b""), (TRACE_B, b"child-b", b"root-b")),
+                 serialized=True)
+    assert span_ids(output, serialized=True) == [b"root-a"]
+    output = add(assembler, make_resource_spans((TRACE_B, b"root-b", b"")), serialized=True)
+    assert span_ids(output, serialized=True) == [b"child-b", b"root-b"]
+    assert sum(n_items for _, _, n_items in output) == 1
+
+
+def test_timed_out_in_ctf_time():
+    assembler = TraceAssembler(1000)
+    add(assembler, make_resource_spans((TRACE_A, b"child", b"root")), timestamp=0)
+    output = add(assembler, make_resource_spans((TRACE_B, b"other", b"root-b")), timestamp=2_000_000_000)
+    assert span_ids(output) == [b"child"]
+    assert assembler.n_timed_out == 1
+    assert span_ids(assembler.flush()) == [b"other"]
+
+
+def test_evicted_beyond_max_traces():
+    assembler = TraceAssembler(1000, max_pending_traces=1)
+    add(assembler, make_resource_spans((TRACE_A, b"child", b"root")))
+    output = add(assembler, make_resource_spans((TRACE_B, b"other", b"root-b")))
+    assert span_ids(output) == [b"child"]
+    assert assembler.n_evicted == 1
+
+
+def test_malformed_payload_passed_through():
+    assembler = TraceAssembler(1000)
+    malformed = b"\x12\x03\x12\x01\xff"
+    assert assembler.add(malformed, len(malformed), 0) == [(malformed, len(malformed), 1)]
+    assert assembler.n_invalid == 1